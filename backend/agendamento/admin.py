@@ -7,6 +7,7 @@ class SalaAdmin(admin.ModelAdmin):
     list_filter = ['ativa', 'capacidade']
     search_fields = ['nome', 'recursos']
     ordering = ['nome']
+    readonly_fields = ['token_calendario']
 
 @admin.register(Reserva)
 class ReservaAdmin(admin.ModelAdmin):
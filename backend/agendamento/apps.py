@@ -5,3 +5,10 @@ class AgendamentoConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'agendamento'
     verbose_name = 'Sistema de Agendamento'
+
+    def ready(self):
+        from django.db.models.signals import post_migrate
+
+        from . import busca, checks, signals  # noqa: F401
+
+        post_migrate.connect(busca.garantir_indices, sender=self)
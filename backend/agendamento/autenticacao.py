@@ -0,0 +1,170 @@
+"""
+Autenticação JWT com cache do usuário autenticado.
+
+O JWTAuthentication padrão busca o User no banco a cada requisição. Aqui
+um retrato compacto do usuário e do seu perfil fica no cache compartilhado
+(uma entrada por usuário e versão) e, para evitar desserializá-lo a cada
+requisição, também em um LRU em memória do processo.
+
+Cada usuário tem uma versão no cache compartilhado; os retratos guardados
+(nos dois níveis) levam a versão com que foram lidos do banco e só valem
+enquanto ela for a atual. Salvar ou remover o User ou o PerfilUsuario
+avança a versão (ver signals.py), o que invalida o retrato em todos os
+workers: desativar um usuário ou retirar is_staff vale na requisição
+seguinte, ao custo de uma leitura do cache compartilhado por requisição.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import PerfilUsuario
+
+# O hash da senha fica de fora do retrato; User.password é carregado sob demanda
+CAMPOS_USUARIO = [f.attname for f in User._meta.concrete_fields if f.attname != 'password']
+CAMPOS_PERFIL = [f.attname for f in PerfilUsuario._meta.concrete_fields]
+
+# Bem mais longa que a dos retratos: expirar só descarta os retratos da versão
+_TTL_VERSAO = 24 * 60 * 60
+
+_entradas = OrderedDict()
+_trava = threading.Lock()
+
+
+def _ttl():
+    return getattr(settings, 'AUTENTICACAO_CACHE_TTL', 60)
+
+
+def _tamanho_maximo():
+    return getattr(settings, 'AUTENTICACAO_CACHE_MAX', 1000)
+
+
+def _chave_versao(usuario_id):
+    return f'autenticacao:versao:{usuario_id}'
+
+
+def _chave(usuario_id, versao):
+    return f'autenticacao:{usuario_id}:v{versao}'
+
+
+def versao(usuario_id):
+    """Versão atual dos dados do usuário no cache compartilhado, criada se faltar"""
+    chave = _chave_versao(usuario_id)
+    atual = cache.get(chave)
+    if atual is None:
+        # Inicial pelo relógio: uma versão que expirou não volta a valer
+        inicial = int(time.time() * 1000)
+        cache.add(chave, inicial, _TTL_VERSAO)
+        atual = cache.get(chave, inicial)
+    return atual
+
+
+def _retratar(usuario):
+    """Valores dos campos do usuário e do perfil (ou None, se não houver)"""
+    try:
+        perfil = usuario.perfil
+    except PerfilUsuario.DoesNotExist:
+        perfil = None
+    return (
+        tuple(getattr(usuario, nome) for nome in CAMPOS_USUARIO),
+        tuple(getattr(perfil, nome) for nome in CAMPOS_PERFIL) if perfil else None,
+    )
+
+
+def _reconstruir(retrato):
+    """Instâncias novas a cada requisição, já ligadas entre si (sem consultas)"""
+    valores_usuario, valores_perfil = retrato
+    usuario = User.from_db('default', CAMPOS_USUARIO, valores_usuario)
+    perfil = None
+    if valores_perfil is not None:
+        perfil = PerfilUsuario.from_db('default', CAMPOS_PERFIL, valores_perfil)
+        PerfilUsuario.usuario.field.set_cached_value(perfil, usuario)
+    User.perfil.related.set_cached_value(usuario, perfil)
+    return usuario
+
+
+def obter(usuario_id, versao_atual):
+    """Retrato do usuário na versão atual: memória do processo, depois cache compartilhado"""
+    with _trava:
+        entrada = _entradas.get(usuario_id)
+        if entrada is not None:
+            expira_em, versao_entrada, retrato = entrada
+            if versao_entrada == versao_atual and expira_em >= time.monotonic():
+                _entradas.move_to_end(usuario_id)
+                return retrato
+            del _entradas[usuario_id]
+    retrato = cache.get(_chave(usuario_id, versao_atual))
+    if retrato is not None:
+        _guardar_no_processo(usuario_id, versao_atual, retrato)
+    return retrato
+
+
+def _guardar_no_processo(usuario_id, versao_atual, retrato):
+    with _trava:
+        _entradas[usuario_id] = (time.monotonic() + _ttl(), versao_atual, retrato)
+        _entradas.move_to_end(usuario_id)
+        while len(_entradas) > _tamanho_maximo():
+            _entradas.popitem(last=False)
+
+
+def guardar(usuario_id, versao_atual, retrato):
+    cache.set(_chave(usuario_id, versao_atual), retrato, _ttl())
+    _guardar_no_processo(usuario_id, versao_atual, retrato)
+
+
+def invalidar(usuario_id):
+    """Descarta os retratos de um usuário em todos os workers (avança a versão)"""
+    usuario_id = str(usuario_id)
+    try:
+        cache.incr(_chave_versao(usuario_id))
+    except ValueError:
+        pass  # Sem versão, nenhum retrato vale: a próxima começa do relógio
+    with _trava:
+        _entradas.pop(usuario_id, None)
+
+
+def limpar():
+    """Esvazia a memória do processo (o cache compartilhado fica como está)"""
+    with _trava:
+        _entradas.clear()
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication que reaproveita o usuário (e o perfil) entre requisições"""
+
+    def get_user(self, validated_token):
+        # Tokens revogáveis dependem do hash da senha, que não fica em cache
+        if api_settings.CHECK_REVOKE_TOKEN or _ttl() <= 0:
+            return super().get_user(validated_token)
+
+        try:
+            usuario_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+        usuario_id = str(usuario_id)
+        # Lida antes do banco: um retrato lido durante uma alteração fica na versão já superada
+        versao_atual = versao(usuario_id)
+        retrato = obter(usuario_id, versao_atual)
+        if retrato is None:
+            try:
+                usuario = (
+                    User.objects.select_related('perfil').defer('password')
+                    .get(**{api_settings.USER_ID_FIELD: usuario_id})
+                )
+            except User.DoesNotExist as e:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found") from e
+            retrato = _retratar(usuario)
+            guardar(usuario_id, versao_atual, retrato)
+
+        usuario = _reconstruir(retrato)
+        if api_settings.CHECK_USER_IS_ACTIVE and not usuario.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return usuario
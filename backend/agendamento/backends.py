@@ -0,0 +1,35 @@
+"""
+Backend de autenticação por username ou email.
+"""
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+from django.db.models import Case, Q, Value, When
+
+
+class EmailOuUsernameBackend(ModelBackend):
+    """
+    Resolve o identificador como username ou email em uma única consulta e
+    verifica a senha uma única vez. O username exato tem prioridade; entre
+    emails duplicados vale o usuário mais antigo.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+
+        user = User._default_manager.filter(
+            Q(username=username) | Q(email__iexact=username)
+        ).order_by(
+            Case(When(username=username, then=Value(0)), default=Value(1)), 'id'
+        ).first()
+
+        if user is None:
+            # Roda o hasher uma vez para que o tempo de resposta não revele
+            # que o usuário não existe (mesmo cuidado do ModelBackend)
+            User().set_password(password)
+            return None
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
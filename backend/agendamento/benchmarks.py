@@ -0,0 +1,579 @@
+"""
+Cenários de benchmark executados por `python manage.py benchmark <cenario>`.
+
+Cada cenário popula o banco de teste criado pelo comando, mede a operação
+alvo e imprime latências (p50/p99) ou vazão. Os tamanhos padrão são os
+citados nas solicitações de desempenho; use `-o chave=valor` para reduzi-los.
+"""
+import random
+import statistics
+import time as relogio
+from datetime import datetime, time, timedelta
+
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from . import disponibilidade
+from .models import Reserva, Sala
+
+CENARIOS = {}
+
+
+def cenario(nome):
+    def registrar(func):
+        CENARIOS[nome] = func
+        return func
+    return registrar
+
+
+def medir(func, repeticoes):
+    """Executa `func` `repeticoes` vezes e retorna as durações em milissegundos"""
+    amostras = []
+    for _ in range(repeticoes):
+        inicio = relogio.perf_counter()
+        func()
+        amostras.append((relogio.perf_counter() - inicio) * 1000)
+    return amostras
+
+
+def resumo(amostras):
+    ordenadas = sorted(amostras)
+    p99 = ordenadas[min(len(ordenadas) - 1, int(len(ordenadas) * 0.99))]
+    return f'p50={statistics.median(ordenadas):.2f}ms p99={p99:.2f}ms max={ordenadas[-1]:.2f}ms'
+
+
+def criar_salas(quantidade):
+    recursos = ['Projetor', 'TV', 'Lousa', 'Videoconferência']
+    Sala.objects.bulk_create(
+        Sala(
+            nome=f'Sala {i:04d}',
+            capacidade=random.choice([4, 6, 8, 10, 12, 20, 30, 50]),
+            recursos=', '.join(random.sample(recursos, random.randint(0, len(recursos)))),
+        )
+        for i in range(quantidade)
+    )
+    return list(Sala.objects.all())
+
+
+def criar_reservas_diarias(salas, usuario, inicio, dias, por_dia=4, lote=5000):
+    """Reservas sem sobreposição em horário comercial; retorna o total criado"""
+    total = 0
+    buffer = []
+    for sala in salas:
+        for d in range(dias):
+            dia = inicio.date() + timedelta(days=d)
+            if dia.weekday() >= 5:
+                continue
+            hora = timezone.make_aware(datetime.combine(dia, time(8)))
+            for _ in range(por_dia):
+                hora += timedelta(minutes=random.choice([0, 15, 30, 60]))
+                duracao = timedelta(minutes=random.choice([30, 60, 90]))
+                buffer.append(Reserva(
+                    sala=sala, usuario=usuario, titulo='Reunião',
+                    data_inicio=hora, data_fim=hora + duracao,
+                ))
+                hora += duracao
+            if len(buffer) >= lote:
+                Reserva.objects.bulk_create(buffer)
+                total += len(buffer)
+                buffer = []
+    Reserva.objects.bulk_create(buffer)
+    return total + len(buffer)
+
+
+@cenario('horarios_livres')
+def horarios_livres(stdout, salas=500, dias=365, repeticoes=20):
+    """Busca do primeiro horário livre de 1h nas próximas 2 semanas"""
+    random.seed(42)
+    usuario = User.objects.create(username='benchmark')
+    inicio = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    todas = criar_salas(salas)
+    total = criar_reservas_diarias(todas, usuario, inicio, dias)
+    stdout.write(f'{salas} salas, {total} reservas em {dias} dias')
+
+    for criterio in ('cedo', 'ajuste'):
+        def buscar():
+            desde = inicio + timedelta(days=random.randint(0, max(dias - 14, 0)))
+            candidatas = Sala.objects.filter(ativa=True, capacidade__gte=10, recursos__icontains='projetor')
+            disponibilidade.buscar_horarios_livres(
+                candidatas.only('id', 'nome', 'capacidade'),
+                desde, desde + timedelta(days=14), timedelta(hours=1),
+                time(8), time(18), participantes=10, limite=5, criterio=criterio,
+            )
+        stdout.write(f'horarios_livres criterio={criterio}: {resumo(medir(buscar, repeticoes))}')
+
+
+@cenario('paginacao')
+def paginacao(stdout, reservas=1000000, salas=200, repeticoes=20):
+    """Latência da página N com cursor (keyset) e com ?page=N (offset)"""
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory
+
+    from .paginacao import ReservaPagination
+
+    random.seed(42)
+    usuario = User.objects.create(username='benchmark')
+    todas = criar_salas(salas)
+    inicio = timezone.now() - timedelta(days=365 * 5)
+    for lote in range(0, reservas, 10000):
+        Reserva.objects.bulk_create(
+            Reserva(
+                sala=random.choice(todas), usuario=usuario, titulo='Reunião',
+                data_inicio=inicio + timedelta(minutes=n * 3),
+                data_fim=inicio + timedelta(minutes=n * 3 + 30),
+            )
+            for n in range(lote, min(lote + 10000, reservas))
+        )
+    stdout.write(f'{reservas} reservas')
+
+    fabrica = APIRequestFactory()
+    queryset = Reserva.objects.all()
+    tamanho = ReservaPagination.page_size
+    ultima = (reservas - 1) // tamanho + 1
+    for pagina in sorted({1, 10, 100, 1000, ultima // 2, ultima}):
+        def por_offset():
+            paginador = ReservaPagination()
+            paginador.paginate_queryset(queryset, Request(fabrica.get('/', {'page': pagina})))
+
+        ancora = queryset.order_by(*ReservaPagination.ordering)[(pagina - 1) * tamanho - 1] if pagina > 1 else None
+        cursor = ReservaPagination()._codificar(ancora, 'n') if ancora else None
+
+        def por_cursor():
+            paginador = ReservaPagination()
+            paginador.paginate_queryset(queryset, Request(fabrica.get('/', {'cursor': cursor} if cursor else {})))
+
+        stdout.write(f'pagina {pagina:>6}: cursor {resumo(medir(por_cursor, repeticoes))} | '
+                     f'offset {resumo(medir(por_offset, repeticoes))}')
+
+
+@cenario('login')
+def login(stdout, usuarios=1000, repeticoes=50):
+    """Vazão de AuthView.post com username e com email"""
+    from rest_framework.test import APIRequestFactory
+
+    from .views import AuthView
+
+    senha = 'senha-de-benchmark'
+    modelo = User(username='modelo')
+    modelo.set_password(senha)
+    User.objects.bulk_create(
+        User(username=f'usuario{i}', email=f'usuario{i}@empresa.com', password=modelo.password)
+        for i in range(usuarios)
+    )
+
+    fabrica = APIRequestFactory()
+    view = AuthView.as_view()
+    for campo, identificador in (('username', 'usuario{}'), ('email', 'Usuario{}@Empresa.com')):
+        def entrar():
+            i = random.randrange(usuarios)
+            resposta = view(fabrica.post('/api/auth/login/', {
+                campo: identificador.format(i), 'password': senha,
+            }, format='json'))
+            assert resposta.status_code == 200, resposta.data
+
+        amostras = medir(entrar, repeticoes)
+        vazao = 1000 / statistics.mean(amostras)
+        stdout.write(f'login por {campo}: {vazao:.1f} logins/s por processo, {resumo(amostras)}')
+
+
+@cenario('autenticacao')
+def autenticacao_jwt(stdout, repeticoes=500):
+    """GET autenticado por JWT com e sem o usuário em cache"""
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext, override_settings
+    from rest_framework.test import APIRequestFactory
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    from . import autenticacao
+    from .views import UserProfileView
+
+    usuario = User.objects.create_user('benchmark', 'benchmark@empresa.com', 'senha')
+    cabecalho = f'Bearer {AccessToken.for_user(usuario)}'
+    fabrica = APIRequestFactory()
+    view = UserProfileView.as_view()
+
+    def perfil():
+        resposta = view(fabrica.get('/api/auth/user/', HTTP_AUTHORIZATION=cabecalho))
+        assert resposta.status_code == 200, resposta.data
+
+    for rotulo, ttl in (('sem cache', 0), ('com cache', 60)):
+        autenticacao.limpar()
+        with override_settings(AUTENTICACAO_CACHE_TTL=ttl):
+            perfil()
+            with CaptureQueriesContext(connection) as consultas:
+                amostras = medir(perfil, repeticoes)
+        stdout.write(
+            f'{rotulo}: {len(consultas) / repeticoes:.1f} consultas/requisição, {resumo(amostras)}'
+        )
+
+
+@cenario('lote')
+def lote(stdout, ocorrencias=26, repeticoes=20):
+    """Semestre de reuniões semanais: POST /lote/ contra um POST por ocorrência"""
+    from rest_framework.test import APIRequestFactory, force_authenticate
+
+    from .views import ReservaViewSet
+
+    usuario = User.objects.create_user('benchmark')
+    salas = criar_salas(2 * repeticoes)
+    fabrica = APIRequestFactory()
+    criar = ReservaViewSet.as_view({'post': 'create'})
+    criar_lote = ReservaViewSet.as_view({'post': 'lote'})
+    inicio = timezone.make_aware(datetime.combine(timezone.localdate() + timedelta(days=7), time(9)))
+
+    def post(view, url, dados):
+        requisicao = fabrica.post(url, dados, format='json')
+        force_authenticate(requisicao, usuario)
+        resposta = view(requisicao)
+        assert resposta.status_code == 201, resposta.data
+
+    def individuais():
+        sala = salas.pop()
+        for semana in range(ocorrencias):
+            data_inicio = inicio + timedelta(weeks=semana)
+            post(criar, '/api/reservas/', {
+                'sala': sala.id, 'titulo': 'Daily',
+                'data_inicio': data_inicio.isoformat(),
+                'data_fim': (data_inicio + timedelta(minutes=30)).isoformat(),
+            })
+
+    def em_lote():
+        post(criar_lote, '/api/reservas/lote/', {
+            'sala': salas.pop().id, 'titulo': 'Daily',
+            'recorrencia': {
+                'data_inicio': inicio.isoformat(),
+                'data_fim': (inicio + timedelta(minutes=30)).isoformat(),
+                'frequencia': 'semanal', 'contagem': ocorrencias,
+            },
+        })
+
+    stdout.write(f'{ocorrencias} POSTs individuais: {resumo(medir(individuais, repeticoes))}')
+    stdout.write(f'POST /lote/ com {ocorrencias} ocorrências: {resumo(medir(em_lote, repeticoes))}')
+
+
+@cenario('exportacao')
+def exportacao(stdout, reservas=200000, salas=100):
+    """Tempo e pico de memória das exportações CSV/ICS consumidas por inteiro"""
+    import tracemalloc
+
+    from rest_framework.test import APIRequestFactory
+
+    from .views import ReservaViewSet
+
+    usuario = User.objects.create_user('benchmark')
+    lista = criar_salas(salas)
+    dias = max(1, reservas // (salas * 4) * 7 // 5)
+    total = criar_reservas_diarias(lista, usuario, timezone.now() - timedelta(days=dias), dias)
+    fabrica = APIRequestFactory()
+
+    for formato in ('csv', 'ics'):
+        view = ReservaViewSet.as_view({'get': f'exportar_{formato}'})
+
+        def consumir():
+            resposta = view(fabrica.get(f'/api/reservas/exportar/{formato}/'))
+            return sum(len(bloco) for bloco in resposta.streaming_content)
+
+        inicio = relogio.perf_counter()
+        tamanho = consumir()
+        duracao = relogio.perf_counter() - inicio
+        # Segunda passada só para o pico de memória (tracemalloc deixa tudo mais lento)
+        tracemalloc.start()
+        consumir()
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        stdout.write(
+            f'{formato}: {total} reservas, {tamanho / 2**20:.1f} MiB em {duracao:.2f}s, '
+            f'pico de memória {pico / 2**20:.1f} MiB'
+        )
+
+
+@cenario('calendario')
+def calendario_feed(stdout, salas=50, dias=365, repeticoes=2000):
+    """Polls do feed .ics: primeira geração, 200 vindo do cache e 304 condicional"""
+    from django.core.cache import cache
+    from django.db import connection
+    from django.test import RequestFactory
+    from django.test.utils import CaptureQueriesContext
+
+    from .views import calendario_sala
+
+    usuario = User.objects.create_user('benchmark')
+    lista = criar_salas(salas)
+    criar_reservas_diarias(lista, usuario, timezone.now() - timedelta(days=30), dias)
+    cache.clear()
+    fabrica = RequestFactory()
+
+    def poll(sala, **cabecalhos):
+        return calendario_sala(fabrica.get(f'/api/calendarios/{sala.token_calendario}.ics', **cabecalhos), sala.token_calendario)
+
+    amostras = medir(lambda: poll(lista.pop()), salas - 1)
+    stdout.write(f'geração ({dias} dias por sala): {resumo(amostras)}')
+
+    sala = lista[0]
+    etag = poll(sala)['ETag']
+    for rotulo, cabecalhos in (('200 do cache', {}), ('304', {'HTTP_IF_NONE_MATCH': etag})):
+        with CaptureQueriesContext(connection) as consultas:
+            amostras = medir(lambda: poll(sala, **cabecalhos), repeticoes)
+        vazao = 1000 / statistics.mean(amostras)
+        stdout.write(
+            f'{rotulo}: {len(consultas)} consultas em {repeticoes} polls, '
+            f'{vazao:.0f} polls/s por processo, {resumo(amostras)}'
+        )
+
+
+@cenario('transicoes')
+def transicoes(stdout, salas=200, dias=120):
+    """Tempo para avançar o status de todo o histórico vencido (pior caso: primeira execução)"""
+    from .transicoes import avancar_status
+
+    usuario = User.objects.create_user('benchmark')
+    total = criar_reservas_diarias(criar_salas(salas), usuario, timezone.now() - timedelta(days=dias), dias + 7)
+    for tamanho in (500, 5000):
+        Reserva.objects.update(status='agendada')
+        inicio = relogio.perf_counter()
+        totais = avancar_status(tamanho_lote=tamanho)
+        duracao = relogio.perf_counter() - inicio
+        alteradas = sum(totais.values())
+        stdout.write(
+            f'lote={tamanho}: {alteradas} de {total} reservas em {duracao:.2f}s '
+            f'({alteradas / duracao:.0f} reservas/s)'
+        )
+
+
+@cenario('concorrencia')
+def concorrencia(stdout, threads=16, rodadas=20):
+    """
+    `threads` reservas simultâneas do mesmo horário na mesma sala, por
+    rodada: exatamente uma deve ser criada (201) e as demais recusadas (409).
+    """
+    import threading
+
+    from django.db import connection
+    from rest_framework.test import APIRequestFactory, force_authenticate
+
+    from .views import ReservaViewSet
+
+    usuario = User.objects.create_user('benchmark')
+    sala = criar_salas(1)[0]
+    fabrica = APIRequestFactory()
+    view = ReservaViewSet.as_view({'post': 'create'})
+    inicio = timezone.now().replace(minute=0, second=0, microsecond=0) + timedelta(days=1)
+    latencias, placar = [], {}
+    trava = threading.Lock()
+
+    def reservar(barreira, data_inicio):
+        requisicao = fabrica.post('/api/reservas/', {
+            'sala': sala.id, 'titulo': 'Disputa',
+            'data_inicio': data_inicio.isoformat(),
+            'data_fim': (data_inicio + timedelta(hours=1)).isoformat(),
+        }, format='json')
+        force_authenticate(requisicao, usuario)
+        try:
+            barreira.wait()
+            comeco = relogio.perf_counter()
+            codigo = view(requisicao).status_code
+            duracao = (relogio.perf_counter() - comeco) * 1000
+        finally:
+            connection.close()
+        with trava:
+            latencias.append(duracao)
+            resultados.append(codigo)
+
+    for rodada in range(rodadas):
+        resultados = []
+        barreira = threading.Barrier(threads)
+        data_inicio = inicio + timedelta(hours=2 * rodada)
+        trabalhadores = [
+            threading.Thread(target=reservar, args=(barreira, data_inicio)) for _ in range(threads)
+        ]
+        for trabalhador in trabalhadores:
+            trabalhador.start()
+        for trabalhador in trabalhadores:
+            trabalhador.join()
+        for codigo in resultados:
+            placar[codigo] = placar.get(codigo, 0) + 1
+        assert len(resultados) == threads and resultados.count(201) == 1, f'rodada {rodada}: {sorted(resultados)}'
+
+    criadas = Reserva.objects.filter(sala=sala).count()
+    assert criadas == rodadas, f'{criadas} reservas criadas em {rodadas} rodadas'
+    stdout.write(f'{rodadas} rodadas x {threads} threads: respostas {dict(sorted(placar.items()))}')
+    stdout.write(f'latência por requisição: {resumo(latencias)}')
+
+
+@cenario('idempotencia')
+def idempotencia(stdout, repeticoes=200, tentativas=5):
+    """POST de reserva com Idempotency-Key: primeira execução contra repetições (retry)"""
+    from rest_framework.test import APIRequestFactory, force_authenticate
+
+    from .views import ReservaViewSet
+
+    usuario = User.objects.create_user('benchmark')
+    sala = criar_salas(1)[0]
+    criar_reservas_diarias([sala], usuario, timezone.now() - timedelta(days=365), 365)
+    fabrica = APIRequestFactory()
+    view = ReservaViewSet.as_view({'post': 'create'})
+    inicio = timezone.now() + timedelta(days=400)
+    originais, repeticoes_ms = [], []
+
+    for i in range(repeticoes):
+        data_inicio = inicio + timedelta(hours=i)
+        dados = {
+            'sala': sala.id, 'titulo': 'Retry',
+            'data_inicio': data_inicio.isoformat(),
+            'data_fim': (data_inicio + timedelta(minutes=30)).isoformat(),
+        }
+
+        def post():
+            requisicao = fabrica.post('/api/reservas/', dados, format='json', HTTP_IDEMPOTENCY_KEY=f'chave-{i}')
+            force_authenticate(requisicao, usuario)
+            assert view(requisicao).status_code == 201
+
+        originais += medir(post, 1)
+        repeticoes_ms += medir(post, tentativas)
+
+    stdout.write(f'primeira execução: {resumo(originais)}')
+    stdout.write(f'repetição (resposta guardada): {resumo(repeticoes_ms)}')
+
+
+@cenario('sync')
+def sync(stdout, historico=200000, alteracoes=100, repeticoes=200):
+    """Poll de /api/sync/ sobre um log grande: sem alterações e com `alteracoes` novas"""
+    import json
+
+    from django.test.utils import override_settings
+    from rest_framework.test import APIRequestFactory, force_authenticate
+
+    from .models import RegistroAlteracao
+    from .views import SyncView
+
+    usuario = User.objects.create_user('benchmark')
+    salas = criar_salas(50)
+    dias = max(1, historico // (len(salas) * 4) * 7 // 5)
+    criar_reservas_diarias(salas, usuario, timezone.now() - timedelta(days=dias), dias)
+    RegistroAlteracao.objects.bulk_create(
+        RegistroAlteracao(modelo='reserva', objeto_id=pk)
+        for pk in Reserva.objects.values_list('pk', flat=True).iterator()
+    )
+    fabrica = APIRequestFactory()
+    view = SyncView.as_view()
+
+    def poll(token):
+        requisicao = fabrica.get('/api/sync/', {'since': token})
+        force_authenticate(requisicao, usuario)
+        resposta = view(requisicao)
+        assert resposta.status_code == 200, resposta.data
+        return len(json.dumps(resposta.data))
+
+    with override_settings(SYNC_ATRASO_SEGUNDOS=0):
+        token = RegistroAlteracao.objects.latest('id').pk
+        tamanho = poll(token)
+        stdout.write(f'sem alterações ({tamanho} bytes): {resumo(medir(lambda: poll(token), repeticoes))}')
+        for reserva in Reserva.objects.order_by('?')[:alteracoes]:
+            reserva.titulo = 'Alterada'
+            reserva.save()
+        tamanho = poll(token)
+        stdout.write(
+            f'{alteracoes} alterações ({tamanho} bytes): {resumo(medir(lambda: poll(token), repeticoes))}'
+        )
+
+
+@cenario('eventos')
+def eventos_push(stdout, conexoes=5000, salas=50, painel=10, publicacoes=200):
+    """
+    `conexoes` clientes SSE ociosos no mesmo processo (`painel`% assinando
+    todas as salas, o resto uma sala cada) enquanto reservas são alteradas:
+    memória por conexão e latência do commit até a entrega.
+    """
+    import asyncio
+    import threading
+    import tracemalloc
+
+    from django.db import transaction
+    from django.test import RequestFactory
+
+    from . import eventos
+    from .views import eventos_sse
+
+    usuario = User.objects.create_user('benchmark')
+    lista_salas = criar_salas(salas)
+    amanha = timezone.now() + timedelta(days=1)
+    Reserva.objects.bulk_create(
+        Reserva(sala=sala, usuario=usuario, titulo='Reunião', data_inicio=amanha, data_fim=amanha + timedelta(hours=1))
+        for sala in lista_salas
+    )
+    reservas = list(Reserva.objects.all())
+    fabrica = RequestFactory()
+    recebidos = []
+    por_sala = {sala.id: 0 for sala in lista_salas}
+    caminhos = []
+    for i in range(conexoes):
+        if i * 100 < conexoes * painel:
+            caminhos.append('/api/eventos/')
+        else:
+            sala_id = lista_salas[i % salas].id
+            por_sala[sala_id] += 1
+            caminhos.append(f'/api/eventos/?salas={sala_id}')
+    todas = sum(1 for caminho in caminhos if '?' not in caminho)
+
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+    completo = threading.Event()
+    esperado = 0
+
+    async def cliente(caminho):
+        resposta = await eventos_sse(fabrica.get(caminho))
+        async for parte in resposta.streaming_content:
+            if parte.startswith(b'event: reserva'):
+                recebidos.append(relogio.perf_counter())
+                if len(recebidos) == esperado:
+                    completo.set()
+
+    async def abrir():
+        return [asyncio.ensure_future(cliente(caminho)) for caminho in caminhos]
+
+    async def fechar(tarefas):
+        for tarefa in tarefas:
+            tarefa.cancel()
+        await asyncio.gather(*tarefas, return_exceptions=True)
+
+    tracemalloc.start()
+    antes = tracemalloc.get_traced_memory()[0]
+    comeco = relogio.perf_counter()
+    tarefas = asyncio.run_coroutine_threadsafe(abrir(), loop).result()
+    while eventos.hub.total() < conexoes:
+        relogio.sleep(0.01)
+    abertura = relogio.perf_counter() - comeco
+    memoria = tracemalloc.get_traced_memory()[0] - antes
+    tracemalloc.stop()
+    stdout.write(
+        f'{conexoes} conexões abertas em {abertura:.2f}s; '
+        f'memória Python por conexão: {memoria / conexoes / 1024:.1f} KiB'
+    )
+
+    entregas, completas, perdidas = [], [], 0
+    try:
+        for i in range(publicacoes):
+            reserva = random.choice(reservas)
+            esperado = por_sala[reserva.sala_id] + todas
+            recebidos.clear()
+            completo.clear()
+            marca = []
+            with transaction.atomic():
+                # Registrado antes do save: roda antes da publicação feita pelo sinal
+                transaction.on_commit(lambda: marca.append(relogio.perf_counter()))
+                reserva.titulo = f'Alterada {i}'
+                reserva.save()
+            completo.wait(5)
+            perdidas += esperado - len(recebidos)
+            atrasos = [(instante - marca[0]) * 1000 for instante in list(recebidos)]
+            entregas += atrasos
+            if atrasos:
+                completas.append(max(atrasos))
+    finally:
+        asyncio.run_coroutine_threadsafe(fechar(tarefas), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+
+    stdout.write(f'{publicacoes} alterações; entregas não recebidas: {perdidas}')
+    stdout.write(f'commit -> entrega (cada cliente): {resumo(entregas)}')
+    stdout.write(f'commit -> último cliente da alteração: {resumo(completas)}')
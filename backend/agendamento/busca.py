@@ -0,0 +1,181 @@
+"""
+Busca textual indexada (títulos e descrições de reservas, conteúdo das
+mensagens do chat), no lugar de `icontains`, que varre a tabela inteira.
+
+- PostgreSQL: coluna `busca` (tsvector, configuração 'portuguese', com peso
+  por campo) preenchida por um trigger BEFORE INSERT/UPDATE e indexada com
+  GIN. A consulta usa websearch_to_tsquery (aspas, OR e -termo) e ordena
+  por ts_rank_cd.
+- SQLite (desenvolvimento): tabela virtual FTS5 `<tabela>_fts` de conteúdo
+  externo, mantida por triggers, com prefixo em cada termo e acentos
+  ignorados; ordena por bm25 com os mesmos pesos.
+- Outros bancos: `icontains` em cada termo, sem relevância.
+
+A coluna, o índice e as tabelas FTS ficam fora dos modelos (o ORM não os lê
+nem grava) e são criados pelas migrações (agendamento 0012, chat 0005), com
+o SQL de `comandos_criar` copiado nelas. Depois de cada migrate,
+`garantir_indices` completa o que faltar: em bancos criados sem migrações
+(benchmark, TEST MIGRATE=False) e nos triggers do SQLite, que somem quando
+o Django recria a tabela em uma alteração de esquema.
+"""
+import re
+
+from django.db import connections
+from django.db.migrations.loader import MigrationLoader
+from django.db.models import BooleanField, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+CONFIGURACAO = 'portuguese'
+# Proporção próxima à dos pesos padrão do ts_rank ({D, C, B, A} = {0.1, 0.2, 0.4, 1.0})
+PESOS_BM25 = {'A': 10.0, 'B': 4.0, 'C': 2.0, 'D': 1.0}
+MAXIMO_TERMOS = 16
+TERMO = re.compile(r'\w+')
+
+INDICES = {}
+
+
+def termos(texto):
+    return TERMO.findall(texto)[:MAXIMO_TERMOS]
+
+
+def consulta_fts5(texto):
+    """Cada termo entre aspas (operadores FTS5 do usuário viram texto) e como prefixo"""
+    return ' '.join(f'"{termo}"*' for termo in termos(texto))
+
+
+class IndiceTexto:
+    """
+    Índice textual de `tabela` sobre `campos`, pares (coluna, peso de 'A' a
+    'D'), do mais relevante para o menos. A tabela deve ter chave `id`.
+    """
+
+    def __init__(self, tabela, campos):
+        self.tabela = tabela
+        self.campos = tuple(campos)
+        self.fts = f'{tabela}_fts'
+        self.colunas = [coluna for coluna, _ in self.campos]
+
+    # Esquema
+
+    def _vetor(self, linha=''):
+        return ' || '.join(
+            f"setweight(to_tsvector('{CONFIGURACAO}', coalesce({linha}{coluna}, '')), '{peso}')"
+            for coluna, peso in self.campos
+        )
+
+    def _sql_postgresql(self):
+        funcao = f'{self.tabela}_busca_atualizar'
+        inalterado = ' AND '.join(f'NEW.{coluna} IS NOT DISTINCT FROM OLD.{coluna}' for coluna in self.colunas)
+        return [
+            f'ALTER TABLE {self.tabela} ADD COLUMN IF NOT EXISTS busca tsvector',
+            f"""
+            CREATE OR REPLACE FUNCTION {funcao}() RETURNS trigger AS $$
+            BEGIN
+                -- save() do Django regrava todas as colunas: só recalcula se o texto mudou
+                IF TG_OP = 'UPDATE' AND {inalterado} THEN
+                    RETURN NEW;
+                END IF;
+                NEW.busca := {self._vetor('NEW.')};
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql
+            """,
+            f'DROP TRIGGER IF EXISTS {self.tabela}_busca_trg ON {self.tabela}',
+            f'CREATE TRIGGER {self.tabela}_busca_trg BEFORE INSERT OR UPDATE OF {", ".join(self.colunas)} '
+            f'ON {self.tabela} FOR EACH ROW EXECUTE FUNCTION {funcao}()',
+            f'UPDATE {self.tabela} SET busca = {self._vetor()}',
+            f'CREATE INDEX IF NOT EXISTS {self.tabela}_busca_idx ON {self.tabela} USING GIN (busca)',
+        ]
+
+    def _sql_sqlite(self):
+        colunas = ', '.join(self.colunas)
+        novos = ', '.join(f'new.{coluna}' for coluna in self.colunas)
+        antigos = ', '.join(f'old.{coluna}' for coluna in self.colunas)
+        inserir = f'INSERT INTO {self.fts}(rowid, {colunas}) VALUES (new.id, {novos});'
+        apagar = f"INSERT INTO {self.fts}({self.fts}, rowid, {colunas}) VALUES ('delete', old.id, {antigos});"
+        return [
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.fts} USING fts5({colunas}, content='{self.tabela}', "
+            f"content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+            f'CREATE TRIGGER IF NOT EXISTS {self.fts}_ai AFTER INSERT ON {self.tabela} BEGIN {inserir} END',
+            f'CREATE TRIGGER IF NOT EXISTS {self.fts}_ad AFTER DELETE ON {self.tabela} BEGIN {apagar} END',
+            f'CREATE TRIGGER IF NOT EXISTS {self.fts}_au AFTER UPDATE OF {colunas} ON {self.tabela} '
+            f'BEGIN {apagar} {inserir} END',
+            f"INSERT INTO {self.fts}({self.fts}) VALUES ('rebuild')",
+        ]
+
+    @property
+    def triggers_sqlite(self):
+        return {f'{self.fts}_ai', f'{self.fts}_ad', f'{self.fts}_au'}
+
+    def comandos_criar(self, vendor):
+        return {'postgresql': self._sql_postgresql, 'sqlite': self._sql_sqlite}.get(vendor, list)()
+
+    # Consulta
+
+    def buscar(self, queryset, texto):
+        """
+        `queryset` restrito aos itens que casam com todos os termos de
+        `texto`, anotado com `relevancia` (maior é melhor) e ordenado por ela.
+        Texto sem termos: nenhum item.
+        """
+        if not termos(texto):
+            return queryset.none()
+        conexao = connections[queryset.db]
+        tabela = conexao.ops.quote_name(self.tabela)
+        if conexao.vendor == 'postgresql':
+            consulta = f"websearch_to_tsquery('{CONFIGURACAO}', %s)"
+            filtro = RawSQL(f'{tabela}.busca @@ {consulta}', [texto], output_field=BooleanField())
+            relevancia = RawSQL(f'ts_rank_cd({tabela}.busca, {consulta})', [texto], output_field=FloatField())
+        elif conexao.vendor == 'sqlite':
+            # Junção com a tabela FTS5: a busca no índice conduz a consulta e o
+            # bm25 sai da mesma varredura (uma subconsulta por linha refaria o
+            # MATCH inteiro a cada resultado). O ORM não junta tabelas virtuais: extra()
+            pesos = ', '.join(str(PESOS_BM25[peso]) for _, peso in self.campos)
+            return queryset.extra(
+                select={'relevancia': f'-bm25({self.fts}, {pesos})'},
+                tables=[self.fts],
+                where=[f'{self.fts} MATCH %s', f'{self.fts}.rowid = {tabela}.id'],
+                params=[consulta_fts5(texto)],
+            ).order_by('-relevancia', '-pk')
+        else:
+            filtro = Q()
+            for termo in termos(texto):
+                filtro &= Q(*[Q(**{f'{coluna}__icontains': termo}) for coluna in self.colunas], _connector=Q.OR)
+            return queryset.filter(filtro).annotate(relevancia=Value(0.0)).order_by('-pk')
+        return queryset.filter(filtro).annotate(relevancia=relevancia).order_by('-relevancia', '-pk')
+
+
+def registrar(indice, migracao):
+    """Índice usado pelos modelos, criado pela `migracao` (app, nome); conferido por `garantir_indices`"""
+    indice.migracao = migracao
+    INDICES[indice.tabela] = indice
+    return indice
+
+
+def _completo(cursor, conexao, indice):
+    if conexao.vendor == 'sqlite':
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger') AND tbl_name IN (%s, %s)",
+            [indice.tabela, indice.fts],
+        )
+        return {indice.fts} | indice.triggers_sqlite <= {nome for nome, in cursor.fetchall()}
+    colunas = conexao.introspection.get_table_description(cursor, indice.tabela)
+    return any(coluna.name == 'busca' for coluna in colunas)
+
+
+def garantir_indices(using='default', **kwargs):
+    """post_migrate: cria o que falta dos índices registrados cujas tabelas existem"""
+    conexao = connections[using]
+    if conexao.vendor not in ('postgresql', 'sqlite'):
+        return
+    # Com migrações, só onde a migração do índice está aplicada (respeita migrate para trás)
+    migracoes = MigrationLoader(conexao, ignore_no_migrations=True)
+    with conexao.cursor() as cursor:
+        tabelas = set(conexao.introspection.table_names(cursor))
+        for indice in INDICES.values():
+            app = indice.migracao[0]
+            if app in migracoes.migrated_apps and indice.migracao not in migracoes.applied_migrations:
+                continue
+            if indice.tabela in tabelas and not _completo(cursor, conexao, indice):
+                for comando in indice.comandos_criar(conexao.vendor):
+                    cursor.execute(comando)
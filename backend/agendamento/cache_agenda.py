@@ -0,0 +1,82 @@
+"""
+Cache das respostas de SalaViewSet.agenda.
+
+As entradas são indexadas por sala e janela de datas e carregam a versão
+atual da agenda da sala. Alterar uma reserva incrementa apenas a versão da
+sala afetada, o que invalida todas as janelas dela de uma vez; as entradas
+antigas expiram pelo TTL. Acertos e falhas são contados no próprio cache
+para monitoramento.
+
+Cada entrada guarda, junto com o corpo, o ETag calculado do banco antes de
+gerá-lo; a resposta envia esse ETag. Uma entrada cujo ETag não é o atual
+(invalidação perdida, outro worker com cache próprio) conta como falha, em
+vez de ir para o cliente um corpo antigo com um ETag novo.
+
+A versão e as entradas precisam de um cache compartilhado por todos os
+workers (ver agendamento.checks).
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+CONTADORES = ('acertos', 'falhas', 'invalidacoes')
+
+
+def _chave_versao(sala_id):
+    return f'agenda:versao:{sala_id}'
+
+
+def _chave(sala_id, versao, data_inicio, data_fim):
+    return f'agenda:{sala_id}:v{versao}:{data_inicio.isoformat()}:{data_fim.isoformat()}'
+
+
+def _contar(nome):
+    chave = f'agenda:contador:{nome}'
+    if not cache.add(chave, 1, timeout=None):
+        try:
+            cache.incr(chave)
+        except ValueError:
+            cache.set(chave, 1, timeout=None)
+
+
+def _versao(sala_id):
+    chave = _chave_versao(sala_id)
+    cache.add(chave, 1, timeout=None)
+    return cache.get(chave, 1)
+
+
+def obter(sala_id, data_inicio, data_fim, etag, gerar):
+    """
+    Retorna (etag, dados, acerto) da agenda da sala na janela pedida. `etag`
+    é o atual, calculado do banco; sem entrada com esse ETag, chama `gerar()`
+    e guarda o resultado com ele. O ETag retornado é o guardado com os dados.
+    """
+    chave = _chave(sala_id, _versao(sala_id), data_inicio, data_fim)
+    entrada = cache.get(chave)
+    if entrada is not None and entrada[0] == etag:
+        _contar('acertos')
+        return (*entrada, True)
+
+    _contar('falhas')
+    # Gerado depois de calculado o ETag: o corpo nunca é mais antigo que ele
+    entrada = (etag, gerar())
+    cache.set(chave, entrada, getattr(settings, 'AGENDA_CACHE_TTL', 300))
+    return (*entrada, False)
+
+
+def invalidar(sala_id):
+    """Descarta todas as janelas de agenda em cache de uma sala"""
+    chave = _chave_versao(sala_id)
+    if not cache.add(chave, 2, timeout=None):
+        try:
+            cache.incr(chave)
+        except ValueError:
+            cache.set(chave, 2, timeout=None)
+    _contar('invalidacoes')
+
+
+def estatisticas():
+    valores = cache.get_many([f'agenda:contador:{nome}' for nome in CONTADORES])
+    dados = {nome: valores.get(f'agenda:contador:{nome}', 0) for nome in CONTADORES}
+    consultas = dados['acertos'] + dados['falhas']
+    dados['taxa_acerto'] = round(dados['acertos'] / consultas, 4) if consultas else None
+    return dados
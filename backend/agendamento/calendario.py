@@ -0,0 +1,147 @@
+"""
+Feed iCalendar público por sala (/api/calendarios/<token>.ics).
+
+Clientes de calendário consultam o feed a cada poucos minutos. O texto
+fica pré-gerado em CalendarioSala e, em cima disso, no cache compartilhado
+do Django: `calendario:token:<token>` resolve o token para a sala e
+`calendario:sala:<id>:v<versao>` guarda (conteudo, etag, modificado_em,
+valido_ate), com a versão da sala em `calendario:versao:<id>`. Uma
+consulta comum faz três leituras do cache e nenhuma do banco.
+
+Alterações em reservas e em salas (nome, token, desativação, remoção)
+chamam `invalidar(salas)` após o commit, que avança a versão da sala no
+cache e incrementa CalendarioSala.versao. Na leitura seguinte, de qualquer
+worker, a entrada da versão nova falta e o banco é consultado: o token é
+conferido de novo (token trocado ou sala desativada deixam de responder)
+e o feed só é refeito se CalendarioSala.versao mudou, ou uma vez por dia,
+para a janela de datas acompanhar o calendário. Alterações que não passam
+pelos sinais (QuerySet.update em Sala) valem quando a entrada expira
+(CALENDARIO_CACHE_TTL). Como as agendas, isso pede um cache compartilhado
+por todos os workers (ver agendamento.checks).
+"""
+import hashlib
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+
+from . import icalendar
+from .models import CalendarioSala, Reserva, Sala
+
+VALIDADE = timedelta(days=1)
+# Bem mais longa que a das entradas: expirar só descarta as entradas da versão
+_TTL_VERSAO = 7 * 24 * 60 * 60
+
+
+def _chave_token(token):
+    return f'calendario:token:{token}'
+
+
+def _chave_versao(sala_id):
+    return f'calendario:versao:{sala_id}'
+
+
+def _chave_sala(sala_id, versao):
+    return f'calendario:sala:{sala_id}:v{versao}'
+
+
+def _versao(sala_id):
+    chave = _chave_versao(sala_id)
+    versao = cache.get(chave)
+    if versao is None:
+        # Inicial pelo relógio: uma versão que expirou não volta a valer
+        inicial = int(time.time() * 1000)
+        cache.add(chave, inicial, _TTL_VERSAO)
+        versao = cache.get(chave, inicial)
+    return versao
+
+
+def _ttl():
+    return getattr(settings, 'CALENDARIO_CACHE_TTL', 3600)
+
+
+def renderizar(sala):
+    """Texto .ics das reservas não canceladas da sala na janela configurada"""
+    agora = timezone.now()
+    reservas = Reserva.objects.filter(
+        sala=sala,
+        data_fim__gte=agora - timedelta(days=getattr(settings, 'CALENDARIO_DIAS_PASSADOS', 30)),
+        data_inicio__lt=agora + timedelta(days=getattr(settings, 'CALENDARIO_DIAS_FUTUROS', 365)),
+    ).exclude(status='cancelada').order_by('data_inicio', 'id').values_list(
+        'id', 'titulo', 'descricao', 'data_inicio', 'data_fim', 'status', 'atualizado_em',
+    )
+    partes = [icalendar.cabecalho(sala.nome)]
+    partes.extend(
+        icalendar.evento(*reserva, local=sala.nome) for reserva in reservas
+    )
+    partes.append(icalendar.rodape())
+    return ''.join(partes)
+
+
+def _regenerar(sala_id, token):
+    """
+    Confere o token (sala ativa) e refaz o feed se a versão mudou ou se ele
+    venceu; devolve a entrada de cache, ou None se o token não vale mais
+    """
+    sala = Sala.objects.filter(pk=sala_id, token_calendario=token, ativa=True).only('nome').first()
+    if sala is None:
+        return None
+    calendario, _ = CalendarioSala.objects.get_or_create(sala=sala)
+    agora = timezone.now()
+    vencido = calendario.gerado_em is None or calendario.gerado_em + VALIDADE <= agora
+    if calendario.versao_gerada != calendario.versao or vencido:
+        # A versão é lida antes das reservas: uma alteração concorrente
+        # incrementa `versao` e deixa o feed desatualizado de novo
+        versao = calendario.versao
+        conteudo = renderizar(sala)
+        etag = '"%s"' % hashlib.md5(conteudo.encode()).hexdigest()
+        if etag != calendario.etag:
+            calendario.conteudo, calendario.etag, calendario.modificado_em = conteudo, etag, agora
+        calendario.gerado_em = agora
+        CalendarioSala.objects.filter(pk=sala_id).update(
+            conteudo=calendario.conteudo,
+            etag=calendario.etag,
+            modificado_em=calendario.modificado_em,
+            gerado_em=agora,
+            versao_gerada=versao,
+        )
+    return (calendario.conteudo, calendario.etag, calendario.modificado_em, calendario.gerado_em + VALIDADE)
+
+
+def obter(token):
+    """(conteudo, etag, modificado_em) do feed do token, ou None se o token não existe"""
+    chave_token = _chave_token(token)
+    sala_id = cache.get(chave_token)
+    if sala_id is None:
+        sala_id = Sala.objects.filter(token_calendario=token, ativa=True).values_list('pk', flat=True).first()
+        if sala_id is None:
+            return None
+        cache.set(chave_token, sala_id, _ttl())
+
+    # Versão lida antes da regeneração: se a sala mudar no meio dela, a
+    # entrada é gravada sob a versão antiga e nunca mais lida
+    chave = _chave_sala(sala_id, _versao(sala_id))
+    entrada = cache.get(chave)
+    if entrada is None or entrada[3] <= timezone.now():
+        entrada = _regenerar(sala_id, token)
+        if entrada is None:
+            cache.delete(chave_token)
+            return None
+        cache.set(chave, entrada, _ttl())
+    return entrada[:3]
+
+
+def invalidar(salas):
+    """Marca os feeds das salas como desatualizados (chamado após o commit)"""
+    salas = list(salas)
+    if not salas:
+        return
+    for sala_id in salas:
+        try:
+            cache.incr(_chave_versao(sala_id))
+        except ValueError:
+            pass  # Sem versão, nenhuma entrada vale: a próxima começa do relógio
+    CalendarioSala.objects.filter(sala_id__in=salas).update(versao=F('versao') + 1)
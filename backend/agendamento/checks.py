@@ -0,0 +1,59 @@
+"""
+Verificações de configuração (manage.py check e início do servidor).
+
+Com mais de um worker (WEB_CONCURRENCY), cada processo com cache em memória
+teria as próprias versões de agenda, gerações dos mapas de disponibilidade
+e feeds .ics: uma reserva invalida o cache do worker que a gravou e os
+outros continuam servindo o estado antigo. Do mesmo jeito, o broker local de
+eventos só entrega o que foi publicado no próprio worker.
+
+São avisos, e não erros: plataformas como o Heroku definem WEB_CONCURRENCY
+pelo tamanho do dyno, e a configuração padrão precisa subir mesmo assim.
+"""
+import logging
+
+from django.conf import settings
+from django.core import checks
+
+logger = logging.getLogger(__name__)
+
+CACHES_DO_PROCESSO = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@checks.register(checks.Tags.caches)
+def estado_compartilhado(app_configs=None, **kwargs):
+    workers = getattr(settings, 'WEB_CONCURRENCY', 1)
+    if workers <= 1:
+        return []
+    erros = []
+    backend = settings.CACHES['default']['BACKEND']
+    if backend in CACHES_DO_PROCESSO:
+        erros.append(checks.Warning(
+            f'O cache padrão ({backend}) é do processo, com {workers} workers (WEB_CONCURRENCY): '
+            'agendas, disponibilidade e feeds .ics podem ficar desatualizados nos outros workers.',
+            hint='Use CACHE_BACKEND=redis ou WEB_CONCURRENCY=1.',
+            id='agendamento.W002',
+        ))
+    elif backend == 'django.core.cache.backends.filebased.FileBasedCache':
+        erros.append(checks.Warning(
+            'O cache em arquivo é compartilhado, mas add/incr não são atômicos: '
+            'invalidações simultâneas podem se perder.',
+            hint='Use CACHE_BACKEND=redis com mais de um worker.',
+            id='agendamento.W001',
+        ))
+    if getattr(settings, 'EVENTOS_BROKER', '').endswith('.BrokerLocal'):
+        erros.append(checks.Warning(
+            f'O broker de eventos local só alcança o próprio worker, com {workers} workers (WEB_CONCURRENCY).',
+            hint='Use EVENTOS_BROKER=redis ou WEB_CONCURRENCY=1.',
+            id='agendamento.W003',
+        ))
+    return erros
+
+
+def avisar_estado_compartilhado():
+    """Registra no log, ao subir o servidor, os avisos de estado_compartilhado"""
+    for aviso in estado_compartilhado():
+        logger.warning('%s %s (%s)', aviso.msg, aviso.hint, aviso.id)
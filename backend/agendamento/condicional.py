@@ -0,0 +1,56 @@
+"""
+GET condicional (ETag / If-None-Match) para as listagens da API.
+
+O ETag é calculado a partir de validadores baratos, como o maior
+`atualizado_em` e a contagem de linhas do queryset, sem serializar o corpo.
+Quando o cliente já tem a versão atual, a resposta é 304 sem corpo.
+"""
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def resumo_queryset(queryset, campo='atualizado_em'):
+    """(contagem, maior valor de `campo`) do queryset em uma consulta"""
+    dados = queryset.order_by().aggregate(total=Count('pk'), ultimo=Max(campo))
+    return dados['total'], dados['ultimo']
+
+
+def gerar_etag(request, *validadores):
+    partes = [request.get_full_path(), getattr(request.accepted_renderer, 'format', '')]
+    partes.extend(str(v) for v in validadores)
+    return '"%s"' % hashlib.md5('|'.join(partes).encode()).hexdigest()
+
+
+def nao_modificado(request, etag):
+    """Resposta 304 se o If-None-Match do cliente corresponde ao ETag, senão None"""
+    cabecalho = request.headers.get('If-None-Match')
+    if not cabecalho:
+        return None
+    etags = parse_etags(cabecalho)
+    if '*' in etags or etag in (e.removeprefix('W/') for e in etags):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+    return None
+
+
+class ListagemCondicionalMixin:
+    """
+    Adiciona ETag à ação `list` de um ViewSet. A view define
+    `validadores_listagem(queryset)` retornando valores que mudam sempre que
+    o conteúdo da listagem muda.
+    """
+
+    def validadores_listagem(self, queryset):
+        return resumo_queryset(queryset)
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        etag = gerar_etag(request, *self.validadores_listagem(queryset))
+        resposta = nao_modificado(request, etag)
+        if resposta is None:
+            resposta = super().list(request, *args, **kwargs)
+            resposta['ETag'] = etag
+        return resposta
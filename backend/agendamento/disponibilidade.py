@@ -0,0 +1,359 @@
+"""
+Motor de disponibilidade de salas baseado em mapas de bits.
+
+A ocupação de cada sala é mantida em cache como um mapa de bits por dia
+(horário local), com um bit para cada faixa de SLOT_MINUTOS minutos: 288
+faixas de 5 minutos cabem em 36 bytes. Descobrir quais salas estão livres
+em um intervalo vira um AND entre a máscara do intervalo e o mapa de cada
+sala, sem varrer a tabela de reservas.
+
+Os mapas são montados sob demanda (uma consulta para todos os pares
+sala/dia ausentes) e atualizados incrementalmente pelos sinais de Reserva.
+
+Cada par sala/dia tem uma geração no cache, que faz parte da chave do mapa
+e avança a cada alteração de reserva naquele dia. Um mapa montado a partir
+de uma leitura do banco anterior à alteração fica gravado sob a geração
+antiga, que ninguém mais lê, em vez de sobrescrever o mapa atualizado. A
+geração começa no relógio em milissegundos, e não em 1, para que uma
+geração expirada e recriada nunca reencontre mapas antigos.
+"""
+import heapq
+import time as relogio
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models
+from django.utils import timezone
+
+from .models import Reserva, Sala
+
+SLOT_MINUTOS = 5
+SLOTS_POR_DIA = 24 * 60 // SLOT_MINUTOS
+BYTES_POR_DIA = (SLOTS_POR_DIA + 7) // 8
+
+_SEGUNDOS_SLOT = SLOT_MINUTOS * 60
+# Bem mais longa que a dos mapas: expirar só descarta os mapas da geração
+_TTL_GERACAO = 24 * 60 * 60
+
+
+def _ttl():
+    return getattr(settings, 'DISPONIBILIDADE_CACHE_TTL', 300)
+
+
+def _max_dias():
+    return getattr(settings, 'DISPONIBILIDADE_MAX_DIAS', 31)
+
+
+def _chave_geracao(sala_id, dia):
+    return f'disponibilidade:geracao:{sala_id}:{dia.isoformat()}'
+
+
+def _chave(sala_id, dia, geracao):
+    return f'disponibilidade:{sala_id}:{dia.isoformat()}:g{geracao}'
+
+
+def _geracoes(pares):
+    """Geração atual de cada (sala_id, dia), criando as que faltam"""
+    chaves = {_chave_geracao(*par): par for par in pares}
+    geracoes = cache.get_many(list(chaves))
+    for chave in chaves.keys() - geracoes.keys():
+        inicial = int(relogio.time() * 1000)
+        cache.add(chave, inicial, _TTL_GERACAO)
+        geracoes[chave] = cache.get(chave, inicial)
+    return {chaves[chave]: geracao for chave, geracao in geracoes.items()}
+
+
+def _avancar_geracao(chave):
+    """Nova geração, ou None se não havia nenhuma (nada em cache para o dia)"""
+    try:
+        return cache.incr(chave)
+    except ValueError:
+        return None
+
+
+def _inicio_do_dia(dia):
+    return timezone.make_aware(datetime.combine(dia, time.min))
+
+
+def _faixa(inicio, fim):
+    """Máscara com os bits [inicio, fim)"""
+    if fim <= inicio:
+        return 0
+    return ((1 << (fim - inicio)) - 1) << inicio
+
+
+def dias_do_intervalo(data_inicio, data_fim):
+    """Datas locais tocadas pelo intervalo [data_inicio, data_fim)"""
+    fuso = timezone.get_current_timezone()
+    dia = data_inicio.astimezone(fuso).date()
+    ultimo = (data_fim - timedelta(microseconds=1)).astimezone(fuso).date()
+    dias = []
+    while dia <= ultimo:
+        dias.append(dia)
+        dia += timedelta(days=1)
+    return dias
+
+
+def mascaras(dia, data_inicio, data_fim):
+    """
+    Retorna (tocadas, cobertas) para o intervalo recortado ao dia:
+    faixas que o intervalo toca e faixas que ele cobre por inteiro.
+    """
+    inicio_dia = _inicio_do_dia(dia)
+    fim_dia = _inicio_do_dia(dia + timedelta(days=1))
+    inicio = max(data_inicio, inicio_dia)
+    fim = min(data_fim, fim_dia)
+    if fim <= inicio:
+        return 0, 0
+
+    seg_inicio = (inicio - inicio_dia).total_seconds()
+    seg_fim = (fim - inicio_dia).total_seconds()
+    primeira_tocada = int(seg_inicio // _SEGUNDOS_SLOT)
+    ultima_tocada = min(-int(-seg_fim // _SEGUNDOS_SLOT), SLOTS_POR_DIA)
+    primeira_coberta = -int(-seg_inicio // _SEGUNDOS_SLOT)
+    ultima_coberta = min(int(seg_fim // _SEGUNDOS_SLOT), SLOTS_POR_DIA)
+    return (
+        _faixa(primeira_tocada, ultima_tocada),
+        _faixa(primeira_coberta, ultima_coberta),
+    )
+
+
+def _para_bytes(mapa):
+    return mapa.to_bytes(BYTES_POR_DIA, 'little')
+
+
+def _de_bytes(dados):
+    return int.from_bytes(dados, 'little')
+
+
+def obter_mapas(salas_ids, dias):
+    """
+    Mapas de ocupação {(sala_id, dia): int} para todos os pares pedidos.
+    Pares ausentes do cache são montados com uma única consulta.
+    """
+    # Gerações lidas antes do banco: uma alteração no meio do caminho as avança
+    geracoes = _geracoes([(sala_id, dia) for sala_id in salas_ids for dia in dias])
+    chaves = {_chave(*par, geracao): par for par, geracao in geracoes.items()}
+    em_cache = cache.get_many(list(chaves))
+    mapas = {chaves[chave]: _de_bytes(dados) for chave, dados in em_cache.items()}
+
+    faltantes = [par for chave, par in chaves.items() if chave not in em_cache]
+    if faltantes:
+        novos = _montar_mapas(faltantes)
+        for par, mapa in novos.items():
+            # add: não sobrescreve o mapa que marcar_ocupacao gravou nesta geração
+            cache.add(_chave(*par, geracoes[par]), _para_bytes(mapa), _ttl())
+        mapas.update(novos)
+    return mapas
+
+
+def _montar_mapas(pares):
+    mapas = {par: 0 for par in pares}
+    salas_ids = {sala_id for sala_id, _ in pares}
+    dias = sorted({dia for _, dia in pares})
+    inicio = _inicio_do_dia(dias[0])
+    fim = _inicio_do_dia(dias[-1] + timedelta(days=1))
+
+    reservas = Reserva.objects.ativas().filter(
+        sala_id__in=salas_ids,
+        data_inicio__lt=fim,
+        data_fim__gt=inicio,
+    ).order_by().values_list('sala_id', 'data_inicio', 'data_fim')
+
+    for sala_id, data_inicio, data_fim in reservas.iterator():
+        for dia in dias_do_intervalo(max(data_inicio, inicio), min(data_fim, fim)):
+            if (sala_id, dia) in mapas:
+                mapas[(sala_id, dia)] |= mascaras(dia, data_inicio, data_fim)[0]
+    return mapas
+
+
+def filtrar_livres(salas, data_inicio, data_fim):
+    """
+    Filtra as salas (instâncias de Sala) livres em [data_inicio, data_fim).
+
+    Uma sala cujo mapa intersecta as faixas cobertas pelo intervalo está
+    ocupada com certeza. Se a interseção for só nas faixas das bordas, que o
+    intervalo toca parcialmente, a sala é confirmada com uma consulta
+    restrita a essas salas.
+    """
+    salas = list(salas)
+    dias = dias_do_intervalo(data_inicio, data_fim)
+    if not salas or not dias:
+        return salas
+
+    if len(dias) > _max_dias():
+        ocupadas = set(Reserva.objects.ativas().filter(
+            sala__in=salas,
+            data_inicio__lt=data_fim,
+            data_fim__gt=data_inicio,
+        ).values_list('sala_id', flat=True))
+        return [sala for sala in salas if sala.pk not in ocupadas]
+
+    mapas = obter_mapas([sala.pk for sala in salas], dias)
+    mascaras_dias = [(dia, *mascaras(dia, data_inicio, data_fim)) for dia in dias]
+
+    livres, duvidosas = set(), set()
+    for sala in salas:
+        situacao = 'livre'
+        for dia, tocadas, cobertas in mascaras_dias:
+            mapa = mapas[(sala.pk, dia)]
+            if mapa & cobertas:
+                situacao = 'ocupada'
+                break
+            if mapa & tocadas:
+                situacao = 'duvidosa'
+        if situacao == 'livre':
+            livres.add(sala.pk)
+        elif situacao == 'duvidosa':
+            duvidosas.add(sala.pk)
+
+    if duvidosas:
+        ocupadas = set(Reserva.objects.ativas().filter(
+            sala_id__in=duvidosas,
+            data_inicio__lt=data_fim,
+            data_fim__gt=data_inicio,
+        ).values_list('sala_id', flat=True))
+        livres |= duvidosas - ocupadas
+    return [sala for sala in salas if sala.pk in livres]
+
+
+def marcar_ocupacao(sala_id, data_inicio, data_fim):
+    """
+    Acrescenta uma reserva ativa (já gravada) aos mapas que estão em cache.
+    A geração do dia avança sempre; o mapa da geração nova só é gravado se
+    nenhuma outra alteração avançou a geração entre a leitura e o avanço,
+    senão o próximo acesso monta o mapa de novo a partir do banco.
+    """
+    for dia in dias_do_intervalo(data_inicio, data_fim):
+        chave_geracao = _chave_geracao(sala_id, dia)
+        geracao = cache.get(chave_geracao)
+        if geracao is None:
+            continue
+        dados = cache.get(_chave(sala_id, dia, geracao))
+        nova = _avancar_geracao(chave_geracao)
+        if dados is not None and nova == geracao + 1:
+            mapa = _de_bytes(dados) | mascaras(dia, data_inicio, data_fim)[0]
+            cache.add(_chave(sala_id, dia, nova), _para_bytes(mapa), _ttl())
+
+
+def invalidar_ocupacao(sala_id, data_inicio, data_fim):
+    """
+    Descarta os mapas dos dias de uma reserva que deixou de ocupar a sala.
+    Não basta limpar os bits: outra reserva pode dividir a mesma faixa.
+    """
+    invalidar_ocupacoes([(sala_id, data_inicio, data_fim)])
+
+
+def invalidar_ocupacoes(intervalos):
+    """Como invalidar_ocupacao, para vários (sala_id, data_inicio, data_fim) de uma vez"""
+    chaves = {
+        _chave_geracao(sala_id, dia)
+        for sala_id, data_inicio, data_fim in intervalos
+        for dia in dias_do_intervalo(data_inicio, data_fim)
+    }
+    # Os mapas da geração anterior ficam órfãos e expiram pelo TTL
+    for chave in chaves:
+        _avancar_geracao(chave)
+
+
+def _arredondar_para_slot(momento, fuso):
+    """Arredonda para cima até a próxima fronteira de faixa (horário local)"""
+    inicio_dia = datetime.combine(momento.astimezone(fuso).date(), time.min, tzinfo=fuso)
+    resto = (momento - inicio_dia).total_seconds() % _SEGUNDOS_SLOT
+    if resto:
+        momento += timedelta(seconds=_SEGUNDOS_SLOT - resto)
+    return momento
+
+
+def _primeiro_encaixe(livre_inicio, livre_fim, duracao, hora_inicio, hora_fim, fuso):
+    """Primeiro início dentro do expediente em que `duracao` cabe no intervalo livre"""
+    dia = livre_inicio.astimezone(fuso).date()
+    while True:
+        expediente_inicio = datetime.combine(dia, hora_inicio, tzinfo=fuso)
+        if expediente_inicio >= livre_fim:
+            return None
+        expediente_fim = datetime.combine(dia, hora_fim, tzinfo=fuso)
+        inicio = _arredondar_para_slot(max(livre_inicio, expediente_inicio), fuso)
+        if inicio + duracao <= min(livre_fim, expediente_fim):
+            return inicio
+        dia += timedelta(days=1)
+
+
+def buscar_horarios_livres(salas, inicio, fim, duracao, hora_inicio, hora_fim,
+                           participantes=1, limite=5, criterio='cedo'):
+    """
+    Primeiro horário livre de `duracao` em cada sala dentro de [inicio, fim),
+    respeitando o expediente diário [hora_inicio, hora_fim).
+
+    As reservas ativas são lidas ordenadas por sala e início, em janelas de
+    dias que dobram de tamanho (faixas limitadas de data_inicio no índice); cada sala é resolvida em uma varredura linear
+    sobre os seus intervalos ocupados e sai das janelas seguintes assim que um
+    horário é encontrado. Retorna até `limite` tuplas (sala, inicio, fim),
+    ordenadas pelo início mais cedo (criterio='cedo') ou pela menor sobra de
+    capacidade (criterio='ajuste').
+    """
+    salas = {sala.pk: sala for sala in salas}
+    if not salas or hora_fim <= hora_inicio:
+        return []
+    fuso = timezone.get_current_timezone()
+
+    # Fim da última ocupação vista por sala; a sala sai daqui quando é resolvida.
+    # Em `inicio` a sala fica ocupada até o maior fim entre as reservas em
+    # andamento nele (podem ser várias: nada no banco impede sobreposições);
+    # faixa data_fim > inicio no índice parcial (sala, data_fim)
+    em_andamento_ate = Reserva.objects.ativas().filter(
+        sala=models.OuterRef('pk'),
+        data_fim__gt=inicio,
+        data_inicio__lt=inicio,
+    ).order_by('-data_fim').values('data_fim')[:1]
+    em_andamento = Sala.objects.filter(pk__in=list(salas)).annotate(
+        ocupada_ate=models.Subquery(em_andamento_ate)
+    ).values_list('pk', 'ocupada_ate')
+    cursor = {
+        sala_id: max(inicio, ocupada_ate) if ocupada_ate else inicio
+        for sala_id, ocupada_ate in em_andamento
+    }
+    encontrados = {}
+
+    def tentar(sala_id, livre_ate):
+        encaixe = _primeiro_encaixe(cursor[sala_id], livre_ate, duracao, hora_inicio, hora_fim, fuso)
+        if encaixe is not None:
+            encontrados[sala_id] = encaixe
+            del cursor[sala_id]
+
+    # Janelas terminam à meia-noite local: o expediente nunca atravessa a fronteira
+    janela_inicio, dias = inicio, 1
+    while cursor and janela_inicio < fim:
+        proximo_dia = janela_inicio.astimezone(fuso).date() + timedelta(days=dias)
+        janela_fim = min(datetime.combine(proximo_dia, time.min, tzinfo=fuso), fim)
+
+        reservas = Reserva.objects.ativas().filter(
+            sala_id__in=list(cursor),
+            data_inicio__gte=janela_inicio,
+            data_inicio__lt=janela_fim,
+        ).order_by('sala_id', 'data_inicio').values_list('sala_id', 'data_inicio', 'data_fim')
+
+        for sala_id, data_inicio, data_fim in reservas.iterator():
+            if sala_id not in cursor:
+                continue
+            if data_inicio > cursor[sala_id]:
+                tentar(sala_id, data_inicio)
+            if sala_id in cursor and data_fim > cursor[sala_id]:
+                cursor[sala_id] = data_fim
+
+        for sala_id, livre_desde in list(cursor.items()):
+            if livre_desde < janela_fim:
+                tentar(sala_id, janela_fim)
+
+        janela_inicio, dias = janela_fim, dias * 2
+
+    if criterio == 'ajuste':
+        def ordem(item):
+            return (salas[item[0]].capacidade - participantes, item[1], item[0])
+    else:
+        def ordem(item):
+            return (item[1], salas[item[0]].capacidade, item[0])
+
+    melhores = heapq.nsmallest(limite, encontrados.items(), key=ordem)
+    return [(salas[sala_id], encaixe, encaixe + duracao) for sala_id, encaixe in melhores]
@@ -0,0 +1,282 @@
+"""
+Push de alterações de reservas e salas para telas de sala, agenda e
+dashboard (Server-Sent Events em /api/eventos/, servido via ASGI).
+
+- `hub`: distribuição dentro do processo. Cada conexão (SSE ou o WebSocket
+  do chat) é uma Assinatura com uma fila asyncio e um conjunto de tópicos
+  ('sala:<id>', 'sala:*' para todas as salas, 'conversa:<id>' no chat).
+  A entrega é feita no event loop da assinatura
+  com call_soon_threadsafe, então `publicar` pode ser chamado de qualquer
+  thread (views síncronas, sinais, comandos).
+- Broker (EVENTOS_BROKER): leva as publicações até o hub de cada processo.
+  BrokerLocal entrega direto no hub do próprio processo (um worker ASGI).
+  BrokerRedis usa pub/sub do Redis, para vários workers e para publicações
+  feitas fora do processo ASGI (atualizar_status_reservas).
+  Código assíncrono publica com `await broker().apublicar(...)`, que não
+  bloqueia o event loop; `publicar` chamado de dentro de um loop também
+  não bloqueia: agenda a publicação assíncrona e retorna.
+
+As mensagens já saem formatadas como quadros SSE, serializados uma vez só,
+não uma vez por assinante. Heartbeat e duração máxima das conexões ficam a
+cargo de uma única tarefa por event loop (`_pulsar`), e não de um timer por
+conexão: cada conexão ociosa custa só a fila e a espera nela.
+"""
+import asyncio
+import json
+import logging
+import threading
+import weakref
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+TODAS = 'sala:*'
+RESSINCRONIZAR = 'event: ressincronizar\ndata: {}\n\n'
+PING = ': ping\n\n'
+FIM = object()
+
+
+def quadro(tipo, dados):
+    return f'event: {tipo}\ndata: {json.dumps(dados, separators=(",", ":"))}\n\n'
+
+
+class Assinatura:
+    def __init__(self, topicos, tamanho_fila, duracao):
+        self.topicos = frozenset(topicos)
+        self.loop = asyncio.get_running_loop()
+        self.fila = asyncio.Queue(tamanho_fila)
+        self.expira_em = self.loop.time() + duracao
+
+    def entregar(self, mensagem):
+        """Chamado no loop da assinatura. Fila cheia: o cliente perdeu eventos e deve ressincronizar"""
+        try:
+            self.fila.put_nowait(mensagem)
+        except asyncio.QueueFull:
+            while not self.fila.empty():
+                self.fila.get_nowait()
+            self.fila.put_nowait(RESSINCRONIZAR)
+
+    def encerrar(self):
+        """Faz o fluxo terminar depois dos eventos já na fila"""
+        if self.fila.full():
+            self.fila.get_nowait()
+        self.fila.put_nowait(FIM)
+
+
+def _entregar_todas(assinaturas, mensagem):
+    for assinatura in assinaturas:
+        assinatura.entregar(mensagem)
+
+
+class Hub:
+    def __init__(self):
+        self._por_topico = defaultdict(set)
+        self._trava = threading.Lock()
+
+    def adicionar(self, assinatura):
+        with self._trava:
+            for topico in assinatura.topicos:
+                self._por_topico[topico].add(assinatura)
+
+    def remover(self, assinatura):
+        with self._trava:
+            for topico in assinatura.topicos:
+                self._por_topico[topico].discard(assinatura)
+                if not self._por_topico[topico]:
+                    del self._por_topico[topico]
+
+    def total(self):
+        with self._trava:
+            return len(set().union(*self._por_topico.values()))
+
+    def do_loop(self, loop):
+        with self._trava:
+            return {assinatura for assinaturas in self._por_topico.values()
+                    for assinatura in assinaturas if assinatura.loop is loop}
+
+    def entregar(self, topico, mensagem):
+        # 'prefixo:*' recebe tudo do prefixo ('sala:*': todas as salas)
+        curinga = topico.partition(':')[0] + ':*'
+        with self._trava:
+            alvos = self._por_topico.get(topico, set()) | self._por_topico.get(curinga, set())
+        # Um callback por event loop, não um por assinante
+        por_loop = defaultdict(list)
+        for assinatura in alvos:
+            por_loop[assinatura.loop].append(assinatura)
+        for loop, assinaturas in por_loop.items():
+            try:
+                loop.call_soon_threadsafe(_entregar_todas, assinaturas, mensagem)
+            except RuntimeError:
+                # Loop já encerrado; as assinaturas dele saem no finally do fluxo
+                pass
+
+
+hub = Hub()
+
+
+_pendentes = set()
+
+
+def _publicacao_concluida(tarefa):
+    _pendentes.discard(tarefa)
+    if not tarefa.cancelled() and tarefa.exception() is not None:
+        logger.error('Falha ao publicar evento', exc_info=tarefa.exception())
+
+
+def _em_segundo_plano(loop, corrotina):
+    # Referência guardada até o fim: o loop só mantém referências fracas às tarefas
+    tarefa = loop.create_task(corrotina)
+    _pendentes.add(tarefa)
+    tarefa.add_done_callback(_publicacao_concluida)
+
+
+class BrokerLocal:
+    """Só o próprio processo: suficiente com um único worker ASGI"""
+
+    def publicar(self, topico, mensagem):
+        hub.entregar(topico, mensagem)
+
+    async def apublicar(self, topico, mensagem):
+        hub.entregar(topico, mensagem)
+
+    async def iniciar(self):
+        pass
+
+
+class BrokerRedis:
+    """Pub/sub do Redis (EVENTOS_REDIS_URL); requer o pacote redis"""
+    canal = 'salafacil:eventos'
+
+    def __init__(self):
+        import redis
+
+        self._url = settings.EVENTOS_REDIS_URL
+        self._cliente = redis.Redis.from_url(self._url)
+        # Conexões do redis.asyncio pertencem ao loop em que foram abertas
+        self._clientes_assincronos = weakref.WeakKeyDictionary()
+        self._ouvinte = None
+
+    def publicar(self, topico, mensagem):
+        """Bloqueia até o Redis responder, exceto dentro de um event loop (ver apublicar)"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._cliente.publish(self.canal, json.dumps([topico, mensagem]))
+        else:
+            _em_segundo_plano(loop, self.apublicar(topico, mensagem))
+
+    async def apublicar(self, topico, mensagem):
+        await self._cliente_assincrono().publish(self.canal, json.dumps([topico, mensagem]))
+
+    def _cliente_assincrono(self):
+        import redis.asyncio
+
+        loop = asyncio.get_running_loop()
+        cliente = self._clientes_assincronos.get(loop)
+        if cliente is None:
+            cliente = self._clientes_assincronos[loop] = redis.asyncio.Redis.from_url(self._url)
+        return cliente
+
+    async def iniciar(self):
+        # Um ouvinte por processo, criado na primeira assinatura
+        if self._ouvinte is None or self._ouvinte.done():
+            self._ouvinte = asyncio.get_running_loop().create_task(self._ouvir())
+
+    async def _ouvir(self):
+        import redis.asyncio
+
+        cliente = redis.asyncio.Redis.from_url(self._url)
+        async with cliente.pubsub() as pubsub:
+            await pubsub.subscribe(self.canal)
+            async for item in pubsub.listen():
+                if item['type'] == 'message':
+                    topico, mensagem = json.loads(item['data'])
+                    hub.entregar(topico, mensagem)
+
+
+_broker = None
+_trava_broker = threading.Lock()
+
+
+def broker():
+    global _broker
+    with _trava_broker:
+        if _broker is None:
+            _broker = import_string(getattr(settings, 'EVENTOS_BROKER', 'agendamento.eventos.BrokerLocal'))()
+        return _broker
+
+
+def publicar(tipo, acao, itens):
+    """
+    Publica alterações de `tipo` ('reserva' ou 'sala'); `itens` são pares
+    (id, sala_id). Uma mensagem por sala, no tópico 'sala:<sala_id>'.
+    """
+    por_sala = defaultdict(list)
+    for objeto_id, sala_id in itens:
+        por_sala[sala_id].append(objeto_id)
+    destino = broker()
+    for sala_id, ids in por_sala.items():
+        try:
+            destino.publicar(f'sala:{sala_id}', quadro(tipo, {'acao': acao, 'sala': sala_id, 'ids': ids}))
+        except Exception:
+            # Push é melhor esforço: a alteração já foi gravada e está no log de sync
+            logger.exception('Falha ao publicar evento de %s na sala %s', tipo, sala_id)
+
+
+_pulsos = {}
+
+
+async def _pulsar():
+    """Heartbeat das conexões ociosas do loop e encerramento das que venceram"""
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            await asyncio.sleep(getattr(settings, 'EVENTOS_HEARTBEAT', 15))
+            assinaturas = hub.do_loop(loop)
+            if not assinaturas:
+                return
+            agora = loop.time()
+            for assinatura in assinaturas:
+                if assinatura.expira_em <= agora:
+                    assinatura.encerrar()
+                elif assinatura.fila.empty():
+                    assinatura.fila.put_nowait(PING)
+    finally:
+        _pulsos.pop(loop, None)
+
+
+async def assinar(topicos, duracao=None):
+    """
+    Nova assinatura no loop corrente. O fluxo da conexão lê `assinatura.fila`
+    até receber FIM, após `duracao` segundos (padrão EVENTOS_DURACAO_MAXIMA;
+    math.inf para não expirar), com a precisão do heartbeat.
+    """
+    await broker().iniciar()
+    if duracao is None:
+        duracao = getattr(settings, 'EVENTOS_DURACAO_MAXIMA', 300)
+    assinatura = Assinatura(topicos, getattr(settings, 'EVENTOS_TAMANHO_FILA', 100), duracao)
+    hub.adicionar(assinatura)
+    if assinatura.loop not in _pulsos:
+        _pulsos[assinatura.loop] = assinatura.loop.create_task(_pulsar())
+    return assinatura
+
+
+def cancelar(assinatura):
+    hub.remover(assinatura)
+
+
+async def encerrar():
+    """
+    Desligamento do servidor (lifespan.shutdown): espera as publicações
+    pendentes e cancela o heartbeat do loop corrente e o ouvinte do Redis.
+    """
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(*[tarefa for tarefa in _pendentes if tarefa.get_loop() is loop], return_exceptions=True)
+    tarefas = [_pulsos.pop(loop, None), getattr(_broker, '_ouvinte', None)]
+    tarefas = [tarefa for tarefa in tarefas if tarefa is not None and tarefa.get_loop() is loop and not tarefa.done()]
+    for tarefa in tarefas:
+        tarefa.cancel()
+    await asyncio.gather(*tarefas, return_exceptions=True)
@@ -0,0 +1,79 @@
+"""
+Geração de iCalendar (RFC 5545) para exportações e feeds de reservas.
+
+Só o necessário para VEVENTs simples: escape de texto, dobra de linhas em
+75 octetos e datas em UTC. As funções devolvem texto pronto para ser
+escrito em sequência, o que permite montar o calendário aos pedaços
+(StreamingHttpResponse) sem guardá-lo inteiro em memória.
+"""
+from datetime import timezone as dt_timezone
+
+PRODID = '-//SalaFacil//Agendamento de Salas//PT-BR'
+
+STATUS = {
+    'agendada': 'CONFIRMED',
+    'em_andamento': 'CONFIRMED',
+    'concluida': 'CONFIRMED',
+    'cancelada': 'CANCELLED',
+}
+
+
+def escapar(texto):
+    return (
+        (texto or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+        .replace('\r\n', '\\n').replace('\n', '\\n')
+    )
+
+
+def data_hora(valor):
+    return valor.astimezone(dt_timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def _dobrar(linha):
+    """Quebra linhas com mais de 75 octetos, sem partir caracteres UTF-8"""
+    if len(linha.encode()) <= 75:
+        return linha + '\r\n'
+    partes, atual, tamanho = [], '', 0
+    for caractere in linha:
+        octetos = len(caractere.encode())
+        # Linhas de continuação começam com um espaço, que conta no limite
+        if tamanho + octetos > (75 if not partes else 74):
+            partes.append(atual)
+            atual, tamanho = '', 0
+        atual += caractere
+        tamanho += octetos
+    partes.append(atual)
+    return '\r\n '.join(partes) + '\r\n'
+
+
+def cabecalho(nome):
+    return ''.join(_dobrar(linha) for linha in (
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        f'PRODID:{PRODID}',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        f'X-WR-CALNAME:{escapar(nome)}',
+    ))
+
+
+def rodape():
+    return 'END:VCALENDAR\r\n'
+
+
+def evento(reserva_id, titulo, descricao, data_inicio, data_fim, status, atualizado_em, local=''):
+    linhas = [
+        'BEGIN:VEVENT',
+        f'UID:reserva-{reserva_id}@salafacil',
+        f'DTSTAMP:{data_hora(atualizado_em)}',
+        f'LAST-MODIFIED:{data_hora(atualizado_em)}',
+        f'DTSTART:{data_hora(data_inicio)}',
+        f'DTEND:{data_hora(data_fim)}',
+        f'SUMMARY:{escapar(titulo)}',
+    ]
+    if descricao:
+        linhas.append(f'DESCRIPTION:{escapar(descricao)}')
+    if local:
+        linhas.append(f'LOCATION:{escapar(local)}')
+    linhas += [f'STATUS:{STATUS.get(status, "CONFIRMED")}', 'END:VEVENT']
+    return ''.join(_dobrar(linha) for linha in linhas)
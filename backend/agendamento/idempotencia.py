@@ -0,0 +1,137 @@
+"""
+Suporte ao cabeçalho Idempotency-Key em ações que criam ou alteram reservas.
+
+A primeira requisição com uma chave grava um registro provisório em
+ChaveIdempotencia, executa a ação e guarda o status e o corpo da resposta.
+Repetições da mesma chave (pelo mesmo usuário) devolvem a resposta
+guardada sem executar a ação de novo, com o cabeçalho
+`Idempotent-Replayed: true`. Enquanto a original não termina, as
+repetições recebem 409; a mesma chave com outra requisição recebe 422.
+Respostas 5xx não são guardadas, para que o cliente possa tentar de novo.
+
+O registro provisório é um arrendamento de IDEMPOTENCIA_PENDENTE_SEGUNDOS
+contados de `criado_em`: se o worker morre no meio da ação (timeout do
+gunicorn, deploy), nada o remove, e depois desse prazo uma repetição
+assume a chave e executa a ação. O prazo deve passar do timeout das
+requisições, para não haver duas execuções ao mesmo tempo; a original que
+ainda termine depois disso não sobrescreve o registro assumido.
+"""
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import ChaveIdempotencia
+
+CABECALHO = 'Idempotency-Key'
+
+
+def _ttl():
+    return timedelta(hours=getattr(settings, 'IDEMPOTENCIA_TTL_HORAS', 24))
+
+
+def _arrendamento():
+    return timedelta(seconds=getattr(settings, 'IDEMPOTENCIA_PENDENTE_SEGUNDOS', 60))
+
+
+def _impressao(request):
+    """Identifica a requisição: método, caminho e corpo (JSON canônico)"""
+    try:
+        corpo = json.dumps(request.data, sort_keys=True, separators=(',', ':'), default=str)
+    except TypeError:
+        corpo = repr(request.data)
+    conteudo = '\n'.join([request.method, request.path, corpo])
+    return hashlib.sha256(conteudo.encode()).hexdigest()
+
+
+def _assumir(registro, agora):
+    """Renova o arrendamento de um registro provisório vencido; False se outra requisição o assumiu antes"""
+    assumido = ChaveIdempotencia.objects.filter(
+        pk=registro.pk, status_code__isnull=True, criado_em=registro.criado_em,
+    ).update(criado_em=agora)
+    registro.criado_em = agora
+    return assumido == 1
+
+
+def _reservar(usuario, chave, impressao):
+    """Registro provisório da chave, ou o registro já existente (não expirado)"""
+    agora = timezone.now()
+    limite = agora - _ttl()
+    for _ in range(2):
+        existente = ChaveIdempotencia.objects.filter(usuario=usuario, chave=chave).first()
+        if existente is not None:
+            if existente.criado_em >= limite:
+                # Provisório cuja requisição não terminou no prazo (worker encerrado)
+                vencido = existente.status_code is None and existente.criado_em < agora - _arrendamento()
+                if vencido and existente.impressao == impressao and _assumir(existente, agora):
+                    return existente, True
+                return existente, False
+            # Expirada e ainda não removida por limpar_expirados
+            existente.delete()
+        try:
+            with transaction.atomic():
+                return ChaveIdempotencia.objects.create(usuario=usuario, chave=chave, impressao=impressao), True
+        except IntegrityError:
+            # Outra requisição com a mesma chave gravou o registro antes
+            continue
+    return ChaveIdempotencia.objects.get(usuario=usuario, chave=chave), False
+
+
+def _repetir(registro, impressao):
+    if registro.impressao != impressao:
+        return Response(
+            {'error': f'{CABECALHO} já usada com outra requisição'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    if registro.status_code is None:
+        return Response(
+            {'error': f'A requisição original com esta {CABECALHO} ainda está em processamento'},
+            status=status.HTTP_409_CONFLICT, headers={'Retry-After': '1'},
+        )
+    return Response(registro.corpo, status=registro.status_code, headers={'Idempotent-Replayed': 'true'})
+
+
+def idempotente(metodo):
+    """
+    Decorador para métodos de ViewSet. Sem o cabeçalho, ou para usuários
+    anônimos, a ação roda normalmente.
+    """
+    @wraps(metodo)
+    def envoltorio(view, request, *args, **kwargs):
+        chave = request.headers.get(CABECALHO)
+        if not chave or not request.user.is_authenticated:
+            return metodo(view, request, *args, **kwargs)
+        if len(chave) > ChaveIdempotencia._meta.get_field('chave').max_length:
+            return Response({'error': f'{CABECALHO} muito longa'}, status=status.HTTP_400_BAD_REQUEST)
+
+        impressao = _impressao(request)
+        registro, novo = _reservar(request.user, chave, impressao)
+        if not novo:
+            return _repetir(registro, impressao)
+
+        # Só o registro deste arrendamento: se ele venceu e outra requisição
+        # assumiu a chave, o resultado desta não a sobrescreve
+        proprio = ChaveIdempotencia.objects.filter(
+            pk=registro.pk, status_code__isnull=True, criado_em=registro.criado_em,
+        )
+        try:
+            try:
+                resposta = metodo(view, request, *args, **kwargs)
+            except Exception as exc:
+                # Erros de validação/permissão também são respostas definitivas
+                resposta = view.handle_exception(exc)
+        except BaseException:
+            proprio.delete()
+            raise
+        if resposta.status_code >= 500:
+            proprio.delete()
+        else:
+            proprio.update(status_code=resposta.status_code, corpo=resposta.data)
+        return resposta
+    return envoltorio
@@ -0,0 +1,38 @@
+"""
+Medição de consultas SQL e tempo de uma requisição, para cabeçalhos de depuração.
+"""
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+
+
+class Medicao:
+    def __init__(self):
+        self.consultas = 0
+        self.tempo_banco = 0.0
+        self.tempo_total = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.consultas += 1
+            self.tempo_banco += time.perf_counter() - inicio
+
+    def server_timing(self):
+        """Valor do cabeçalho Server-Timing (durações em ms)"""
+        return (
+            f'db;desc="{self.consultas} consultas";dur={self.tempo_banco * 1000:.1f}, '
+            f'total;dur={self.tempo_total * 1000:.1f}'
+        )
+
+
+@contextmanager
+def medir_consultas():
+    medicao = Medicao()
+    inicio = time.perf_counter()
+    with connection.execute_wrapper(medicao):
+        yield medicao
+    medicao.tempo_total = time.perf_counter() - inicio
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from agendamento.transicoes import avancar_status, proxima_transicao
+
+
+class Command(BaseCommand):
+    help = (
+        'Avança o status das reservas (agendada -> em_andamento -> concluida) '
+        'conforme o horário. Com --loop, fica rodando e acorda no próximo início/fim.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Continua rodando como worker')
+        parser.add_argument('--lote', type=int, default=500, help='Reservas por UPDATE (padrão: 500)')
+        parser.add_argument(
+            '--espera-maxima', type=float, default=60,
+            help='Segundos máximos entre execuções no modo --loop, para reservas criadas '
+                 'depois do cálculo da próxima transição (padrão: 60)',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            agora = timezone.now()
+            totais = avancar_status(agora, tamanho_lote=options['lote'])
+            if any(totais.values()) or options['verbosity'] > 1:
+                self.stdout.write(
+                    f"{timezone.localtime(agora):%Y-%m-%d %H:%M:%S} "
+                    f"em_andamento: {totais['em_andamento']}, concluida: {totais['concluida']}"
+                )
+            if not options['loop']:
+                return
+
+            proxima = proxima_transicao(agora)
+            espera = options['espera_maxima']
+            if proxima is not None:
+                espera = min(espera, max(0, (proxima - timezone.now()).total_seconds()))
+            # A conexão não fica aberta (e expirando no servidor) durante a espera
+            connection.close()
+            time.sleep(espera)
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils.module_loading import autodiscover_modules
+
+from agendamento.benchmarks import CENARIOS
+
+# Cada app registra seus cenários no próprio módulo benchmarks (ex.: chat)
+autodiscover_modules('benchmarks')
+
+
+class Command(BaseCommand):
+    help = 'Executa um cenário de benchmark em um banco de teste descartável'
+
+    def add_arguments(self, parser):
+        parser.add_argument('cenario', choices=sorted(CENARIOS))
+        parser.add_argument(
+            '-o', '--opcao', action='append', default=[], metavar='CHAVE=VALOR',
+            help='Parâmetro inteiro do cenário, ex.: -o salas=500 -o dias=365',
+        )
+
+    def handle(self, *args, **options):
+        opcoes = {}
+        for item in options['opcao']:
+            chave, _, valor = item.partition('=')
+            try:
+                opcoes[chave] = int(valor)
+            except ValueError:
+                raise CommandError(f'Valor inválido para {chave}: {valor!r}')
+
+        # O esquema vem direto dos models, sem rodar as migrações: o banco é
+        # descartado ao final e nunca toca os dados reais
+        connection.settings_dict.setdefault('TEST', {})['MIGRATE'] = False
+        nome_original = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            CENARIOS[options['cenario']](self.stdout, **opcoes)
+        finally:
+            connection.creation.destroy_test_db(nome_original, verbosity=0)
@@ -0,0 +1,33 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from agendamento import sincronizacao
+from agendamento.models import ChaveIdempotencia
+
+
+class Command(BaseCommand):
+    help = 'Remove registros auxiliares vencidos (chaves de idempotência e log de sincronização)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=5000, help='Linhas por DELETE (padrão: 5000)')
+
+    def _remover(self, queryset, tamanho):
+        """DELETE em lotes de ids, para não segurar transações longas"""
+        total = 0
+        while True:
+            ids = list(queryset.order_by().values_list('pk', flat=True)[:tamanho])
+            if not ids:
+                return total
+            queryset.model.objects.filter(pk__in=ids).delete()
+            total += len(ids)
+
+    def handle(self, *args, **options):
+        limite = timezone.now() - timedelta(hours=settings.IDEMPOTENCIA_TTL_HORAS)
+        removidas = self._remover(ChaveIdempotencia.objects.filter(criado_em__lt=limite), options['lote'])
+        self.stdout.write(f'Chaves de idempotência removidas: {removidas}')
+
+        removidos = sincronizacao.limpar(timedelta(days=settings.SYNC_RETENCAO_DIAS), options['lote'])
+        self.stdout.write(f'Registros de alteração removidos: {removidos}')
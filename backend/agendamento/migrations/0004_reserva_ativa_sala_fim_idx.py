@@ -0,0 +1,17 @@
+# Generated by Django 4.2.23 on 2026-10-18 15:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agendamento', '0003_department_userprofile_pushnotification_adminlog'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='reserva',
+            index=models.Index(condition=models.Q(('status__in', ['agendada', 'em_andamento'])), fields=['sala', 'data_fim'], name='reserva_ativa_sala_fim_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.23 on 2026-10-18 15:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agendamento', '0004_reserva_ativa_sala_fim_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='reserva',
+            index=models.Index(condition=models.Q(('status__in', ['agendada', 'em_andamento'])), fields=['sala', 'data_inicio'], name='reserva_ativa_sala_inicio_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reserva',
+            index=models.Index(condition=models.Q(('status__in', ['agendada', 'em_andamento'])), fields=['data_fim', 'data_inicio'], name='reserva_ativa_fim_inicio_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reserva',
+            index=models.Index(fields=['sala', 'data_inicio'], name='reserva_sala_inicio_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reserva',
+            index=models.Index(fields=['usuario', 'data_inicio'], name='reserva_usuario_inicio_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reserva',
+            index=models.Index(fields=['data_inicio'], name='reserva_inicio_idx'),
+        ),
+    ]
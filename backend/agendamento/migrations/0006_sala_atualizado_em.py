@@ -0,0 +1,20 @@
+# Generated by Django 4.2.23 on 2026-10-18 16:40
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agendamento', '0005_reserva_indices_consultas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sala',
+            name='atualizado_em',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
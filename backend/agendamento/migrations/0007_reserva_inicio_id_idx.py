@@ -0,0 +1,21 @@
+# Generated by Django 4.2.23 on 2026-10-18 17:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agendamento', '0006_sala_atualizado_em'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='reserva',
+            name='reserva_inicio_idx',
+        ),
+        migrations.AddIndex(
+            model_name='reserva',
+            index=models.Index(fields=['data_inicio', 'id'], name='reserva_inicio_id_idx'),
+        ),
+    ]
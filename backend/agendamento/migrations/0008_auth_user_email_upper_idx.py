@@ -0,0 +1,28 @@
+# Generated by Django 4.2.23 on 2026-10-18 17:40
+
+from django.db import migrations
+
+
+def criar_indice(apps, schema_editor):
+    # email__iexact vira UPPER(email::text) = UPPER(%s) no PostgreSQL
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS auth_user_email_upper_idx ON auth_user (UPPER(email::text))'
+        )
+
+
+def remover_indice(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS auth_user_email_upper_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('agendamento', '0007_reserva_inicio_id_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(criar_indice, remover_indice),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.23 on 2026-10-18 17:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+import agendamento.models
+
+
+def preencher_tokens(apps, schema_editor):
+    Sala = apps.get_model('agendamento', 'Sala')
+    for sala in Sala.objects.filter(token_calendario__isnull=True).only('pk'):
+        sala.token_calendario = agendamento.models.gerar_token_calendario()
+        sala.save(update_fields=['token_calendario'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agendamento', '0008_auth_user_email_upper_idx'),
+    ]
+
+    operations = [
+        # Salas existentes recebem tokens distintos antes da restrição unique
+        migrations.AddField(
+            model_name='sala',
+            name='token_calendario',
+            field=models.CharField(editable=False, max_length=64, null=True),
+        ),
+        migrations.RunPython(preencher_tokens, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='sala',
+            name='token_calendario',
+            field=models.CharField(default=agendamento.models.gerar_token_calendario, editable=False, max_length=64, unique=True),
+        ),
+        migrations.CreateModel(
+            name='CalendarioSala',
+            fields=[
+                ('sala', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='calendario', serialize=False, to='agendamento.sala')),
+                ('conteudo', models.TextField(blank=True)),
+                ('etag', models.CharField(blank=True, max_length=64)),
+                ('versao', models.PositiveIntegerField(default=0)),
+                ('versao_gerada', models.PositiveIntegerField(blank=True, null=True)),
+                ('gerado_em', models.DateTimeField(blank=True, null=True)),
+                ('modificado_em', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Calendário da Sala',
+                'verbose_name_plural': 'Calendários das Salas',
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.23 on 2026-10-18 17:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agendamento', '0010_chaveidempotencia'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RegistroAlteracao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('modelo', models.CharField(choices=[('reserva', 'Reserva'), ('sala', 'Sala')], max_length=10)),
+                ('objeto_id', models.BigIntegerField()),
+                ('criado_em', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Registro de Alteração',
+                'verbose_name_plural': 'Registros de Alterações',
+            },
+        ),
+    ]
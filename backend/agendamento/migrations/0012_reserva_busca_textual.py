@@ -0,0 +1,70 @@
+# Generated by Django 4.2.23 on 2026-10-18 23:10
+
+from django.db import migrations
+
+# Coluna tsvector + GIN no PostgreSQL, FTS5 no SQLite (ver agendamento.busca).
+# SQL fixo, e não gerado por IndiceTexto: a migração não muda se o módulo mudar
+CRIAR = {
+    'postgresql': [
+        'ALTER TABLE agendamento_reserva ADD COLUMN IF NOT EXISTS busca tsvector',
+        """
+        CREATE OR REPLACE FUNCTION agendamento_reserva_busca_atualizar() RETURNS trigger AS $$
+        BEGIN
+            -- save() do Django regrava todas as colunas: só recalcula se o texto mudou
+            IF TG_OP = 'UPDATE' AND NEW.titulo IS NOT DISTINCT FROM OLD.titulo AND NEW.descricao IS NOT DISTINCT FROM OLD.descricao THEN
+                RETURN NEW;
+            END IF;
+            NEW.busca := setweight(to_tsvector('portuguese', coalesce(NEW.titulo, '')), 'A') || setweight(to_tsvector('portuguese', coalesce(NEW.descricao, '')), 'B');
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        'DROP TRIGGER IF EXISTS agendamento_reserva_busca_trg ON agendamento_reserva',
+        'CREATE TRIGGER agendamento_reserva_busca_trg BEFORE INSERT OR UPDATE OF titulo, descricao ON agendamento_reserva FOR EACH ROW EXECUTE FUNCTION agendamento_reserva_busca_atualizar()',
+        "UPDATE agendamento_reserva SET busca = setweight(to_tsvector('portuguese', coalesce(titulo, '')), 'A') || setweight(to_tsvector('portuguese', coalesce(descricao, '')), 'B')",
+        'CREATE INDEX IF NOT EXISTS agendamento_reserva_busca_idx ON agendamento_reserva USING GIN (busca)',
+    ],
+    'sqlite': [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS agendamento_reserva_fts USING fts5(titulo, descricao, content='agendamento_reserva', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+        'CREATE TRIGGER IF NOT EXISTS agendamento_reserva_fts_ai AFTER INSERT ON agendamento_reserva BEGIN INSERT INTO agendamento_reserva_fts(rowid, titulo, descricao) VALUES (new.id, new.titulo, new.descricao); END',
+        "CREATE TRIGGER IF NOT EXISTS agendamento_reserva_fts_ad AFTER DELETE ON agendamento_reserva BEGIN INSERT INTO agendamento_reserva_fts(agendamento_reserva_fts, rowid, titulo, descricao) VALUES ('delete', old.id, old.titulo, old.descricao); END",
+        "CREATE TRIGGER IF NOT EXISTS agendamento_reserva_fts_au AFTER UPDATE OF titulo, descricao ON agendamento_reserva BEGIN INSERT INTO agendamento_reserva_fts(agendamento_reserva_fts, rowid, titulo, descricao) VALUES ('delete', old.id, old.titulo, old.descricao); INSERT INTO agendamento_reserva_fts(rowid, titulo, descricao) VALUES (new.id, new.titulo, new.descricao); END",
+        "INSERT INTO agendamento_reserva_fts(agendamento_reserva_fts) VALUES ('rebuild')",
+    ],
+}
+
+REMOVER = {
+    'postgresql': [
+        'DROP TRIGGER IF EXISTS agendamento_reserva_busca_trg ON agendamento_reserva',
+        'DROP FUNCTION IF EXISTS agendamento_reserva_busca_atualizar()',
+        'DROP INDEX IF EXISTS agendamento_reserva_busca_idx',
+        'ALTER TABLE agendamento_reserva DROP COLUMN IF EXISTS busca',
+    ],
+    'sqlite': [
+        'DROP TRIGGER IF EXISTS agendamento_reserva_fts_ad',
+        'DROP TRIGGER IF EXISTS agendamento_reserva_fts_ai',
+        'DROP TRIGGER IF EXISTS agendamento_reserva_fts_au',
+        'DROP TABLE IF EXISTS agendamento_reserva_fts',
+    ],
+}
+
+
+def criar_indice(apps, schema_editor):
+    for comando in CRIAR.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(comando)
+
+
+def remover_indice(apps, schema_editor):
+    for comando in REMOVER.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(comando)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agendamento', '0011_registroalteracao'),
+    ]
+
+    operations = [
+        migrations.RunPython(criar_indice, remover_indice),
+    ]
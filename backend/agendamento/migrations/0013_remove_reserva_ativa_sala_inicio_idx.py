@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23 on 2026-10-18 23:40
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agendamento', '0012_reserva_busca_textual'),
+    ]
+
+    operations = [
+        # Redundante com reserva_sala_inicio_idx, que cobre as mesmas colunas
+        migrations.RemoveIndex(
+            model_name='reserva',
+            name='reserva_ativa_sala_inicio_idx',
+        ),
+    ]
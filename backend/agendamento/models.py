@@ -1,7 +1,32 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.db.models import Q
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.utils import timezone
 from datetime import datetime
+import secrets
+
+from . import busca
+
+def gerar_token_calendario():
+    return secrets.token_urlsafe(32)
+
+class SalaQuerySet(models.QuerySet):
+    def com_reservas_ativas(self):
+        """Anota `reservas_ativas_count` com as reservas ativas ainda não encerradas"""
+        # Subconsulta correlacionada: usa o índice parcial (sala, data_fim)
+        # em vez de juntar todo o histórico de reservas de cada sala
+        contagem = Reserva.objects.ativas().filter(
+            sala=models.OuterRef('pk'),
+            data_fim__gte=timezone.now(),
+        ).order_by().values('sala').annotate(total=models.Count('pk')).values('total')
+        return self.annotate(
+            reservas_ativas_count=Coalesce(
+                models.Subquery(contagem, output_field=models.IntegerField()), 0
+            )
+        )
 
 class Sala(models.Model):
     nome = models.CharField(max_length=100, unique=True)
@@ -9,6 +34,11 @@ class Sala(models.Model):
     recursos = models.TextField(blank=True, help_text="Ex: Projetor, TV, Lousa")
     ativa = models.BooleanField(default=True)
     criado_em = models.DateTimeField(auto_now_add=True)
+    atualizado_em = models.DateTimeField(auto_now=True)
+    # Token secreto da URL pública do calendário (.ics) da sala
+    token_calendario = models.CharField(max_length=64, unique=True, default=gerar_token_calendario, editable=False)
+    
+    objects = SalaQuerySet.as_manager()
     
     class Meta:
         verbose_name = "Sala"
@@ -18,7 +48,59 @@ class Sala(models.Model):
     def __str__(self):
         return f"{self.nome} (Cap: {self.capacidade})"
 
+class ReservaQuerySet(models.QuerySet):
+    def ativas(self):
+        return self.filter(status__in=Reserva.STATUS_ATIVOS)
+
+    def para_listagem(self):
+        """Junta sala e usuário lendo apenas as colunas usadas por ReservaSerializer"""
+        campos_reserva = [f.attname for f in Reserva._meta.concrete_fields]
+        return self.select_related('sala', 'usuario').only(
+            *campos_reserva,
+            'sala__nome',
+            'usuario__first_name',
+            'usuario__last_name',
+        )
+
+    def conflitantes(self, sala, data_inicio, data_fim, excluir=None):
+        """
+        Reservas ativas da sala (exceto `excluir`) que se sobrepõem ao
+        intervalo [data_inicio, data_fim).
+
+        Filtro de sobreposição completo, e não só a última reserva iniciada
+        antes de `data_fim`: nada no banco impede que reservas ativas se
+        sobreponham (bulk_create, update() em lote), e uma reserva longa
+        anterior ficaria escondida atrás de uma curta. A faixa
+        data_fim > data_inicio no índice parcial (sala, data_fim) limita a
+        varredura às reservas ativas ainda não encerradas naquele ponto.
+        """
+        conflitos = self.ativas().filter(
+            sala=sala,
+            data_fim__gt=data_inicio,
+            data_inicio__lt=data_fim,
+        )
+        if excluir is not None:
+            conflitos = conflitos.exclude(pk=excluir)
+        return conflitos
+
+    def conflitantes_em_lote(self, sala, intervalos):
+        """
+        Reservas ativas da sala que se sobrepõem a qualquer um dos intervalos
+        [(data_inicio, data_fim), ...], em uma única consulta.
+        """
+        sobreposicao = Q()
+        for data_inicio, data_fim in intervalos:
+            sobreposicao |= Q(data_fim__gt=data_inicio, data_inicio__lt=data_fim)
+        if not sobreposicao:
+            return self.none()
+        return self.ativas().filter(sobreposicao, sala=sala)
+
+    def buscar(self, texto):
+        """Reservas cujo título ou descrição casa com `texto`, das mais relevantes para as menos"""
+        return INDICE_BUSCA.buscar(self, texto)
+
 class Reserva(models.Model):
+    STATUS_ATIVOS = ['agendada', 'em_andamento']
     STATUS_CHOICES = [
         ('agendada', 'Agendada'),
         ('em_andamento', 'Em Andamento'),
@@ -37,10 +119,32 @@ class Reserva(models.Model):
     criado_em = models.DateTimeField(auto_now_add=True)
     atualizado_em = models.DateTimeField(auto_now=True)
     
+    objects = ReservaQuerySet.as_manager()
+    
     class Meta:
         verbose_name = "Reserva"
         verbose_name_plural = "Reservas"
         ordering = ['-data_inicio']
+        indexes = [
+            # Verificação de conflitos e reservas ativas por sala
+            models.Index(
+                fields=['sala', 'data_fim'],
+                name='reserva_ativa_sala_fim_idx',
+                condition=Q(status__in=['agendada', 'em_andamento']),
+            ),
+            # Salas ocupadas em um horário (disponiveis, dashboard)
+            models.Index(
+                fields=['data_fim', 'data_inicio'],
+                name='reserva_ativa_fim_inicio_idx',
+                condition=Q(status__in=['agendada', 'em_andamento']),
+            ),
+            # Listagem com filtros de sala/usuário ordenada por data; também atende
+            # a agenda da sala (status fica como filtro residual)
+            models.Index(fields=['sala', 'data_inicio'], name='reserva_sala_inicio_idx'),
+            models.Index(fields=['usuario', 'data_inicio'], name='reserva_usuario_inicio_idx'),
+            # Paginação por cursor em (data_inicio, id)
+            models.Index(fields=['data_inicio', 'id'], name='reserva_inicio_id_idx'),
+        ]
     
     def clean(self):
         if self.data_inicio >= self.data_fim:
@@ -49,15 +153,16 @@ class Reserva(models.Model):
         if self.participantes > self.sala.capacidade:
             raise ValidationError(f"Número de participantes ({self.participantes}) excede a capacidade da sala ({self.sala.capacidade}).")
         
-        # Verificar conflitos de horário
-        conflitos = Reserva.objects.filter(
-            sala=self.sala,
-            status__in=['agendada', 'em_andamento']
-        ).exclude(pk=self.pk)
+        # Verificar conflitos de horário (uma única consulta indexada)
+        if self.status not in self.STATUS_ATIVOS:
+            return
         
-        for reserva in conflitos:
-            if (self.data_inicio < reserva.data_fim and self.data_fim > reserva.data_inicio):
-                raise ValidationError(f"Conflito de horário com a reserva: {reserva.titulo}")
+        conflito = Reserva.objects.conflitantes(
+            self.sala, self.data_inicio, self.data_fim, excluir=self.pk
+        ).order_by('data_inicio').values_list('titulo', flat=True).first()
+        
+        if conflito is not None:
+            raise ValidationError(f"Conflito de horário com a reserva: {conflito}", code='conflito')
     
     def save(self, *args, **kwargs):
         self.clean()
@@ -66,6 +171,12 @@ class Reserva(models.Model):
     def __str__(self):
         return f"{self.titulo} - {self.sala.nome} ({self.data_inicio.strftime('%d/%m/%Y %H:%M')})"
 
+# Busca textual (agendamento.busca), criada na migração 0012
+INDICE_BUSCA = busca.registrar(
+    busca.IndiceTexto('agendamento_reserva', [('titulo', 'A'), ('descricao', 'B')]),
+    ('agendamento', '0012_reserva_busca_textual'),
+)
+
 class PerfilUsuario(models.Model):
     DEPARTAMENTOS = [
         ('ti', 'Tecnologia da Informação'),
@@ -90,3 +201,72 @@ class PerfilUsuario(models.Model):
     
     def __str__(self):
         return f"Perfil de {self.usuario.get_full_name() or self.usuario.username}"
+
+class CalendarioSala(models.Model):
+    """
+    Feed iCalendar pré-gerado de uma sala. Alterações nas reservas apenas
+    incrementam `versao`; o conteúdo é refeito na próxima leitura quando
+    `versao_gerada` ficou para trás (ver calendario.py).
+    """
+    sala = models.OneToOneField(Sala, on_delete=models.CASCADE, primary_key=True, related_name='calendario')
+    conteudo = models.TextField(blank=True)
+    etag = models.CharField(max_length=64, blank=True)
+    versao = models.PositiveIntegerField(default=0)
+    versao_gerada = models.PositiveIntegerField(null=True, blank=True)
+    gerado_em = models.DateTimeField(null=True, blank=True)
+    modificado_em = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        verbose_name = "Calendário da Sala"
+        verbose_name_plural = "Calendários das Salas"
+    
+    def __str__(self):
+        return f"Calendário de {self.sala.nome}"
+
+class ChaveIdempotencia(models.Model):
+    """
+    Resposta guardada de uma requisição feita com o cabeçalho Idempotency-Key.
+    `status_code` nulo indica que a requisição original ainda está em
+    processamento, por até IDEMPOTENCIA_PENDENTE_SEGUNDOS desde `criado_em`.
+    Removida após IDEMPOTENCIA_TTL_HORAS (limpar_expirados).
+    """
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chaves_idempotencia')
+    chave = models.CharField(max_length=255)
+    impressao = models.CharField(max_length=64, help_text="SHA-256 de método, caminho e corpo")
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    corpo = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    criado_em = models.DateTimeField(auto_now_add=True, db_index=True)
+    
+    class Meta:
+        verbose_name = "Chave de Idempotência"
+        verbose_name_plural = "Chaves de Idempotência"
+        constraints = [
+            models.UniqueConstraint(fields=['usuario', 'chave'], name='idempotencia_usuario_chave_uniq'),
+        ]
+    
+    def __str__(self):
+        return f"{self.chave} ({self.usuario_id})"
+
+class RegistroAlteracao(models.Model):
+    """
+    Log de alterações de Reserva e Sala para a sincronização incremental
+    (/api/sync/). O id é o token de mudança: cada gravação ou remoção
+    acrescenta uma linha, inclusive as feitas em lote. Linhas de objetos
+    removidos funcionam como tombstones até serem apagadas por
+    limpar_expirados, após SYNC_RETENCAO_DIAS.
+    """
+    MODELOS = [
+        ('reserva', 'Reserva'),
+        ('sala', 'Sala'),
+    ]
+    
+    modelo = models.CharField(max_length=10, choices=MODELOS)
+    objeto_id = models.BigIntegerField()
+    criado_em = models.DateTimeField(auto_now_add=True, db_index=True)
+    
+    class Meta:
+        verbose_name = "Registro de Alteração"
+        verbose_name_plural = "Registros de Alterações"
+    
+    def __str__(self):
+        return f"#{self.pk} {self.modelo} {self.objeto_id}"
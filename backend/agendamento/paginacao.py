@@ -0,0 +1,186 @@
+"""
+Paginação por chave (keyset) para listagens longas.
+
+Em vez de COUNT(*) e OFFSET, cada página continua a partir dos valores de
+ordenação do último item visto, codificados em um cursor opaco. O custo de
+buscar a página N independe de N. Clientes que precisam de números de
+página podem continuar usando `?page=N`.
+
+Resultados de busca, ordenados por relevância, usam BuscaPagination.
+"""
+import base64
+import json
+from collections import OrderedDict
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Subclasses definem `ordering` com campos que, juntos, são únicos
+    (o último deve ser a chave primária), ex.: ('-data_inicio', '-id').
+    """
+    ordering = ('-id',)
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    offset_query_param = 'page'
+
+    def __init__(self):
+        self._offset = None
+
+    # Modo por número de página (opcional)
+
+    def _usar_offset(self, request):
+        if self.offset_query_param in request.query_params:
+            if self._offset is None:
+                self._offset = PageNumberPagination()
+                self._offset.page_size = self.page_size
+                self._offset.page_size_query_param = self.page_size_query_param
+                self._offset.max_page_size = self.max_page_size
+            return True
+        return False
+
+    # Cursores
+
+    def _campos(self):
+        return [(campo.lstrip('-'), campo.startswith('-')) for campo in self.ordering]
+
+    def _codificar(self, item, direcao):
+        valores = [getattr(item, nome) for nome, _ in self._campos()]
+        dados = json.dumps({'v': valores, 'd': direcao}, default=str, separators=(',', ':'))
+        return base64.urlsafe_b64encode(dados.encode()).decode().rstrip('=')
+
+    def _decodificar(self, cursor, modelo):
+        try:
+            dados = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            valores = [
+                modelo._meta.get_field(nome).to_python(valor)
+                for (nome, _), valor in zip(self._campos(), dados['v'], strict=True)
+            ]
+            if dados['d'] not in ('n', 'p'):
+                raise ValueError
+        except Exception:
+            raise NotFound('Cursor inválido.')
+        return valores, dados['d']
+
+    def _filtro_apos(self, valores, invertido):
+        """
+        Itens depois de `valores` na ordenação (ou antes, se invertido).
+        A condição sobre o primeiro campo vem isolada para que o banco use
+        uma busca por faixa no índice.
+        """
+        campos = self._campos()
+        condicao = None
+        for (nome, desc), valor in reversed(list(zip(campos, valores))):
+            operador = 'lt' if desc != invertido else 'gt'
+            estrito = Q(**{f'{nome}__{operador}': valor})
+            condicao = estrito if condicao is None else estrito | (Q(**{nome: valor}) & condicao)
+        nome, desc = campos[0]
+        limite = Q(**{f'{nome}__{"lte" if desc != invertido else "gte"}': valores[0]})
+        return limite & condicao
+
+    def _ordenacao(self, invertido):
+        if not invertido:
+            return list(self.ordering)
+        return [campo[1:] if campo.startswith('-') else '-' + campo for campo in self.ordering]
+
+    def get_page_size(self, request):
+        try:
+            tamanho = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(tamanho, self.max_page_size))
+
+    def _janela(self, queryset, request):
+        """Queryset da página pedida (com um item extra) e a direção da leitura"""
+        cursor = request.query_params.get(self.cursor_query_param)
+        direcao = None
+        if cursor:
+            valores, direcao = self._decodificar(cursor, queryset.model)
+            queryset = queryset.filter(self._filtro_apos(valores, invertido=direcao == 'p'))
+        tamanho = self.get_page_size(request)
+        queryset = queryset.order_by(*self._ordenacao(invertido=direcao == 'p'))
+        return queryset[:tamanho + 1], direcao, tamanho
+
+    def validadores(self, queryset, request):
+        """Chaves e `atualizado_em` dos itens da página, para o ETag (sem COUNT)"""
+        if self._usar_offset(request):
+            return None
+        janela, _, _ = self._janela(queryset, request)
+        return list(janela.values_list('pk', 'atualizado_em'))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        if self._usar_offset(request):
+            return self._offset.paginate_queryset(queryset, request, view)
+
+        janela, direcao, tamanho = self._janela(queryset, request)
+        itens = list(janela)
+        tem_mais = len(itens) > tamanho
+        itens = itens[:tamanho]
+        if direcao == 'p':
+            itens.reverse()
+            self.tem_proxima, self.tem_anterior = True, tem_mais
+        else:
+            self.tem_proxima, self.tem_anterior = tem_mais, direcao == 'n'
+        self.itens = itens
+        return itens
+
+    def _link(self, item, direcao):
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.offset_query_param)
+        return replace_query_param(url, self.cursor_query_param, self._codificar(item, direcao))
+
+    def get_next_link(self):
+        if not self.itens or not self.tem_proxima:
+            return None
+        return self._link(self.itens[-1], 'n')
+
+    def get_previous_link(self):
+        if not self.itens or not self.tem_anterior:
+            return None
+        return self._link(self.itens[0], 'p')
+
+    def get_paginated_response(self, data):
+        if self._usar_offset(self.request):
+            return self._offset.get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class ReservaPagination(KeysetPagination):
+    ordering = ('-data_inicio', '-id')
+
+
+class UsuarioPagination(KeysetPagination):
+    ordering = ('id',)
+
+
+class BuscaPagination(PageNumberPagination):
+    """
+    Resultados da busca textual (ordenados por relevância, sem chave de
+    ordenação estável para cursor). O COUNT percorre só os itens que casam.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
@@ -1,6 +1,17 @@
-from rest_framework import serializers
+from datetime import timedelta
+from rest_framework import serializers, status
+from rest_framework.exceptions import APIException
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.utils import timezone
 from .models import Sala, Reserva, PerfilUsuario
+from .travas import reserva_atomica
+
+class ConflitoDeHorario(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Conflito de horário.'
+    default_code = 'conflito'
 
 class UsuarioSerializer(serializers.ModelSerializer):
     class Meta:
@@ -19,17 +30,47 @@ class SalaSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Sala
-        fields = '__all__'
+        # O token do feed .ics só é entregue pela ação calendario (staff)
+        exclude = ['token_calendario']
     
     def get_reservas_ativas(self, obj):
-        from datetime import datetime
+        # Valor anotado por Sala.objects.com_reservas_ativas() evita uma consulta por sala
+        if hasattr(obj, 'reservas_ativas_count'):
+            return obj.reservas_ativas_count
         reservas = obj.reservas.filter(
             status__in=['agendada', 'em_andamento'],
-            data_fim__gte=datetime.now()
+            data_fim__gte=timezone.now()
         ).count()
         return reservas
 
-class ReservaSerializer(serializers.ModelSerializer):
+class GravacaoReservaMixin:
+    """
+    Grava a reserva com a sala travada (verificação de conflito e INSERT/UPDATE
+    na mesma transação) e converte os erros de Reserva.clean() em respostas
+    da API: 409 para conflito de horário, 400 para os demais.
+    """
+    def _gravar(self, salas, gravar):
+        try:
+            with reserva_atomica(*salas):
+                return gravar()
+        except DjangoValidationError as erro:
+            if any(e.code == 'conflito' for e in erro.error_list):
+                raise ConflitoDeHorario(erro.messages[0])
+            raise serializers.ValidationError(erro.messages)
+    
+    def create(self, validated_data):
+        validated_data['usuario'] = self.context['request'].user
+        return self._gravar(
+            [validated_data['sala']], lambda: super(GravacaoReservaMixin, self).create(validated_data)
+        )
+    
+    def update(self, instance, validated_data):
+        return self._gravar(
+            [instance.sala_id, validated_data.get('sala')],
+            lambda: super(GravacaoReservaMixin, self).update(instance, validated_data),
+        )
+
+class ReservaSerializer(GravacaoReservaMixin, serializers.ModelSerializer):
     sala_nome = serializers.CharField(source='sala.nome', read_only=True)
     usuario_nome = serializers.CharField(source='usuario.get_full_name', read_only=True)
     
@@ -37,16 +78,82 @@ class ReservaSerializer(serializers.ModelSerializer):
         model = Reserva
         fields = '__all__'
         read_only_fields = ['usuario', 'criado_em', 'atualizado_em']
-    
-    def create(self, validated_data):
-        validated_data['usuario'] = self.context['request'].user
-        return super().create(validated_data)
 
-class ReservaCreateSerializer(serializers.ModelSerializer):
+class ReservaBuscaSerializer(ReservaSerializer):
+    """Resultado de Reserva.objects.buscar(), com a relevância"""
+    relevancia = serializers.FloatField(read_only=True)
+
+class ReservaCreateSerializer(GravacaoReservaMixin, serializers.ModelSerializer):
     class Meta:
         model = Reserva
         fields = ['sala', 'titulo', 'descricao', 'data_inicio', 'data_fim', 'participantes']
-    
-    def create(self, validated_data):
-        validated_data['usuario'] = self.context['request'].user
-        return super().create(validated_data)
+
+class OcorrenciaSerializer(serializers.Serializer):
+    data_inicio = serializers.DateTimeField()
+    data_fim = serializers.DateTimeField()
+
+    def validate(self, data):
+        if data['data_inicio'] >= data['data_fim']:
+            raise serializers.ValidationError("Data de início deve ser anterior à data de fim.")
+        return data
+
+class RecorrenciaSerializer(OcorrenciaSerializer):
+    """Primeira ocorrência (data_inicio/data_fim) repetida a cada `intervalo` dias ou semanas"""
+    FREQUENCIAS = {'diaria': 1, 'semanal': 7}
+
+    frequencia = serializers.ChoiceField(choices=list(FREQUENCIAS))
+    intervalo = serializers.IntegerField(min_value=1, default=1)
+    contagem = serializers.IntegerField(min_value=1, required=False)
+    ate = serializers.DateField(required=False)
+
+    def validate(self, data):
+        data = super().validate(data)
+        if ('contagem' in data) == ('ate' in data):
+            raise serializers.ValidationError("Informe 'contagem' ou 'ate'.")
+        return data
+
+    def expandir(self, data, limite):
+        """Ocorrências da regra (em horário local, estável entre mudanças de fuso); no máximo limite + 1"""
+        inicio = timezone.localtime(data['data_inicio'])
+        duracao = data['data_fim'] - data['data_inicio']
+        passo = timedelta(days=self.FREQUENCIAS[data['frequencia']] * data['intervalo'])
+        total = min(data.get('contagem', limite + 1), limite + 1)
+        fuso = inicio.tzinfo
+
+        ocorrencias = []
+        local = inicio.replace(tzinfo=None)
+        while len(ocorrencias) < total:
+            if 'ate' in data and local.date() > data['ate']:
+                break
+            data_inicio = timezone.make_aware(local, fuso)
+            ocorrencias.append({'data_inicio': data_inicio, 'data_fim': data_inicio + duracao})
+            local += passo
+        return ocorrencias
+
+class ReservaLoteSerializer(serializers.Serializer):
+    """Várias reservas da mesma sala: lista de ocorrências ou regra de recorrência"""
+    sala = serializers.PrimaryKeyRelatedField(queryset=Sala.objects.filter(ativa=True))
+    titulo = serializers.CharField(max_length=200)
+    descricao = serializers.CharField(required=False, allow_blank=True, default='')
+    participantes = serializers.IntegerField(min_value=1, default=1)
+    ocorrencias = OcorrenciaSerializer(many=True, required=False)
+    recorrencia = RecorrenciaSerializer(required=False)
+    ignorar_conflitos = serializers.BooleanField(default=False)
+
+    def validate(self, data):
+        limite = getattr(settings, 'RESERVA_LOTE_MAX_OCORRENCIAS', 200)
+        if ('ocorrencias' in data) == ('recorrencia' in data):
+            raise serializers.ValidationError("Informe 'ocorrencias' ou 'recorrencia'.")
+        if 'recorrencia' in data:
+            data['ocorrencias'] = self.fields['recorrencia'].expandir(data.pop('recorrencia'), limite)
+        if not data['ocorrencias']:
+            raise serializers.ValidationError({'ocorrencias': "Nenhuma ocorrência informada."})
+        if len(data['ocorrencias']) > limite:
+            raise serializers.ValidationError(
+                {'ocorrencias': f"Máximo de {limite} ocorrências por lote."}
+            )
+        if data['participantes'] > data['sala'].capacidade:
+            raise serializers.ValidationError(
+                f"Número de participantes ({data['participantes']}) excede a capacidade da sala ({data['sala'].capacidade})."
+            )
+        return data
@@ -0,0 +1,135 @@
+"""
+Sinais do app de agendamento: mantém os caches derivados de Reserva
+(mapas de disponibilidade, agendas e feeds .ics das salas) em dia quando
+reservas são criadas, alteradas, canceladas ou removidas; registra as
+alterações de reservas e salas para a sincronização incremental e as
+publica para os clientes de /api/eventos/; cria o perfil de novos usuários
+e descarta o usuário em cache da autenticação quando ele ou o perfil mudam.
+"""
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from . import autenticacao, cache_agenda, calendario, disponibilidade, eventos, sincronizacao
+from .models import PerfilUsuario, Reserva, Sala
+
+
+def _estado(reserva):
+    # Lê de __dict__ para não disparar consultas em campos adiados (only/defer)
+    campos = reserva.__dict__
+    return (
+        campos.get('sala_id'),
+        campos.get('data_inicio'),
+        campos.get('data_fim'),
+        campos.get('status'),
+    )
+
+
+def _ocupa(estado):
+    sala_id, data_inicio, data_fim, status = estado
+    return (
+        sala_id is not None and data_inicio is not None and data_fim is not None
+        and status in Reserva.STATUS_ATIVOS
+    )
+
+
+def reservas_alteradas(alteracoes):
+    """
+    Propaga alterações de reservas para os caches derivados.
+
+    `alteracoes` é uma lista de pares (estado_anterior, estado_atual), cada
+    estado no formato (sala_id, data_inicio, data_fim, status) ou None.
+    Usado pelos sinais e pelas operações em lote que não disparam save().
+    A propagação acontece após o commit da transação corrente.
+    """
+    def propagar():
+        salas = set()
+        liberadas = []
+        for anterior, atual in alteracoes:
+            # Qualquer alteração (inclusive só de título) muda a agenda da sala
+            salas.update(estado[0] for estado in (anterior, atual) if estado is not None)
+            if anterior == atual:
+                continue
+            if anterior is not None and _ocupa(anterior):
+                liberadas.append(anterior[:3])
+            if atual is not None and _ocupa(atual):
+                disponibilidade.marcar_ocupacao(*atual[:3])
+        # Em lote: várias reservas costumam cair no mesmo dia da mesma sala
+        disponibilidade.invalidar_ocupacoes(liberadas)
+        for sala_id in salas:
+            cache_agenda.invalidar(sala_id)
+        calendario.invalidar(salas)
+
+    transaction.on_commit(propagar)
+
+
+def alteracoes_registradas(tipo, itens, acao='alterada'):
+    """
+    Registra alterações de `tipo` ('reserva' ou 'sala') no log de
+    sincronização, na transação corrente, e as publica para os clientes
+    conectados em /api/eventos/ após o commit. `itens` são pares (id, sala_id).
+    """
+    sincronizacao.registrar(tipo, [objeto_id for objeto_id, _ in itens])
+    transaction.on_commit(lambda: eventos.publicar(tipo, acao, itens))
+
+
+def reservas_criadas(reservas):
+    """Propaga reservas inseridas com bulk_create, que não dispara post_save"""
+    alteracoes_registradas('reserva', [(reserva.pk, reserva.sala_id) for reserva in reservas], 'criada')
+    reservas_alteradas([(None, _estado(reserva)) for reserva in reservas])
+
+
+@receiver(post_init, sender=Reserva)
+def guardar_estado_original(sender, instance, **kwargs):
+    instance._estado_original = _estado(instance) if instance.pk else None
+
+
+@receiver(post_save, sender=Reserva)
+def reserva_salva(sender, instance, created, **kwargs):
+    alteracoes_registradas('reserva', [(instance.pk, instance.sala_id)], 'criada' if created else 'alterada')
+    atual = _estado(instance)
+    reservas_alteradas([(instance._estado_original, atual)])
+    instance._estado_original = atual
+
+
+@receiver(post_delete, sender=Reserva)
+def reserva_removida(sender, instance, **kwargs):
+    alteracoes_registradas('reserva', [(instance.pk, instance.sala_id)], 'removida')
+    reservas_alteradas([(instance._estado_original, None)])
+
+
+@receiver(post_save, sender=Sala)
+def sala_salva(sender, instance, created, **kwargs):
+    alteracoes_registradas('sala', [(instance.pk, instance.pk)], 'criada' if created else 'alterada')
+    # A agenda e o feed .ics incluem o nome da sala; o feed depende também
+    # do token e de a sala estar ativa
+    if not created:
+        def propagar():
+            cache_agenda.invalidar(instance.pk)
+            calendario.invalidar([instance.pk])
+        transaction.on_commit(propagar)
+
+
+@receiver(post_delete, sender=Sala)
+def sala_removida(sender, instance, **kwargs):
+    alteracoes_registradas('sala', [(instance.pk, instance.pk)], 'removida')
+    sala_id = instance.pk
+    transaction.on_commit(lambda: calendario.invalidar([sala_id]))
+
+
+@receiver(post_save, sender=User)
+def criar_perfil(sender, instance, created, raw=False, **kwargs):
+    # Perfil criado junto com o usuário, fora do caminho do login
+    if created and not raw:
+        PerfilUsuario.objects.get_or_create(usuario=instance)
+
+
+@receiver([post_save, post_delete], sender=User)
+def usuario_alterado(sender, instance, **kwargs):
+    transaction.on_commit(lambda: autenticacao.invalidar(instance.pk))
+
+
+@receiver([post_save, post_delete], sender=PerfilUsuario)
+def perfil_alterado(sender, instance, **kwargs):
+    transaction.on_commit(lambda: autenticacao.invalidar(instance.usuario_id))
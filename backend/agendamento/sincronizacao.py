@@ -0,0 +1,98 @@
+"""
+Sincronização incremental de reservas e salas (/api/sync/?since=<token>).
+
+Cada gravação ou remoção de Reserva/Sala acrescenta uma linha em
+RegistroAlteracao na mesma transação da alteração; o token é o id da
+última linha entregue ao cliente. Como ids são atribuídos no INSERT e não
+no commit, uma transação mais lenta pode tornar visível um id menor depois
+de um maior: por isso só são entregues linhas com mais de
+SYNC_ATRASO_SEGUNDOS, e a leitura para na primeira linha recente demais.
+
+Limite: a janela só protege transações que fazem o commit até
+SYNC_ATRASO_SEGUNDOS depois de gravar a linha no log. Uma transação mais
+lenta que isso (lote grande de reservas, banco sob carga, pausa entre a
+gravação e o commit) torna a linha visível depois que um token maior já foi
+entregue, e os clientes que já passaram dele não recebem a alteração até a
+próxima carga completa. Operações em lote devem caber na janela (os lotes de
+transicoes.py são curtos); onde não couberem, aumente SYNC_ATRASO_SEGUNDOS,
+o que atrasa a entrega de todas as alterações na mesma medida.
+
+A limpeza (limpar_expirados) mantém a linha mais nova entre as vencidas
+como marco: um token anterior a ela pode ter perdido alterações e recebe
+410, e o cliente refaz a carga completa.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import RegistroAlteracao
+
+
+class TokenExpirado(Exception):
+    pass
+
+
+def registrar(modelo, ids):
+    """Acrescenta ao log as alterações dos objetos `ids` de `modelo` ('reserva' ou 'sala')"""
+    RegistroAlteracao.objects.bulk_create(
+        RegistroAlteracao(modelo=modelo, objeto_id=objeto_id) for objeto_id in ids
+    )
+
+
+def _limite_visivel():
+    """Linhas criadas até este momento já não podem ganhar vizinhas menores (ver o limite acima)"""
+    return timezone.now() - timedelta(seconds=getattr(settings, 'SYNC_ATRASO_SEGUNDOS', 2))
+
+
+def token_atual():
+    """Token a partir do qual um cliente que acabou de fazer a carga completa deve sincronizar"""
+    return RegistroAlteracao.objects.filter(criado_em__lte=_limite_visivel()).aggregate(
+        ultimo=Max('id')
+    )['ultimo'] or 0
+
+
+def alteracoes_desde(desde, limite):
+    """
+    Retorna (token, {'reserva': [ids], 'sala': [ids]}, mais) com os objetos
+    alterados depois de `desde`, em até `limite` linhas do log.
+    """
+    primeiro = RegistroAlteracao.objects.order_by('id').values_list('id', flat=True).first()
+    if primeiro is not None and desde < primeiro - 1:
+        raise TokenExpirado
+
+    visivel = _limite_visivel()
+    linhas = RegistroAlteracao.objects.filter(id__gt=desde).order_by('id').values_list(
+        'id', 'modelo', 'objeto_id', 'criado_em'
+    )[:limite + 1]
+
+    token, mais = desde, False
+    alterados = {'reserva': {}, 'sala': {}}
+    for indice, (registro_id, modelo, objeto_id, criado_em) in enumerate(linhas):
+        if criado_em > visivel:
+            break
+        if indice == limite:
+            mais = True
+            break
+        alterados[modelo][objeto_id] = None
+        token = registro_id
+    return token, {modelo: list(ids) for modelo, ids in alterados.items()}, mais
+
+
+def limpar(retencao, tamanho_lote):
+    """Remove as linhas anteriores a `retencao`, exceto a mais nova delas (marco); devolve quantas"""
+    marco = RegistroAlteracao.objects.filter(criado_em__lt=timezone.now() - retencao).aggregate(
+        ultimo=Max('id')
+    )['ultimo']
+    if marco is None:
+        return 0
+    total = 0
+    while True:
+        ids = list(
+            RegistroAlteracao.objects.filter(id__lt=marco).order_by('id').values_list('id', flat=True)[:tamanho_lote]
+        )
+        if not ids:
+            return total
+        RegistroAlteracao.objects.filter(id__in=ids).delete()
+        total += len(ids)
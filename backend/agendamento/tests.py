@@ -0,0 +1,1226 @@
+import asyncio
+import csv
+import importlib
+import re
+import threading
+import warnings
+from datetime import datetime, time, timedelta
+from unittest import mock, skipUnless
+
+from django.contrib.auth import authenticate
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.signals import request_finished
+from django.db import connection, models
+from django.db.models.query import QuerySet
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.exceptions import APIException
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import (
+    autenticacao, busca, calendario, checks, disponibilidade, eventos, idempotencia, sincronizacao, transicoes,
+)
+from .models import (
+    CalendarioSala, ChaveIdempotencia, PerfilUsuario, RegistroAlteracao, Reserva, Sala, gerar_token_calendario,
+)
+from .views import ReservaViewSet
+
+
+def _hora(dia, hora, minuto=0):
+    return timezone.make_aware(datetime.combine(dia, datetime.min.time()).replace(hour=hora, minute=minuto))
+
+
+class ReservaBaseTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('ana', 'ana@empresa.com', 'senha')
+        cls.sala = Sala.objects.create(nome='Sala 1', capacidade=10)
+        cls.dia = timezone.localdate() + timedelta(days=7)
+
+    def reservar(self, inicio, fim, sala=None, **extra):
+        return Reserva.objects.create(
+            sala=sala or self.sala, usuario=self.usuario, titulo=extra.pop('titulo', 'Reunião'),
+            data_inicio=inicio, data_fim=fim, **extra,
+        )
+
+
+class ConflitantesTestCase(ReservaBaseTestCase):
+    def setUp(self):
+        self.anterior = self.reservar(_hora(self.dia, 8), _hora(self.dia, 9), titulo='Anterior')
+        self.existente = self.reservar(_hora(self.dia, 10), _hora(self.dia, 11), titulo='Existente')
+
+    def conflito(self, inicio, fim, **kwargs):
+        return list(Reserva.objects.conflitantes(self.sala, inicio, fim, **kwargs).values_list('titulo', flat=True))
+
+    def test_intervalos_encostados_nao_conflitam(self):
+        self.assertEqual(self.conflito(_hora(self.dia, 11), _hora(self.dia, 12)), [])
+        self.assertEqual(self.conflito(_hora(self.dia, 9), _hora(self.dia, 10)), [])
+
+    def test_sobreposicao_nas_bordas(self):
+        self.assertEqual(self.conflito(_hora(self.dia, 10, 59), _hora(self.dia, 12)), ['Existente'])
+        self.assertEqual(self.conflito(_hora(self.dia, 9), _hora(self.dia, 10, 1)), ['Existente'])
+        self.assertEqual(self.conflito(_hora(self.dia, 8, 59), _hora(self.dia, 9, 30)), ['Anterior'])
+
+    def test_intervalo_que_contem_ou_esta_contido(self):
+        self.assertEqual(self.conflito(_hora(self.dia, 9, 30), _hora(self.dia, 12)), ['Existente'])
+        self.assertEqual(self.conflito(_hora(self.dia, 10, 15), _hora(self.dia, 10, 45)), ['Existente'])
+
+    def test_ignora_inativas_outra_sala_e_a_propria(self):
+        outra = Sala.objects.create(nome='Sala 2', capacidade=10)
+        self.reservar(_hora(self.dia, 12), _hora(self.dia, 13), sala=outra)
+        self.reservar(_hora(self.dia, 12), _hora(self.dia, 13), status='cancelada')
+        self.assertEqual(self.conflito(_hora(self.dia, 12), _hora(self.dia, 13)), [])
+        self.assertEqual(self.conflito(_hora(self.dia, 10), _hora(self.dia, 11), excluir=self.existente.pk), [])
+
+    def test_save_recusa_conflito(self):
+        with self.assertRaises(ValidationError) as erro:
+            self.reservar(_hora(self.dia, 10, 30), _hora(self.dia, 11, 30))
+        self.assertEqual(erro.exception.error_list[0].code, 'conflito')
+        self.existente.data_fim = _hora(self.dia, 11, 30)
+        self.existente.save()
+
+    def test_reservas_sobrepostas_gravadas_em_lote(self):
+        # bulk_create não passa por clean(): uma reserva curta dentro de uma
+        # longa não pode esconder a longa da verificação
+        Reserva.objects.bulk_create([
+            Reserva(sala=self.sala, usuario=self.usuario, titulo=titulo, data_inicio=inicio, data_fim=fim)
+            for titulo, inicio, fim in [
+                ('Longa', _hora(self.dia, 12), _hora(self.dia, 17)),
+                ('Curta', _hora(self.dia, 13), _hora(self.dia, 14)),
+            ]
+        ])
+        self.assertEqual(self.conflito(_hora(self.dia, 15), _hora(self.dia, 16)), ['Longa'])
+        self.assertEqual(sorted(self.conflito(_hora(self.dia, 13, 30), _hora(self.dia, 15))), ['Curta', 'Longa'])
+        with self.assertRaises(ValidationError):
+            self.reservar(_hora(self.dia, 15), _hora(self.dia, 16))
+
+    def test_horario_livre_considera_reservas_sobrepostas(self):
+        Reserva.objects.bulk_create([
+            Reserva(sala=self.sala, usuario=self.usuario, titulo='Reunião', data_inicio=inicio, data_fim=fim)
+            for inicio, fim in [
+                (_hora(self.dia, 11), _hora(self.dia, 17)),
+                (_hora(self.dia, 12), _hora(self.dia, 13)),
+            ]
+        ])
+        encontrados = disponibilidade.buscar_horarios_livres(
+            [self.sala], _hora(self.dia, 14), _hora(self.dia, 20), timedelta(hours=1),
+            time(8), time(18),
+        )
+        self.assertEqual(encontrados, [(self.sala, _hora(self.dia, 17), _hora(self.dia, 18))])
+
+
+
+class HorariosLivresTestCase(ReservaBaseTestCase):
+    """buscar_horarios_livres: varredura dos intervalos ocupados de cada sala"""
+
+    def buscar(self, inicio, fim, minutos=60, salas=None, **kwargs):
+        kwargs.setdefault('hora_inicio', time(8))
+        kwargs.setdefault('hora_fim', time(18))
+        encontrados = disponibilidade.buscar_horarios_livres(
+            salas or [self.sala], inicio, fim, timedelta(minutes=minutos), **kwargs
+        )
+        return [(sala.nome, timezone.localtime(ini).strftime('%d %H:%M'), timezone.localtime(fim).strftime('%H:%M'))
+                for sala, ini, fim in encontrados]
+
+    def horario(self, hora, minuto=0, dias=0):
+        return (self.sala.nome, f'{self.dia + timedelta(days=dias):%d} {hora:02d}:{minuto:02d}')
+
+    def primeiro(self, *args, **kwargs):
+        encontrados = self.buscar(*args, **kwargs)
+        return encontrados[0][:2] if encontrados else None
+
+    def test_pula_os_intervalos_ocupados(self):
+        self.reservar(_hora(self.dia, 8), _hora(self.dia, 9))
+        self.reservar(_hora(self.dia, 9), _hora(self.dia, 10, 30))
+        self.reservar(_hora(self.dia, 11), _hora(self.dia, 12))
+        self.assertEqual(self.buscar(_hora(self.dia, 8), _hora(self.dia, 20)),
+                         [('Sala 1', f'{self.dia:%d} 12:00', '13:00')])
+        # A reserva em andamento no início da busca também conta
+        self.assertEqual(self.primeiro(_hora(self.dia, 9, 30), _hora(self.dia, 20), minutos=30),
+                         self.horario(10, 30))
+
+    def test_duracao_minima(self):
+        self.reservar(_hora(self.dia, 8), _hora(self.dia, 9))
+        self.reservar(_hora(self.dia, 10), _hora(self.dia, 18))
+        self.assertEqual(self.primeiro(_hora(self.dia, 8), _hora(self.dia, 20), minutos=60), self.horario(9))
+        self.assertIsNone(self.primeiro(_hora(self.dia, 8), _hora(self.dia, 20), minutos=65))
+        self.assertEqual(self.primeiro(_hora(self.dia, 8), _hora(self.dia + timedelta(days=1), 20), minutos=65),
+                         self.horario(8, dias=1))
+
+    def test_bordas_do_expediente(self):
+        self.assertEqual(self.primeiro(_hora(self.dia, 6), _hora(self.dia, 20)), self.horario(8))
+        self.assertEqual(self.primeiro(_hora(self.dia, 17), _hora(self.dia, 20)), self.horario(17))
+        self.assertEqual(self.primeiro(_hora(self.dia, 17, 1), _hora(self.dia + timedelta(days=1), 20)),
+                         self.horario(8, dias=1))
+        # Início arredondado para a próxima faixa de SLOT_MINUTOS
+        self.assertEqual(self.primeiro(_hora(self.dia, 9, 1), _hora(self.dia, 20)), self.horario(9, 5))
+
+    def test_bordas_da_janela(self):
+        self.reservar(_hora(self.dia, 8), _hora(self.dia, 12))
+        self.assertEqual(self.primeiro(_hora(self.dia, 8), _hora(self.dia, 13)), self.horario(12))
+        self.assertIsNone(self.primeiro(_hora(self.dia, 8), _hora(self.dia, 12, 59)))
+        # Reservas fora da janela não influem; a busca atravessa vários dias
+        for dias in range(1, 4):
+            dia = self.dia + timedelta(days=dias)
+            self.reservar(_hora(dia, 8), _hora(dia, 18))
+        inicio = _hora(self.dia + timedelta(days=1), 8)
+        self.assertEqual(self.primeiro(inicio, inicio + timedelta(days=5)), self.horario(8, dias=4))
+        self.assertIsNone(self.primeiro(inicio, inicio + timedelta(days=3)))
+
+    def test_criterio_cedo_e_ajuste(self):
+        pequena = Sala.objects.create(nome='Pequena', capacidade=4)
+        grande = Sala.objects.create(nome='Grande', capacidade=20)
+        self.reservar(_hora(self.dia, 8), _hora(self.dia, 9), sala=pequena)
+        salas = [self.sala, pequena, grande]
+        inicio, fim = _hora(self.dia, 8), _hora(self.dia, 20)
+
+        def ordem(**kwargs):
+            return [(nome, hora) for nome, hora, _ in self.buscar(inicio, fim, salas=salas, participantes=4, **kwargs)]
+
+        dia = f'{self.dia:%d}'
+        # Mais cedo primeiro; empate pela menor capacidade
+        self.assertEqual(ordem(criterio='cedo'),
+                         [('Sala 1', f'{dia} 08:00'), ('Grande', f'{dia} 08:00'), ('Pequena', f'{dia} 09:00')])
+        # Menor sobra de capacidade primeiro
+        self.assertEqual(ordem(criterio='ajuste'),
+                         [('Pequena', f'{dia} 09:00'), ('Sala 1', f'{dia} 08:00'), ('Grande', f'{dia} 08:00')])
+        self.assertEqual(ordem(criterio='ajuste', limite=1), [('Pequena', f'{dia} 09:00')])
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class LoginPorEmailOuUsernameTestCase(TestCase):
+    """EmailOuUsernameBackend e /api/auth/login/"""
+
+    client_class = APIClient
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ana = User.objects.create_user('ana', 'Ana@Empresa.com', 'senha-ana')
+        cls.copia = User.objects.create_user('ana2', 'ana@empresa.com', 'senha-copia')
+        cls.bruno = User.objects.create_user('bruno', 'bruno@empresa.com', 'senha-bruno')
+
+    def test_username(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(authenticate(username='ana', password='senha-ana'), self.ana)
+        self.assertIsNone(authenticate(username='ana', password='errada'))
+        self.assertIsNone(authenticate(username='ninguem', password='senha-ana'))
+
+    def test_email_sem_diferenciar_maiusculas(self):
+        self.assertEqual(authenticate(username='BRUNO@empresa.COM', password='senha-bruno'), self.bruno)
+        resposta = self.client.post('/api/auth/login/', {'email': 'bruno@EMPRESA.com', 'password': 'senha-bruno'})
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta.json()['user']['username'], 'bruno')
+        self.assertIn('access', resposta.json())
+
+    def test_email_duplicado_fica_com_a_conta_mais_antiga(self):
+        self.assertEqual(authenticate(username='ana@empresa.com', password='senha-ana'), self.ana)
+        # A senha da conta mais nova não vale para o email compartilhado
+        self.assertIsNone(authenticate(username='ana@empresa.com', password='senha-copia'))
+        self.assertEqual(authenticate(username='ana2', password='senha-copia'), self.copia)
+
+    def test_username_exato_tem_prioridade_sobre_email(self):
+        outro = User.objects.create_user('carla@empresa.com', 'carla@pessoal.com', 'senha-carla')
+        User.objects.create_user('carla', 'carla@empresa.com', 'senha-antiga')
+        self.assertEqual(authenticate(username='carla@empresa.com', password='senha-carla'), outro)
+
+    def test_usuario_inativo(self):
+        self.bruno.is_active = False
+        self.bruno.save()
+        self.assertIsNone(authenticate(username='bruno', password='senha-bruno'))
+        self.assertIsNone(authenticate(username='bruno@empresa.com', password='senha-bruno'))
+        resposta = self.client.post('/api/auth/login/', {'username': 'bruno', 'password': 'senha-bruno'})
+        self.assertEqual(resposta.status_code, 401)
+
+
+class AutenticacaoEmCacheTestCase(TestCase):
+    """CachedJWTAuthentication: retrato do usuário com versão no cache compartilhado"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ana = User.objects.create_user('ana', 'ana@empresa.com', 'senha', is_staff=True)
+
+    def setUp(self):
+        cache.clear()
+        autenticacao.limpar()
+        self.autenticacao = autenticacao.CachedJWTAuthentication()
+
+    def usuario(self, usuario=None):
+        token = self.autenticacao.get_validated_token(str(AccessToken.for_user(usuario or self.ana)))
+        return self.autenticacao.get_user(token)
+
+    def alterar(self, objeto, **campos):
+        for campo, valor in campos.items():
+            setattr(objeto, campo, valor)
+        with self.captureOnCommitCallbacks(execute=True):
+            objeto.save()
+
+    def test_acerto_sem_consultas(self):
+        with self.assertNumQueries(1):
+            self.usuario()
+        with self.assertNumQueries(0):
+            usuario = self.usuario()
+            self.assertEqual(usuario.perfil.usuario, usuario)
+        self.assertEqual(usuario.username, 'ana')
+        # Outro worker (memória do processo vazia) lê o retrato do cache compartilhado
+        autenticacao.limpar()
+        with self.assertNumQueries(0):
+            self.usuario()
+
+    def test_alteracao_do_usuario_e_do_perfil(self):
+        self.usuario()
+        self.alterar(self.ana, is_staff=False)
+        with self.assertNumQueries(1):
+            self.assertFalse(self.usuario().is_staff)
+        self.alterar(PerfilUsuario.objects.get(usuario=self.ana), cargo='Gerente')
+        with self.assertNumQueries(1):
+            self.assertEqual(self.usuario().perfil.cargo, 'Gerente')
+
+    def test_alteracao_vale_para_os_outros_workers(self):
+        self.usuario()
+        # Memória de um worker que não recebeu o sinal: o retrato dele é da versão antiga
+        outro_worker = autenticacao._entradas.copy()
+        self.alterar(self.ana, is_staff=False)
+        autenticacao._entradas.update(outro_worker)
+        self.assertFalse(self.usuario().is_staff)
+
+    def test_usuario_inativo(self):
+        token = self.autenticacao.get_validated_token(str(AccessToken.for_user(self.ana)))
+        self.autenticacao.get_user(token)
+        self.alterar(self.ana, is_active=False)
+        with self.assertRaises(AuthenticationFailed):
+            self.autenticacao.get_user(token)
+
+    @override_settings(AUTENTICACAO_CACHE_MAX=2)
+    def test_lru_limitado(self):
+        outros = [User.objects.create_user(nome) for nome in ('bruno', 'carla')]
+        for usuario in [self.ana, *outros]:
+            self.usuario(usuario)
+        self.assertEqual(list(autenticacao._entradas), [str(usuario.pk) for usuario in outros])
+        # Usar uma entrada a move para o fim da fila
+        self.usuario(outros[0])
+        self.usuario(self.ana)
+        self.assertEqual(list(autenticacao._entradas), [str(outros[0].pk), str(self.ana.pk)])
+
+
+class ReservasEmLoteTestCase(ReservaBaseTestCase):
+    """POST /api/reservas/lote/: ocorrências explícitas ou recorrência"""
+
+    client_class = APIClient
+    url = '/api/reservas/lote/'
+
+    def setUp(self):
+        self.client.force_authenticate(self.usuario)
+
+    def ocorrencia(self, inicio, fim):
+        return {'data_inicio': inicio.isoformat(), 'data_fim': fim.isoformat()}
+
+    def lote(self, **dados):
+        return self.client.post(self.url, {'sala': self.sala.pk, 'titulo': 'Semanal', **dados}, format='json')
+
+    def test_cria_todas_as_ocorrencias(self):
+        resposta = self.lote(ocorrencias=[
+            self.ocorrencia(_hora(self.dia + timedelta(days=n), 9), _hora(self.dia + timedelta(days=n), 10))
+            for n in range(3)
+        ])
+        self.assertEqual(resposta.status_code, 201)
+        self.assertEqual(len(resposta.json()['reservas']), 3)
+        self.assertEqual(resposta.json()['conflitos'], [])
+        self.assertEqual(Reserva.objects.filter(titulo='Semanal', usuario=self.usuario).count(), 3)
+
+    def test_conflitos_por_ocorrencia(self):
+        existente = self.reservar(_hora(self.dia, 10), _hora(self.dia, 11), titulo='Existente')
+        self.reservar(_hora(self.dia, 14), _hora(self.dia, 15), status='cancelada')
+        ocorrencias = [
+            self.ocorrencia(_hora(self.dia, 10, 30), _hora(self.dia, 11, 30)),  # existente
+            self.ocorrencia(_hora(self.dia, 12), _hora(self.dia, 13)),
+            self.ocorrencia(_hora(self.dia, 12, 30), _hora(self.dia, 13, 30)),  # ocorrência 1
+            self.ocorrencia(_hora(self.dia, 14), _hora(self.dia, 15)),  # só a cancelada
+        ]
+        resposta = self.lote(ocorrencias=ocorrencias)
+        self.assertEqual(resposta.status_code, 409)
+        conflitos = resposta.json()['conflitos']
+        self.assertEqual([conflito['indice'] for conflito in conflitos], [0, 2])
+        self.assertEqual(conflitos[0]['conflitos'][0]['reserva']['id'], existente.pk)
+        self.assertEqual(conflitos[1]['conflitos'], [{'ocorrencia': 1}])
+        self.assertFalse(Reserva.objects.filter(titulo='Semanal').exists())
+
+        # ignorar_conflitos: cria só as livres e relata as demais
+        resposta = self.lote(ocorrencias=ocorrencias, ignorar_conflitos=True)
+        self.assertEqual(resposta.status_code, 201)
+        self.assertEqual([conflito['indice'] for conflito in resposta.json()['conflitos']], [0, 2])
+        criadas = Reserva.objects.filter(titulo='Semanal').order_by('data_inicio')
+        self.assertEqual([reserva.data_inicio for reserva in criadas], [_hora(self.dia, 12), _hora(self.dia, 14)])
+
+    @override_settings(RESERVA_LOTE_MAX_OCORRENCIAS=3)
+    def test_limite_de_ocorrencias(self):
+        inicio = _hora(self.dia, 9)
+        ocorrencias = [self.ocorrencia(inicio + timedelta(days=n), inicio + timedelta(days=n, hours=1)) for n in range(4)]
+        recorrencia = {**self.ocorrencia(inicio, inicio + timedelta(hours=1)), 'frequencia': 'diaria'}
+        for dados in [
+            {'ocorrencias': ocorrencias},
+            {'recorrencia': {**recorrencia, 'contagem': 4}},
+            {'recorrencia': {**recorrencia, 'ate': (self.dia + timedelta(days=365)).isoformat()}},
+        ]:
+            with self.subTest(dados=list(dados)):
+                resposta = self.lote(**dados)
+                self.assertEqual(resposta.status_code, 400)
+                self.assertIn('ocorrencias', resposta.json())
+        self.assertEqual(self.lote(ocorrencias=ocorrencias[:3]).status_code, 201)
+        self.assertFalse(Reserva.objects.filter(data_inicio__gte=inicio + timedelta(days=3)).exists())
+
+    def test_ocorrencias_ou_recorrencia(self):
+        ocorrencia = self.ocorrencia(_hora(self.dia, 9), _hora(self.dia, 10))
+        self.assertEqual(self.lote().status_code, 400)
+        self.assertEqual(self.lote(ocorrencias=[ocorrencia],
+                                   recorrencia={**ocorrencia, 'frequencia': 'diaria', 'contagem': 2}).status_code, 400)
+        self.assertEqual(self.lote(recorrencia={**ocorrencia, 'frequencia': 'diaria'}).status_code, 400)
+
+    def test_recorrencia_ate(self):
+        resposta = self.lote(recorrencia={
+            **self.ocorrencia(_hora(self.dia, 9), _hora(self.dia, 10)),
+            'frequencia': 'diaria', 'intervalo': 2, 'ate': (self.dia + timedelta(days=5)).isoformat(),
+        })
+        self.assertEqual(resposta.status_code, 201)
+        dias = sorted(timezone.localdate(reserva.data_inicio) for reserva in Reserva.objects.filter(titulo='Semanal'))
+        self.assertEqual(dias, [self.dia, self.dia + timedelta(days=2), self.dia + timedelta(days=4)])
+
+    @override_settings(TIME_ZONE='America/New_York')
+    def test_recorrencia_atravessa_mudanca_de_horario(self):
+        # Horário de verão nos EUA começa em 10/03/2030: o horário local se mantém, o UTC muda
+        primeira = timezone.make_aware(datetime(2030, 3, 4, 9))
+        resposta = self.lote(recorrencia={
+            **self.ocorrencia(primeira, primeira + timedelta(hours=1)), 'frequencia': 'semanal', 'contagem': 3,
+        })
+        self.assertEqual(resposta.status_code, 201)
+        reservas = Reserva.objects.filter(titulo='Semanal').order_by('data_inicio')
+        locais = [timezone.localtime(reserva.data_inicio) for reserva in reservas]
+        self.assertEqual([(local.day, local.hour) for local in locais], [(4, 9), (11, 9), (18, 9)])
+        self.assertEqual([local.utcoffset() for local in locais],
+                         [timedelta(hours=-5), timedelta(hours=-4), timedelta(hours=-4)])
+        self.assertTrue(all(reserva.data_fim - reserva.data_inicio == timedelta(hours=1) for reserva in reservas))
+
+class PlanoConsultasTestCase(ReservaBaseTestCase):
+    """
+    EXPLAIN das consultas a agendamento_reserva feitas pelos endpoints de
+    leitura, sobre uma base populada: nenhuma pode varrer a tabela inteira.
+    No PostgreSQL a varredura sequencial é desligada na sessão, então ela só
+    aparece no plano quando nenhum índice atende a consulta.
+    """
+
+    client_class = APIClient
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        salas = [cls.sala] + [Sala.objects.create(nome=f'Sala {i}', capacidade=10) for i in range(2, 6)]
+        outro = User.objects.create_user('bruno')
+        inicio = timezone.now() - timedelta(days=60)
+        estados = ['concluida', 'cancelada', 'agendada', 'em_andamento']
+        Reserva.objects.bulk_create(
+            Reserva(sala=salas[n % len(salas)], usuario=cls.usuario if n % 3 else outro, titulo='Reunião',
+                    data_inicio=inicio + timedelta(hours=n), data_fim=inicio + timedelta(hours=n, minutes=30),
+                    status=estados[n % 4] if n < 1440 else 'agendada')
+            for n in range(2000)
+        )
+
+    def setUp(self):
+        self.client.force_authenticate(self.usuario)
+
+    def consultas_de_reserva(self, url, params=None):
+        cache.clear()
+        with CaptureQueriesContext(connection) as consultas:
+            resposta = self.client.get(url, params or {})
+        self.assertEqual(resposta.status_code, 200)
+        sqls = [consulta['sql'] for consulta in consultas if 'agendamento_reserva' in consulta['sql']]
+        self.assertTrue(sqls, f'{url} não consultou reservas')
+        return sqls
+
+    def plano(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute(f'EXPLAIN {sql}')
+                return '\n'.join(linha for linha, in cursor.fetchall())
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return '\n'.join(linha[-1] for linha in cursor.fetchall())
+
+    def assertSemVarredura(self, url, params=None):
+        for sql in self.consultas_de_reserva(url, params):
+            plano = self.plano(sql)
+            if connection.vendor == 'postgresql':
+                self.assertNotIn('Seq Scan on agendamento_reserva', plano, f'{url}\n{sql}\n{plano}')
+            else:
+                # "SCAN tabela" sem índice; U0, U1... são apelidos de subconsultas
+                self.assertNotRegex(plano, r'(?m)^SCAN (agendamento_reserva|U\d+)$', f'{url}\n{sql}\n{plano}')
+
+    def test_agenda(self):
+        amanha = timezone.now() + timedelta(days=1)
+        self.assertSemVarredura(f'/api/salas/{self.sala.pk}/agenda/', {
+            'data_inicio': amanha.isoformat(), 'data_fim': (amanha + timedelta(days=7)).isoformat(),
+        })
+
+    def test_disponiveis(self):
+        amanha = (timezone.now() + timedelta(days=1)).replace(hour=14, minute=0, second=0, microsecond=0)
+        self.assertSemVarredura('/api/salas/disponiveis/', {
+            'data_inicio': amanha.isoformat(), 'data_fim': (amanha + timedelta(hours=1)).isoformat(),
+        })
+
+    def test_listagem_de_salas(self):
+        self.assertSemVarredura('/api/salas/')
+
+    def test_listagem_de_reservas(self):
+        self.assertSemVarredura('/api/reservas/')
+        self.assertSemVarredura('/api/reservas/', {'sala': self.sala.pk})
+        self.assertSemVarredura('/api/reservas/', {'minhas': 'true'})
+
+    def test_dashboard(self):
+        self.assertSemVarredura('/api/reservas/dashboard/')
+
+
+class NumeroDeConsultasTestCase(ReservaBaseTestCase):
+    """
+    As listagens fazem um número fixo de consultas, que não cresce com o
+    número de salas, reservas ou usuários envolvidos (sem N+1).
+    """
+
+    client_class = APIClient
+
+    def setUp(self):
+        self.client.force_authenticate(self.usuario)
+        self.outro = User.objects.create_user('bruno')
+        self.proximo_inicio = _hora(self.dia, 8)
+        self.popular(2)
+
+    def popular(self, quantidade):
+        for _ in range(quantidade):
+            inicio = self.proximo_inicio
+            sala = Sala.objects.create(nome=f'Sala {Sala.objects.count() + 1}', capacidade=8)
+            usuario = User.objects.create_user(f'usuario{User.objects.count()}')
+            for usuario_reserva, hora in ((usuario, 0), (self.usuario, 1), (self.outro, 2)):
+                for alvo in (sala, self.sala):
+                    Reserva.objects.create(
+                        sala=alvo, usuario=usuario_reserva, titulo='Reunião',
+                        data_inicio=inicio + timedelta(hours=hora), data_fim=inicio + timedelta(hours=hora, minutes=30),
+                    )
+            self.proximo_inicio += timedelta(days=1)
+
+    def assertConsultasFixas(self, esperado, url, params=None):
+        """`esperado` consultas agora e depois de multiplicar os dados"""
+        for _ in range(2):
+            cache.clear()
+            with self.assertNumQueries(esperado):
+                resposta = self.client.get(url, params or {})
+            self.assertEqual(resposta.status_code, 200)
+            self.popular(5)
+
+    def test_salas(self):
+        self.assertConsultasFixas(4, '/api/salas/')
+
+    def test_reservas(self):
+        self.assertConsultasFixas(3, '/api/reservas/')
+        self.assertConsultasFixas(3, '/api/reservas/', {'minhas': 'true'})
+
+    def test_agenda(self):
+        self.assertConsultasFixas(3, f'/api/salas/{self.sala.pk}/agenda/', {
+            'data_inicio': _hora(self.dia, 0).isoformat(), 'data_fim': _hora(self.dia + timedelta(days=30), 0).isoformat(),
+        })
+
+    def test_disponiveis(self):
+        self.assertConsultasFixas(2, '/api/salas/disponiveis/', {
+            'data_inicio': _hora(self.dia, 8).isoformat(), 'data_fim': _hora(self.dia, 9).isoformat(),
+        })
+
+    def test_dashboard(self):
+        self.assertConsultasFixas(3, '/api/reservas/dashboard/')
+
+
+class MapasDeDisponibilidadeTestCase(ReservaBaseTestCase):
+    def setUp(self):
+        cache.clear()
+        self.ocupado = disponibilidade.mascaras(self.dia, _hora(self.dia, 10), _hora(self.dia, 11))[0]
+
+    def mapa(self):
+        return disponibilidade.obter_mapas([self.sala.pk], [self.dia])[(self.sala.pk, self.dia)]
+
+    def reservar_com_propagacao(self, *args, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.reservar(*args, **kwargs)
+
+    def test_reserva_atualiza_o_mapa_em_cache(self):
+        self.assertEqual(self.mapa(), 0)
+        reserva = self.reservar_com_propagacao(_hora(self.dia, 10), _hora(self.dia, 11))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.mapa(), self.ocupado)
+        reserva.status = 'cancelada'
+        with self.captureOnCommitCallbacks(execute=True):
+            reserva.save()
+        self.assertEqual(self.mapa(), 0)
+
+    def test_montagem_concorrente_com_reserva_nao_sobrescreve_o_mapa(self):
+        montar = disponibilidade._montar_mapas
+
+        def montar_e_reservar(pares):
+            # O banco foi lido antes da reserva, que é gravada e propagada no meio da montagem
+            mapas = montar(pares)
+            self.reservar_com_propagacao(_hora(self.dia, 10), _hora(self.dia, 11))
+            return mapas
+
+        with mock.patch.object(disponibilidade, '_montar_mapas', montar_e_reservar):
+            self.assertEqual(self.mapa(), 0)
+        self.assertEqual(self.mapa(), self.ocupado)
+
+    def test_cancelamento_durante_a_montagem_nao_deixa_a_sala_ocupada(self):
+        reserva = self.reservar_com_propagacao(_hora(self.dia, 10), _hora(self.dia, 11))
+        montar = disponibilidade._montar_mapas
+
+        def montar_e_cancelar(pares):
+            mapas = montar(pares)
+            reserva.status = 'cancelada'
+            with self.captureOnCommitCallbacks(execute=True):
+                reserva.save()
+            return mapas
+
+        with mock.patch.object(disponibilidade, '_montar_mapas', montar_e_cancelar):
+            self.assertEqual(self.mapa(), self.ocupado)
+        self.assertEqual(self.mapa(), 0)
+
+
+
+
+class IdempotenciaTestCase(ReservaBaseTestCase):
+    """Idempotency-Key em POST /api/reservas/"""
+
+    client_class = APIClient
+
+    def setUp(self):
+        self.client.force_authenticate(self.usuario)
+        self.corpo = {
+            'sala': self.sala.pk, 'titulo': 'Reunião',
+            'data_inicio': _hora(self.dia, 10).isoformat(), 'data_fim': _hora(self.dia, 11).isoformat(),
+        }
+
+    def criar(self, chave='chave-1', **alteracoes):
+        return self.client.post('/api/reservas/', {**self.corpo, **alteracoes}, format='json',
+                                HTTP_IDEMPOTENCY_KEY=chave)
+
+    def pendente(self, chave='chave-1', segundos_atras=0):
+        """Registro provisório como o de uma requisição em andamento (ou cujo worker morreu)"""
+        self.criar(chave)
+        Reserva.objects.all().delete()
+        ChaveIdempotencia.objects.filter(chave=chave).update(
+            status_code=None, corpo=None, criado_em=timezone.now() - timedelta(seconds=segundos_atras),
+        )
+
+    def test_repeticao_devolve_a_resposta_guardada(self):
+        primeira = self.criar()
+        self.assertEqual(primeira.status_code, 201)
+        repetida = self.criar()
+        self.assertEqual(repetida.status_code, 201)
+        self.assertEqual(repetida.json(), primeira.json())
+        self.assertEqual(repetida['Idempotent-Replayed'], 'true')
+        self.assertEqual(Reserva.objects.count(), 1)
+        # Outra chave executa a ação (e aqui conflita com a reserva criada)
+        self.assertEqual(self.criar('chave-2').status_code, 409)
+
+    def test_mesma_chave_com_outro_corpo(self):
+        self.criar()
+        resposta = self.criar(titulo='Outra')
+        self.assertEqual(resposta.status_code, 422)
+        self.assertEqual(Reserva.objects.count(), 1)
+
+    def test_em_andamento(self):
+        self.pendente()
+        resposta = self.criar()
+        self.assertEqual(resposta.status_code, 409)
+        self.assertEqual(resposta['Retry-After'], '1')
+        self.assertFalse(Reserva.objects.exists())
+
+    @override_settings(IDEMPOTENCIA_PENDENTE_SEGUNDOS=60)
+    def test_arrendamento_vencido_e_assumido(self):
+        self.pendente(segundos_atras=61)
+        # Outro corpo com a chave continua recusado
+        self.assertEqual(self.criar(titulo='Outra').status_code, 422)
+        resposta = self.criar()
+        self.assertEqual(resposta.status_code, 201)
+        self.assertEqual(Reserva.objects.count(), 1)
+        registro = ChaveIdempotencia.objects.get(chave='chave-1')
+        self.assertEqual(registro.status_code, 201)
+        self.assertEqual(self.criar().json(), resposta.json())
+
+    def test_original_atrasada_nao_sobrescreve_a_chave_assumida(self):
+        criar_de_verdade = ReservaViewSet.perform_create
+        assumidos = []
+
+        def lenta(view, serializer):
+            # Enquanto a original roda, o arrendamento vence e uma repetição assume a chave
+            registro = ChaveIdempotencia.objects.get(chave='chave-1')
+            ChaveIdempotencia.objects.filter(pk=registro.pk).update(criado_em=timezone.now() - timedelta(hours=1))
+            assumidos.append(idempotencia._reservar(self.usuario, 'chave-1', registro.impressao)[1])
+            assumidos.append(idempotencia._reservar(self.usuario, 'chave-1', registro.impressao)[1])
+            criar_de_verdade(view, serializer)
+
+        with mock.patch.object(ReservaViewSet, 'perform_create', lenta):
+            self.assertEqual(self.criar().status_code, 201)
+        # Só a primeira repetição assume; a chave continua com ela, sem a resposta da original
+        self.assertEqual(assumidos, [True, False])
+        self.assertIsNone(ChaveIdempotencia.objects.get(chave='chave-1').status_code)
+
+    def test_erro_5xx_libera_a_chave(self):
+        with mock.patch('agendamento.views.ReservaViewSet.perform_create', side_effect=APIException()):
+            self.assertEqual(self.criar().status_code, 500)
+        self.assertFalse(ChaveIdempotencia.objects.exists())
+        with mock.patch('agendamento.views.ReservaViewSet.perform_create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.criar()
+        self.assertFalse(ChaveIdempotencia.objects.exists())
+        self.assertEqual(self.criar().status_code, 201)
+        self.assertEqual(ChaveIdempotencia.objects.get().status_code, 201)
+
+class ListagemCondicionalTestCase(ReservaBaseTestCase):
+    """ETag/If-None-Match nas listagens de reservas e salas"""
+
+    client_class = APIClient
+
+    def setUp(self):
+        self.client.force_authenticate(self.usuario)
+        self.reserva = self.reservar(_hora(self.dia, 8), _hora(self.dia, 9))
+
+    def etag(self, url, params=None):
+        resposta = self.client.get(url, params or {})
+        self.assertEqual(resposta.status_code, 200)
+        self.assertTrue(resposta.has_header('ETag'))
+        return resposta['ETag']
+
+    def assertNaoModificada(self, url, etag, params=None, if_none_match=None):
+        resposta = self.client.get(url, params or {}, HTTP_IF_NONE_MATCH=if_none_match or etag)
+        self.assertEqual(resposta.status_code, 304)
+        self.assertEqual(resposta['ETag'], etag)
+        self.assertFalse(resposta.content)
+
+    def assertModificada(self, url, etag, params=None):
+        resposta = self.client.get(url, params or {}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resposta.status_code, 200)
+        self.assertNotEqual(resposta['ETag'], etag)
+        self.assertNaoModificada(url, resposta['ETag'], params)
+
+    def test_if_none_match(self):
+        for url, params in [('/api/reservas/', None), ('/api/reservas/', {'page': 1}), ('/api/salas/', None)]:
+            with self.subTest(url=url, params=params):
+                etag = self.etag(url, params)
+                self.assertNaoModificada(url, etag, params)
+                self.assertNaoModificada(url, etag, params, if_none_match=f'"outro", W/{etag}')
+                self.assertEqual(self.client.get(url, params or {}, HTTP_IF_NONE_MATCH='"outro"').status_code, 200)
+                # Outros filtros, outro ETag
+                self.assertNotEqual(self.etag(url, {**(params or {}), 'sala': self.sala.pk}), etag)
+
+    def test_alteracao_de_reserva(self):
+        for params in [None, {'page': 1}]:
+            with self.subTest(params=params):
+                etag = self.etag('/api/reservas/', params)
+                resposta = self.client.patch(f'/api/reservas/{self.reserva.pk}/', {'titulo': f'Reunião {params}'})
+                self.assertEqual(resposta.status_code, 200)
+                self.assertModificada('/api/reservas/', etag, params)
+
+    def test_cancelamento(self):
+        reservas, salas = self.etag('/api/reservas/'), self.etag('/api/salas/')
+        resposta = self.client.post(f'/api/reservas/{self.reserva.pk}/cancelar/')
+        self.assertEqual(resposta.status_code, 200)
+        self.assertModificada('/api/reservas/', reservas)
+        # A contagem de reservas ativas da sala mudou
+        self.assertModificada('/api/salas/', salas)
+
+    def test_sala_renomeada(self):
+        reservas, salas = self.etag('/api/reservas/'), self.etag('/api/salas/')
+        resposta = self.client.patch(f'/api/salas/{self.sala.pk}/', {'nome': 'Sala Azul'})
+        self.assertEqual(resposta.status_code, 200)
+        # sala_nome aparece em cada reserva
+        self.assertModificada('/api/reservas/', reservas)
+        self.assertModificada('/api/salas/', salas)
+
+
+class ExportacaoTestCase(ReservaBaseTestCase):
+    """Exportações em CSV e iCalendar, com os filtros da listagem"""
+
+    client_class = APIClient
+
+    def setUp(self):
+        self.client.force_authenticate(self.usuario)
+        self.outra_sala = Sala.objects.create(nome='Sala 2', capacidade=10)
+        bruno = User.objects.create_user('bruno')
+        self.primeira = self.reservar(_hora(self.dia, 8), _hora(self.dia, 9), titulo='Primeira',
+                                      descricao='Pauta: "orçamento", metas\nsegunda linha')
+        self.segunda = self.reservar(_hora(self.dia, 10), _hora(self.dia, 11), titulo='Segunda')
+        self.da_outra_sala = self.reservar(_hora(self.dia, 8), _hora(self.dia, 9), sala=self.outra_sala)
+        self.de_outro = Reserva.objects.create(sala=self.sala, usuario=bruno, titulo='Do Bruno',
+                                               data_inicio=_hora(self.dia, 12), data_fim=_hora(self.dia, 13))
+
+    def exportar(self, formato, params=None):
+        resposta = self.client.get(f'/api/reservas/exportar/{formato}/', params or {})
+        self.assertEqual(resposta.status_code, 200)
+        self.assertTrue(resposta.streaming)
+        return b''.join(resposta.streaming_content).decode()
+
+    def linhas_csv(self, params=None):
+        conteudo = self.exportar('csv', params)
+        self.assertTrue(conteudo.startswith('\ufeff'))
+        return list(csv.reader(conteudo[1:].splitlines(keepends=True)))
+
+    def test_csv(self):
+        cabecalho, *linhas = self.linhas_csv({'sala': self.sala.pk})
+        self.assertEqual(cabecalho, ['id', 'sala', 'titulo', 'descricao', 'data_inicio', 'data_fim',
+                                     'status', 'participantes', 'usuario', 'criado_em'])
+        self.assertEqual([int(linha[0]) for linha in linhas], [self.primeira.pk, self.segunda.pk, self.de_outro.pk])
+        primeira = dict(zip(cabecalho, linhas[0]))
+        self.assertEqual(primeira['descricao'], self.primeira.descricao)
+        self.assertEqual(primeira['sala'], 'Sala 1')
+        self.assertEqual(primeira['usuario'], 'ana')
+        self.assertEqual(primeira['data_inicio'], timezone.localtime(self.primeira.data_inicio).isoformat())
+
+    def test_filtros_iguais_aos_da_listagem(self):
+        for params in [{}, {'sala': self.sala.pk}, {'minhas': 'true'},
+                       {'data_inicio': _hora(self.dia, 9, 30).isoformat(), 'data_fim': _hora(self.dia, 12).isoformat()}]:
+            with self.subTest(params=params):
+                listagem = self.client.get('/api/reservas/', {**params, 'page': 1, 'page_size': 100}).json()['results']
+                exportadas = [int(linha[0]) for linha in self.linhas_csv(params)[1:]]
+                self.assertEqual(sorted(exportadas), sorted(reserva['id'] for reserva in listagem))
+                ics = self.exportar('ics', params)
+                self.assertEqual(sorted(int(uid) for uid in re.findall(r'UID:reserva-(\d+)@', ics)), sorted(exportadas))
+
+    def test_ics_escape_e_quebra_de_linha(self):
+        self.primeira.titulo = 'Revisão; orçamento, metas \\ ' + 'ç' * 60
+        self.primeira.save()
+        conteudo = self.exportar('ics', {'sala': self.sala.pk})
+        linhas = conteudo.split('\r\n')
+        # Fim de linha CRLF em todas as linhas, sem \n solto
+        self.assertEqual(linhas[-1], '')
+        self.assertNotIn('\n', conteudo.replace('\r\n', ''))
+        self.assertEqual(linhas[0], 'BEGIN:VCALENDAR')
+        self.assertEqual(linhas[-2], 'END:VCALENDAR')
+        # Linhas de no máximo 75 octetos, continuações começando com espaço
+        self.assertTrue(all(len(linha.encode()) <= 75 for linha in linhas))
+        desdobrado = conteudo.replace('\r\n ', '').split('\r\n')
+        self.assertIn('SUMMARY:Revisão\\; orçamento\\, metas \\\\ ' + 'ç' * 60, desdobrado)
+        self.assertIn('DESCRIPTION:Pauta: "orçamento"\\, metas\\nsegunda linha', desdobrado)
+        self.assertTrue(any(linha.startswith(' ') for linha in linhas))
+        self.assertEqual(desdobrado.count('BEGIN:VEVENT'), 3)
+
+
+class ServidorAsgiTestCase(TransactionTestCase):
+    """backend.asgi: API síncrona pela aplicação WSGI em threads, eventos pelo handler ASGI"""
+
+    def setUp(self):
+        usuario = User.objects.create_user('ana')
+        sala = Sala.objects.create(nome='Sala 1', capacidade=10)
+        inicio = timezone.now() + timedelta(days=1)
+        Reserva.objects.bulk_create(
+            Reserva(sala=sala, usuario=usuario, titulo=f'Reunião {n}', data_inicio=inicio + timedelta(hours=n),
+                    data_fim=inicio + timedelta(hours=n, minutes=30))
+            for n in range(1200)
+        )
+
+    async def chamar(self, aplicacao, caminho):
+        escopo = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': caminho, 'raw_path': caminho.encode(), 'query_string': b'',
+            'root_path': '', 'headers': [(b'host', b'testserver')],
+            'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+        }
+        enviados = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(mensagem):
+            enviados.append(mensagem)
+
+        await aplicacao(escopo, receive, send)
+        return enviados
+
+    async def test_exportacao_enviada_em_partes_pela_aplicacao_wsgi(self):
+        from backend.asgi import application
+
+        finalizadas = []
+
+        def finalizada(**kwargs):
+            finalizadas.append(threading.current_thread().name)
+
+        request_finished.connect(finalizada)
+        try:
+            with warnings.catch_warnings(record=True) as avisos:
+                warnings.simplefilter('always')
+                enviados = await self.chamar(application, '/api/reservas/exportar/csv/')
+        finally:
+            request_finished.disconnect(finalizada)
+        self.assertEqual(enviados[0]['status'], 200)
+        partes = [mensagem['body'] for mensagem in enviados[1:] if mensagem.get('body')]
+        # Um pedaço por bloco de _em_blocos, sem o aviso de iterador consumido inteiro pelo handler ASGI
+        self.assertGreater(len(partes), 2)
+        self.assertEqual(b''.join(partes).decode().count('Reunião '), 1200)
+        self.assertFalse([aviso for aviso in avisos if 'synchronous iterators' in str(aviso.message)])
+        # close() da resposta chamado na thread do pool, que devolve a conexão do banco
+        self.assertEqual(len(finalizadas), 1)
+        self.assertTrue(finalizadas[0].startswith('wsgi'))
+
+    async def test_rotas(self):
+        import backend.asgi as servidor
+
+        with mock.patch.object(servidor, 'django_application', mock.AsyncMock()) as asgi, \
+                mock.patch.object(servidor, 'wsgi_application', mock.AsyncMock()) as wsgi:
+            for caminho in ('/api/eventos/', '/api/reservas/', '/api/chat/conversas/', '/admin/'):
+                await self.chamar(servidor.application, caminho)
+        self.assertEqual([chamada.args[0]['path'] for chamada in asgi.call_args_list], ['/api/eventos/'])
+        self.assertEqual([chamada.args[0]['path'] for chamada in wsgi.call_args_list],
+                         ['/api/reservas/', '/api/chat/conversas/', '/admin/'])
+
+class CacheAgendaTestCase(ReservaBaseTestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.usuario)
+        self.reserva = self.reservar(_hora(self.dia, 10), _hora(self.dia, 11))
+        self.url = f'/api/salas/{self.sala.pk}/agenda/'
+        self.params = {'data_inicio': _hora(self.dia, 0).isoformat(), 'data_fim': _hora(self.dia, 23).isoformat()}
+
+    def test_acerto_envia_o_etag_guardado_com_o_corpo(self):
+        primeira = self.client.get(self.url, self.params)
+        segunda = self.client.get(self.url, self.params)
+        self.assertEqual((primeira['X-Cache'], segunda['X-Cache']), ('MISS', 'HIT'))
+        self.assertEqual(segunda['ETag'], primeira['ETag'])
+        self.assertEqual(segunda.json(), primeira.json())
+        nao_modificada = self.client.get(self.url, self.params, HTTP_IF_NONE_MATCH=primeira['ETag'])
+        self.assertEqual(nao_modificada.status_code, 304)
+
+    def test_entrada_com_etag_antigo_conta_como_falha(self):
+        primeira = self.client.get(self.url, self.params)
+        # update() não dispara sinais: a invalidação do cache não acontece
+        Reserva.objects.filter(pk=self.reserva.pk).update(titulo='Renomeada', atualizado_em=timezone.now())
+        segunda = self.client.get(self.url, self.params)
+        self.assertEqual(segunda['X-Cache'], 'MISS')
+        self.assertNotEqual(segunda['ETag'], primeira['ETag'])
+        self.assertEqual([reserva['titulo'] for reserva in segunda.json()], ['Renomeada'])
+        terceira = self.client.get(self.url, self.params)
+        self.assertEqual((terceira['X-Cache'], terceira['ETag']), ('HIT', segunda['ETag']))
+
+
+class EstadoCompartilhadoTestCase(TestCase):
+    LOCMEM = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+    REDIS = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://r'}}
+
+    def ids(self):
+        return [erro.id for erro in checks.estado_compartilhado()]
+
+    def test_um_worker_aceita_estado_do_processo(self):
+        with override_settings(WEB_CONCURRENCY=1, CACHES=self.LOCMEM, EVENTOS_BROKER='agendamento.eventos.BrokerLocal'):
+            self.assertEqual(self.ids(), [])
+            with self.assertNoLogs('agendamento.checks'):
+                checks.avisar_estado_compartilhado()
+
+    def test_varios_workers_avisam_sem_impedir_a_subida(self):
+        with override_settings(WEB_CONCURRENCY=4, CACHES=self.LOCMEM, EVENTOS_BROKER='agendamento.eventos.BrokerLocal'):
+            self.assertEqual(self.ids(), ['agendamento.W002', 'agendamento.W003'])
+            self.assertFalse(any(aviso.is_serious() for aviso in checks.estado_compartilhado()))
+            with self.assertLogs('agendamento.checks', 'WARNING') as logs:
+                checks.avisar_estado_compartilhado()
+            self.assertEqual(len(logs.records), 2)
+        with override_settings(WEB_CONCURRENCY=4, CACHES=self.REDIS, EVENTOS_BROKER='agendamento.eventos.BrokerRedis'):
+            self.assertEqual(self.ids(), [])
+
+
+class PaginacaoPorNumeroTestCase(ReservaBaseTestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        self.client.force_authenticate(self.usuario)
+        for hora in range(8, 15):
+            self.reservar(_hora(self.dia, hora), _hora(self.dia, hora, 30))
+
+    def test_page_size_vale_no_modo_por_pagina(self):
+        resposta = self.client.get('/api/reservas/', {'page': 2, 'page_size': 3})
+        self.assertEqual(resposta.status_code, 200)
+        dados = resposta.json()
+        self.assertEqual(dados['count'], 7)
+        self.assertEqual([reserva['data_inicio'][11:16] for reserva in dados['results']], ['11:00', '10:00', '09:00'])
+        self.assertIn('page_size=3', dados['next'])
+        self.assertEqual(self.client.get('/api/reservas/', {'page': 4, 'page_size': 3}).status_code, 404)
+
+    def test_page_size_limitado_ao_maximo(self):
+        resposta = self.client.get('/api/reservas/', {'page': 1, 'page_size': 1000})
+        self.assertEqual(len(resposta.json()['results']), 7)
+
+
+class CalendarioTestCase(ReservaBaseTestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        cache.clear()
+        self.reserva = self.reservar(_hora(self.dia, 10), _hora(self.dia, 11), titulo='Planejamento')
+        self.token = self.sala.token_calendario
+
+    def salvar(self, objeto, **campos):
+        for campo, valor in campos.items():
+            setattr(objeto, campo, valor)
+        with self.captureOnCommitCallbacks(execute=True):
+            objeto.save()
+
+    def test_consulta_em_cache_nao_usa_o_banco(self):
+        self.assertIn('Planejamento', calendario.obter(self.token)[0])
+        with self.assertNumQueries(0):
+            self.assertIn('Planejamento', calendario.obter(self.token)[0])
+        resposta = self.client.get(f'/api/calendarios/{self.token}.ics')
+        self.assertEqual(resposta.status_code, 200)
+        with self.assertNumQueries(0):
+            resposta = self.client.get(f'/api/calendarios/{self.token}.ics', HTTP_IF_NONE_MATCH=resposta['ETag'])
+        self.assertEqual(resposta.status_code, 304)
+
+    def test_alteracoes_invalidam_o_feed(self):
+        calendario.obter(self.token)
+        self.salvar(self.reserva, titulo='Retrospectiva')
+        self.assertIn('Retrospectiva', calendario.obter(self.token)[0])
+        self.salvar(self.sala, nome='Sala Azul')
+        self.assertIn('LOCATION:Sala Azul', calendario.obter(self.token)[0])
+        with self.assertNumQueries(0):
+            calendario.obter(self.token)
+
+    def test_versao_sem_entrada_no_cache_nao_volta_a_valer(self):
+        calendario.obter(self.token)
+        Reserva.objects.filter(pk=self.reserva.pk).update(titulo='Retrospectiva')
+        CalendarioSala.objects.filter(pk=self.sala.pk).update(versao=models.F('versao') + 1)
+        # A versão da sala sai do cache (expirou ou foi descartada): recomeça pelo relógio
+        cache.delete(f'calendario:versao:{self.sala.pk}')
+        self.assertIn('Retrospectiva', calendario.obter(self.token)[0])
+
+    def test_token_trocado_ou_sala_desativada_param_de_responder(self):
+        self.assertIsNotNone(calendario.obter(self.token))
+        self.salvar(self.sala, token_calendario=gerar_token_calendario())
+        self.assertIsNone(calendario.obter(self.token))
+        novo = self.sala.token_calendario
+        self.assertIsNotNone(calendario.obter(novo))
+        self.salvar(self.sala, ativa=False)
+        self.assertIsNone(calendario.obter(novo))
+        self.assertEqual(self.client.get(f'/api/calendarios/{novo}.ics').status_code, 404)
+
+    def test_sala_removida(self):
+        self.assertIsNotNone(calendario.obter(self.token))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.sala.delete()
+        self.assertIsNone(calendario.obter(self.token))
+
+
+class TransicoesTestCase(ReservaBaseTestCase):
+    def setUp(self):
+        ontem = timezone.localdate() - timedelta(days=1)
+        self.reservas = [self.reservar(_hora(ontem, hora), _hora(ontem, hora, 30)) for hora in (8, 9, 10)]
+        self.ultimo_registro = RegistroAlteracao.objects.order_by('-id').values_list('id', flat=True).first()
+
+    def registradas(self):
+        return sorted(RegistroAlteracao.objects.filter(id__gt=self.ultimo_registro).values_list('objeto_id', flat=True))
+
+    def test_emite_so_para_as_linhas_alteradas(self):
+        cancelada = self.reservas[1]
+        update = QuerySet.update
+
+        def update_concorrente(queryset, **valores):
+            # Outra instância cancela uma das reservas entre a seleção e o UPDATE
+            if queryset.model is Reserva and valores.get('status') == 'concluida':
+                update(Reserva.objects.filter(pk=cancelada.pk), status='cancelada')
+            return update(queryset, **valores)
+
+        with mock.patch.object(transicoes.signals, 'reservas_alteradas') as reservas_alteradas, \
+                mock.patch.object(QuerySet, 'update', autospec=True, side_effect=update_concorrente):
+            totais = transicoes.avancar_status()
+
+        self.assertEqual(totais, {'concluida': 2, 'em_andamento': 0})
+        esperadas = sorted(reserva.pk for reserva in self.reservas if reserva != cancelada)
+        self.assertEqual(self.registradas(), esperadas)
+        (alteracoes,), _ = reservas_alteradas.call_args
+        self.assertEqual(len(alteracoes), 2)
+        self.assertEqual(Reserva.objects.get(pk=cancelada.pk).status, 'cancelada')
+
+
+@skipUnless(connection.vendor == 'postgresql' or not connection.is_in_memory_db(),
+            'Gravações concorrentes em conexões separadas exigem PostgreSQL ou SQLite em arquivo')
+class ReservasConcorrentesTestCase(TransactionTestCase):
+    """
+    Várias requisições simultâneas pelo mesmo horário: só uma grava. Cada
+    thread usa a própria conexão; no PostgreSQL vale o SELECT ... FOR UPDATE
+    da sala, no SQLite (banco de teste em arquivo) a trava por sala do processo.
+    """
+
+    TENTATIVAS = 8
+    RODADAS = 3
+
+    def test_uma_reserva_por_horario(self):
+        usuario = User.objects.create_user('ana')
+        sala = Sala.objects.create(nome='Sala 1', capacidade=10)
+        dia = timezone.localdate() + timedelta(days=7)
+
+        def reservar(barreira, respostas, inicio):
+            cliente = APIClient()
+            cliente.force_authenticate(usuario)
+            try:
+                barreira.wait()
+                resposta = cliente.post('/api/reservas/', {
+                    'sala': sala.pk, 'titulo': 'Disputa',
+                    'data_inicio': inicio.isoformat(), 'data_fim': (inicio + timedelta(hours=1)).isoformat(),
+                }, format='json')
+                respostas.append(resposta.status_code)
+            finally:
+                connection.close()
+
+        for rodada in range(self.RODADAS):
+            barreira, respostas = threading.Barrier(self.TENTATIVAS), []
+            # Intervalos que se sobrepõem dois a dois, deslocados de 5 em 5 minutos
+            tarefas = [
+                threading.Thread(target=reservar, args=(
+                    barreira, respostas, _hora(dia, 8 + 3 * rodada) + timedelta(minutes=5 * n),
+                ))
+                for n in range(self.TENTATIVAS)
+            ]
+            for tarefa in tarefas:
+                tarefa.start()
+            for tarefa in tarefas:
+                tarefa.join()
+            with self.subTest(rodada=rodada):
+                self.assertEqual(sorted(respostas), [201] + [409] * (self.TENTATIVAS - 1))
+
+        self.assertEqual(Reserva.objects.filter(sala=sala).count(), self.RODADAS)
+
+
+class SincronizacaoTestCase(TestCase):
+    def registrar(self, ids, segundos_atras):
+        sincronizacao.registrar('reserva', ids)
+        RegistroAlteracao.objects.filter(objeto_id__in=ids).update(
+            criado_em=timezone.now() - timedelta(seconds=segundos_atras),
+        )
+        return RegistroAlteracao.objects.get(objeto_id=ids[-1]).pk
+
+    @override_settings(SYNC_ATRASO_SEGUNDOS=30)
+    def test_token_para_antes_das_alteracoes_dentro_da_janela(self):
+        antiga = self.registrar([1, 2], segundos_atras=60)
+        self.registrar([3], segundos_atras=10)
+        token, alterados, mais = sincronizacao.alteracoes_desde(0, limite=10)
+        self.assertEqual((token, alterados['reserva'], mais), (antiga, [1, 2], False))
+        self.assertEqual(sincronizacao.token_atual(), antiga)
+
+    @override_settings(SYNC_ATRASO_SEGUNDOS=0)
+    def test_janela_configuravel(self):
+        ultima = self.registrar([1, 2], segundos_atras=0)
+        token, alterados, _ = sincronizacao.alteracoes_desde(0, limite=10)
+        self.assertEqual((token, alterados['reserva']), (ultima, [1, 2]))
+
+
+class BrokerRedisTestCase(SimpleTestCase):
+    def broker(self):
+        # Sem conexão: os clientes do Redis são substituídos
+        broker = eventos.BrokerRedis.__new__(eventos.BrokerRedis)
+        broker._cliente = mock.Mock()
+        return broker
+
+    def test_publicar_fora_do_event_loop_usa_o_cliente_sincrono(self):
+        broker = self.broker()
+        broker.publicar('sala:1', 'quadro')
+        broker._cliente.publish.assert_called_once_with(broker.canal, '["sala:1", "quadro"]')
+
+    async def test_publicar_dentro_do_event_loop_nao_bloqueia(self):
+        broker = self.broker()
+        assincrono = mock.AsyncMock()
+        with mock.patch.object(broker, '_cliente_assincrono', return_value=assincrono):
+            broker.publicar('sala:1', 'quadro')
+            await asyncio.sleep(0)
+            await broker.apublicar('sala:2', 'outro')
+        broker._cliente.publish.assert_not_called()
+        self.assertEqual(assincrono.publish.await_args_list, [
+            mock.call(broker.canal, '["sala:1", "quadro"]'),
+            mock.call(broker.canal, '["sala:2", "outro"]'),
+        ])
+
+
+class BuscaTestCase(ReservaBaseTestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        self.client.force_authenticate(self.usuario)
+        self.planejamento = self.reservar(_hora(self.dia, 8), _hora(self.dia, 9), titulo='Planejamento trimestral',
+                                          descricao='Metas e orçamento')
+        self.orcamento = self.reservar(_hora(self.dia, 10), _hora(self.dia, 11), titulo='Revisão de orçamento',
+                                       descricao='Planejamento financeiro')
+        self.reservar(_hora(self.dia, 12), _hora(self.dia, 13), titulo='Almoço', descricao='Equipe')
+
+    def titulos(self, texto):
+        return list(Reserva.objects.buscar(texto).values_list('titulo', flat=True))
+
+    def test_relevancia_pesa_o_titulo_acima_da_descricao(self):
+        self.assertEqual(self.titulos('planejamento'), ['Planejamento trimestral', 'Revisão de orçamento'])
+        self.assertEqual(self.titulos('orçamento'), ['Revisão de orçamento', 'Planejamento trimestral'])
+        self.assertEqual(self.titulos('planejamento metas'), ['Planejamento trimestral'])
+        self.assertEqual(self.titulos('!!!'), [])
+
+    def test_indice_acompanha_alteracoes_e_remocoes(self):
+        self.planejamento.titulo = 'Retrospectiva'
+        self.planejamento.save()
+        self.orcamento.delete()
+        self.assertEqual(self.titulos('planejamento'), [])
+        self.assertEqual(self.titulos('retrospectiva'), ['Retrospectiva'])
+
+    def test_endpoint(self):
+        resposta = self.client.get('/api/reservas/busca/', {'q': 'planejamento'})
+        self.assertEqual(resposta.status_code, 200)
+        resultados = resposta.json()['results']
+        self.assertEqual([reserva['id'] for reserva in resultados], [self.planejamento.pk, self.orcamento.pk])
+        self.assertGreater(resultados[0]['relevancia'], resultados[1]['relevancia'])
+        self.assertEqual(self.client.get('/api/reservas/busca/').status_code, 400)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'tsvector e websearch_to_tsquery só existem no PostgreSQL')
+class BuscaPostgresqlTestCase(BuscaTestCase):
+    def test_radicais_e_sintaxe_de_busca(self):
+        self.assertEqual(self.titulos('planejamentos'), ['Planejamento trimestral', 'Revisão de orçamento'])
+        self.assertEqual(self.titulos('planejamento -metas'), ['Revisão de orçamento'])
+        self.assertEqual(self.titulos('"revisão de orçamento"'), ['Revisão de orçamento'])
+
+    def test_consulta_usa_o_indice_gin(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            sql, parametros = Reserva.objects.buscar('planejamento').query.sql_with_params()
+            cursor.execute(f'EXPLAIN {sql}', parametros)
+            plano = '\n'.join(linha for linha, in cursor.fetchall())
+        self.assertIn('agendamento_reserva_busca_idx', plano)
+
+
+class MigracaoBuscaTestCase(TransactionTestCase):
+    """O SQL das migrações é o de IndiceTexto, e desfazer/refazer a migração mantém a busca"""
+
+    MIGRACOES = {
+        'agendamento_reserva': 'agendamento.migrations.0012_reserva_busca_textual',
+        'chat_message': 'chat.migrations.0005_message_busca_textual',
+    }
+
+    def test_sql_das_migracoes_igual_ao_do_indice(self):
+        for tabela, modulo in self.MIGRACOES.items():
+            migracao = importlib.import_module(modulo)
+            for vendor in ('postgresql', 'sqlite'):
+                with self.subTest(tabela=tabela, vendor=vendor):
+                    esperado = [' '.join(comando.split()) for comando in busca.INDICES[tabela].comandos_criar(vendor)]
+                    self.assertEqual([' '.join(comando.split()) for comando in migracao.CRIAR[vendor]], esperado)
+
+    @skipUnless(connection.vendor in ('postgresql', 'sqlite'), 'Busca indexada só no PostgreSQL e no SQLite')
+    def test_desfazer_e_refazer(self):
+        migracao = importlib.import_module(self.MIGRACOES['agendamento_reserva'])
+        usuario = User.objects.create_user('ana')
+        sala = Sala.objects.create(nome='Sala 1', capacidade=10)
+        dia = timezone.localdate() + timedelta(days=7)
+        Reserva.objects.create(sala=sala, usuario=usuario, titulo='Planejamento',
+                               data_inicio=_hora(dia, 8), data_fim=_hora(dia, 9))
+        with connection.schema_editor() as editor:
+            migracao.remover_indice(None, editor)
+        Reserva.objects.create(sala=sala, usuario=usuario, titulo='Planejamento anual',
+                               data_inicio=_hora(dia, 10), data_fim=_hora(dia, 11))
+        with connection.schema_editor() as editor:
+            migracao.criar_indice(None, editor)
+        self.assertEqual(Reserva.objects.buscar('planejamento').count(), 2)
@@ -0,0 +1,81 @@
+"""
+Avanço automático do status das reservas conforme o horário:
+agendada -> em_andamento no início e agendada/em_andamento -> concluida no fim.
+
+As transições são UPDATEs em lote sobre ids travados com
+SELECT ... FOR UPDATE SKIP LOCKED, então várias instâncias podem rodar ao
+mesmo tempo sem processar a mesma linha, e repetir uma execução não tem
+efeito. Usado pelo comando `atualizar_status_reservas`.
+"""
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from . import signals
+from .models import Reserva
+
+
+def _transicoes(agora):
+    """(filtro, novo status) na ordem em que devem ser aplicadas"""
+    return [
+        (dict(status__in=Reserva.STATUS_ATIVOS, data_fim__lte=agora), 'concluida'),
+        (dict(status='agendada', data_inicio__lte=agora, data_fim__gt=agora), 'em_andamento'),
+    ]
+
+
+def _avancar_lote(filtro, novo_status, agora, tamanho):
+    """Aplica uma transição a até `tamanho` reservas; devolve quantas mudaram"""
+    with transaction.atomic():
+        linhas = list(
+            Reserva.objects.filter(**filtro)
+            .select_for_update(skip_locked=True)
+            .order_by('data_fim')
+            .values_list('pk', 'sala_id', 'data_inicio', 'data_fim', 'status')[:tamanho]
+        )
+        if not linhas:
+            return 0
+        ids = [linha[0] for linha in linhas]
+        # O filtro é repetido no UPDATE: se outra instância já mudou a linha, nada acontece
+        # (onde SELECT ... FOR UPDATE não trava, como no SQLite)
+        if not Reserva.objects.filter(pk__in=ids, **filtro).update(status=novo_status, atualizado_em=agora):
+            return 0
+        # Só as linhas que este UPDATE mudou (ainda travadas por esta transação) vão
+        # para o log de sincronização e para os caches
+        alteradas = set(
+            Reserva.objects.filter(pk__in=ids, status=novo_status, atualizado_em=agora).values_list('pk', flat=True)
+        )
+        linhas = [linha for linha in linhas if linha[0] in alteradas]
+        signals.alteracoes_registradas('reserva', [(linha[0], linha[1]) for linha in linhas])
+        signals.reservas_alteradas([
+            ((sala_id, inicio, fim, status), (sala_id, inicio, fim, novo_status))
+            for _, sala_id, inicio, fim, status in linhas
+        ])
+    return len(linhas)
+
+
+def avancar_status(agora=None, tamanho_lote=500):
+    """Aplica todas as transições vencidas até `agora`; devolve {novo_status: quantidade}"""
+    agora = agora or timezone.now()
+    totais = {}
+    for filtro, novo_status in _transicoes(agora):
+        total = 0
+        while True:
+            alteradas = _avancar_lote(filtro, novo_status, agora, tamanho_lote)
+            if not alteradas:
+                break
+            total += alteradas
+        totais[novo_status] = total
+    return totais
+
+
+def proxima_transicao(agora=None):
+    """Próximo início de reserva agendada ou fim de reserva ativa depois de `agora` (ou None)"""
+    agora = agora or timezone.now()
+    inicio = Reserva.objects.filter(status='agendada', data_inicio__gt=agora).aggregate(
+        proximo=Min('data_inicio')
+    )['proximo']
+    fim = Reserva.objects.ativas().filter(data_fim__gt=agora).aggregate(
+        proximo=Min('data_fim')
+    )['proximo']
+    candidatos = [valor for valor in (inicio, fim) if valor is not None]
+    return min(candidatos) if candidatos else None
@@ -0,0 +1,42 @@
+"""
+Exclusão mútua por sala para gravações de reservas.
+
+A verificação de conflito de Reserva.clean() e o INSERT precisam acontecer
+sem que outra reserva da mesma sala seja gravada no meio. `reserva_atomica`
+abre a transação e trava as linhas das salas envolvidas
+(SELECT ... FOR UPDATE), em ordem de id para não haver deadlock entre
+gravações que envolvem mais de uma sala. Reservas de salas diferentes
+continuam em paralelo.
+
+Bancos sem SELECT ... FOR UPDATE (SQLite, em desenvolvimento) usam uma
+trava por sala dentro do processo, suficiente para o runserver.
+"""
+import threading
+from contextlib import ExitStack, contextmanager
+
+from django.db import connection, transaction
+
+from .models import Sala
+
+_travas_locais = {}
+_trava_do_dicionario = threading.Lock()
+
+
+def _trava_local(sala_id):
+    with _trava_do_dicionario:
+        return _travas_locais.setdefault(sala_id, threading.Lock())
+
+
+@contextmanager
+def reserva_atomica(*salas):
+    """Transação com as salas (instâncias ou ids) travadas até o commit"""
+    ids = sorted({getattr(sala, 'pk', sala) for sala in salas if sala is not None})
+    with ExitStack() as pilha:
+        if not connection.features.has_select_for_update:
+            # A trava local é liberada depois do commit (sai da pilha por último)
+            for sala_id in ids:
+                pilha.enter_context(_trava_local(sala_id))
+        pilha.enter_context(transaction.atomic())
+        if connection.features.has_select_for_update:
+            list(Sala.objects.select_for_update().filter(pk__in=ids).order_by('pk').values_list('pk', flat=True))
+        yield
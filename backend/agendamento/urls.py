@@ -11,4 +11,8 @@ urlpatterns = [
     path('', include(router.urls)),
     path('auth/login/', views.AuthView.as_view(), name='auth_login'),
     path('auth/user/', views.UserProfileView.as_view(), name='user_profile'),
+    path('sync/', views.SyncView.as_view(), name='sync'),
+    path('eventos/', views.eventos_sse, name='eventos'),
+    path('calendarios/<str:token>.ics', views.calendario_sala, name='calendario_sala'),
+    path('cache/estatisticas/', views.CacheEstatisticasView.as_view(), name='cache_estatisticas'),
 ]
@@ -4,14 +4,105 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
-from django.db.models import Q
-from datetime import datetime, timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, FilteredRelation, Max, Q
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, HttpResponseNotAllowed, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from django.views.decorators.http import require_GET
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime, parse_time
+from datetime import datetime, time, timedelta
+import csv
 from rest_framework_simplejwt.tokens import RefreshToken
-from .models import Sala, Reserva, PerfilUsuario
+from . import cache_agenda, calendario, disponibilidade, eventos, icalendar, signals, sincronizacao
+from .condicional import ListagemCondicionalMixin, gerar_etag, nao_modificado, resumo_queryset
+from .idempotencia import idempotente
+from .instrumentacao import medir_consultas
+from .models import Sala, Reserva, PerfilUsuario, gerar_token_calendario
+from .paginacao import BuscaPagination, ReservaPagination, UsuarioPagination
 from .serializers import (
-    SalaSerializer, ReservaSerializer, ReservaCreateSerializer, 
+    SalaSerializer, ReservaSerializer, ReservaBuscaSerializer, ReservaCreateSerializer, ReservaLoteSerializer,
     UsuarioSerializer, PerfilUsuarioSerializer
 )
+from .travas import reserva_atomica
+
+def _parse_data_hora(valor):
+    """Converte data/hora ISO 8601 (ou só a data) em datetime com fuso"""
+    try:
+        data_hora = parse_datetime(valor)
+        if data_hora is None:
+            data = parse_date(valor)
+            data_hora = datetime.combine(data, time.min) if data else None
+    except ValueError:
+        return None
+    if data_hora is not None and timezone.is_naive(data_hora):
+        data_hora = timezone.make_aware(data_hora)
+    return data_hora
+
+class _Eco:
+    """Pseudo-arquivo para csv.writer: devolve a linha formatada em vez de guardá-la"""
+    def write(self, valor):
+        return valor
+
+def _em_blocos(partes, tamanho=500):
+    """Agrupa pedaços de texto para não enviar um pedaço por linha ao servidor"""
+    bloco = []
+    for parte in partes:
+        bloco.append(parte)
+        if len(bloco) >= tamanho:
+            yield ''.join(bloco)
+            bloco = []
+    if bloco:
+        yield ''.join(bloco)
+
+def _conflitos_do_lote(sala, ocorrencias):
+    """
+    Conflitos de cada ocorrência, indexados pela posição dela no lote: com
+    reservas ativas existentes (uma única consulta) e entre as próprias
+    ocorrências.
+    """
+    conflitos = {}
+    intervalos = [(o['data_inicio'], o['data_fim']) for o in ocorrencias]
+    existentes = Reserva.objects.conflitantes_em_lote(sala, intervalos).order_by(
+        'data_inicio'
+    ).values('id', 'titulo', 'data_inicio', 'data_fim')
+    for reserva in existentes:
+        for indice, (inicio, fim) in enumerate(intervalos):
+            if reserva['data_inicio'] < fim and inicio < reserva['data_fim']:
+                conflitos.setdefault(indice, []).append({'reserva': {
+                    **reserva,
+                    'data_inicio': timezone.localtime(reserva['data_inicio']),
+                    'data_fim': timezone.localtime(reserva['data_fim']),
+                }})
+
+    # Sobreposição entre as ocorrências restantes: ordena por início e compara
+    # com a que termina mais tarde até ali
+    livres = [indice for indice in range(len(intervalos)) if indice not in conflitos]
+    ordem = sorted(livres, key=lambda i: intervalos[i])
+    anterior = None
+    for indice in ordem:
+        if anterior is not None and intervalos[indice][0] < intervalos[anterior][1]:
+            conflitos.setdefault(indice, []).append({'ocorrencia': anterior})
+        if anterior is None or intervalos[indice][1] > intervalos[anterior][1]:
+            anterior = indice
+    return conflitos
+
+def _contadores_globais_dashboard():
+    """Total de salas ativas e reservas em andamento agora, em uma só consulta"""
+    agora = timezone.now()
+    return Sala.objects.annotate(
+        em_andamento=FilteredRelation('reservas', condition=Q(
+            reservas__status='em_andamento',
+            reservas__data_inicio__lte=agora,
+            reservas__data_fim__gte=agora,
+        ))
+    ).aggregate(
+        total_salas=Count('id', filter=Q(ativa=True), distinct=True),
+        salas_ocupadas_agora=Count('em_andamento'),
+    )
 
 class AuthView(APIView):
     permission_classes = [permissions.AllowAny]
@@ -25,22 +116,11 @@ class AuthView(APIView):
                 'error': 'Email/Username e password são obrigatórios'
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        # Tenta autenticar por username
-        user = authenticate(username=identifier, password=password)
-
-        # Se falhar, tenta autenticar por email
-        if not user:
-            try:
-                # Pega apenas o primeiro usuário com esse email (para lidar com duplicatas)
-                user_obj = User.objects.filter(email__iexact=identifier).first()
-                if user_obj:
-                    user = authenticate(username=user_obj.username, password=password)
-            except Exception:
-                user = None
+        # Username ou email, resolvidos pelo EmailOuUsernameBackend com um único hash
+        user = authenticate(request, username=identifier, password=password)
 
         if user:
             refresh = RefreshToken.for_user(user)
-            perfil, created = PerfilUsuario.objects.get_or_create(usuario=user)
             return Response({
                 'access': str(refresh.access_token),
                 'refresh': str(refresh),
@@ -63,7 +143,11 @@ class UserProfileView(APIView):
     
     def get(self, request):
         user = request.user
-        perfil, created = PerfilUsuario.objects.get_or_create(usuario=user)
+        # O perfil normalmente já vem junto do usuário autenticado (CachedJWTAuthentication)
+        try:
+            perfil = user.perfil
+        except PerfilUsuario.DoesNotExist:
+            perfil, created = PerfilUsuario.objects.get_or_create(usuario=user)
         
         return Response({
             'id': user.id,
@@ -75,11 +159,137 @@ class UserProfileView(APIView):
             'perfil': PerfilUsuarioSerializer(perfil).data
         })
 
-class SalaViewSet(viewsets.ModelViewSet):
+class SyncView(APIView):
+    """
+    Sincronização incremental: reservas e salas alteradas depois do token
+    `since`. Sem `since`, devolve só o token atual (pegue o token antes da
+    carga completa pelas listagens e sincronize a partir dele).
+    Tokens anteriores à retenção do log recebem 410: refaça a carga completa.
+    Alterações só aparecem SYNC_ATRASO_SEGUNDOS depois de gravadas.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get(self, request):
+        desde = request.query_params.get('since')
+        if desde is None:
+            return Response({'token': str(sincronizacao.token_atual())})
+        try:
+            desde = int(desde)
+        except ValueError:
+            return Response({'error': 'since deve ser um token válido'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            token, alterados, mais = sincronizacao.alteracoes_desde(desde, settings.SYNC_LIMITE)
+        except sincronizacao.TokenExpirado:
+            return Response({'error': 'Token expirado: refaça a carga completa'}, status=status.HTTP_410_GONE)
+        
+        reservas = list(Reserva.objects.filter(pk__in=alterados['reserva']).para_listagem())
+        salas = list(Sala.objects.filter(pk__in=alterados['sala']).com_reservas_ativas())
+        return Response({
+            'token': str(token),
+            'mais': mais,
+            'reservas': ReservaSerializer(reservas, many=True).data,
+            'salas': SalaSerializer(salas, many=True).data,
+            'removidos': {
+                'reservas': sorted(set(alterados['reserva']) - {reserva.pk for reserva in reservas}),
+                'salas': sorted(set(alterados['sala']) - {sala.pk for sala in salas}),
+            },
+        })
+
+class CacheEstatisticasView(APIView):
+    """Contadores de acerto/falha dos caches da API, para monitoramento"""
+    permission_classes = [permissions.IsAdminUser]
+    
+    def get(self, request):
+        return Response({'agenda': cache_agenda.estatisticas()})
+
+@require_GET
+def calendario_sala(request, token):
+    """
+    Feed .ics público de uma sala, para assinatura no Outlook/Google.
+    View Django simples (sem DRF) porque os clientes pedem `Accept: text/calendar`
+    e não há autenticação: o token da URL é o segredo.
+    """
+    feed = calendario.obter(token)
+    if feed is None:
+        raise Http404
+    conteudo, etag, modificado_em = feed
+    resposta = HttpResponse(conteudo, content_type='text/calendar; charset=utf-8')
+    resposta['ETag'] = etag
+    resposta['Last-Modified'] = http_date(modificado_em.timestamp())
+    patch_cache_control(resposta, private=True, max_age=settings.CALENDARIO_MAX_AGE)
+    return get_conditional_response(
+        request, etag=etag, last_modified=int(modificado_em.timestamp()), response=resposta
+    )
+
+async def _fluxo_eventos(topicos):
+    assinatura = await eventos.assinar(topicos)
+    try:
+        yield f'retry: {settings.EVENTOS_RECONEXAO_MS}\n\n'
+        while True:
+            mensagem = await assinatura.fila.get()
+            if mensagem is eventos.FIM:
+                break
+            yield mensagem
+    finally:
+        eventos.cancelar(assinatura)
+
+async def eventos_sse(request):
+    """
+    Server-Sent Events com as alterações de reservas e salas (só ids e ação;
+    os dados vêm de /api/sync/ ou das listagens). `?salas=1,2` restringe às
+    salas indicadas. Requer o servidor ASGI (ver Procfile).
+    A conexão é encerrada após EVENTOS_DURACAO_MAXIMA segundos e o EventSource
+    reconecta sozinho: o Django 4.2 não percebe a desconexão do cliente no
+    meio do streaming, e assim conexões abandonadas não ficam para sempre.
+    O evento `ressincronizar` indica que eventos foram perdidos.
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    salas = request.GET.get('salas')
+    if salas:
+        try:
+            topicos = {f'sala:{int(sala_id)}' for sala_id in salas.split(',')}
+        except ValueError:
+            return HttpResponseBadRequest('salas deve ser uma lista de ids separados por vírgula')
+    else:
+        topicos = {eventos.TODAS}
+    resposta = StreamingHttpResponse(_fluxo_eventos(topicos), content_type='text/event-stream')
+    resposta['Cache-Control'] = 'no-cache'
+    # Sem buffer no proxy reverso (nginx), senão os eventos chegam atrasados
+    resposta['X-Accel-Buffering'] = 'no'
+    return resposta
+
+class SalaViewSet(ListagemCondicionalMixin, viewsets.ModelViewSet):
     queryset = Sala.objects.filter(ativa=True)
     serializer_class = SalaSerializer
     permission_classes = [permissions.AllowAny]  # Temporário para debug
     
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ('list', 'retrieve'):
+            queryset = queryset.com_reservas_ativas()
+        return queryset
+    
+    def validadores_listagem(self, queryset):
+        # reservas_ativas muda com as reservas e com a passagem do tempo
+        reservas_ativas = Reserva.objects.ativas().filter(data_fim__gte=timezone.now())
+        return (
+            *resumo_queryset(Sala.objects.filter(ativa=True)),
+            *resumo_queryset(reservas_ativas),
+        )
+    
+    @action(detail=True, methods=['get', 'post'], url_path='calendario',
+            permission_classes=[permissions.IsAdminUser])
+    def calendario_url(self, request, pk=None):
+        """URL do feed .ics da sala; POST gera um token novo e invalida a URL anterior"""
+        sala = self.get_object()
+        if request.method == 'POST':
+            sala.token_calendario = gerar_token_calendario()
+            sala.save(update_fields=['token_calendario', 'atualizado_em'])
+        url = reverse('calendario_sala', args=[sala.token_calendario])
+        return Response({'url': request.build_absolute_uri(url)})
+    
     @action(detail=True, methods=['get'])
     def agenda(self, request, pk=None):
         """Retorna a agenda de uma sala específica"""
@@ -87,10 +297,13 @@ class SalaViewSet(viewsets.ModelViewSet):
         data_inicio = request.query_params.get('data_inicio')
         data_fim = request.query_params.get('data_fim')
         
-        if not data_inicio:
-            data_inicio = datetime.now()
-        if not data_fim:
-            data_fim = datetime.now() + timedelta(days=7)
+        # Janela padrão arredondada ao minuto para que a chave de cache se repita
+        agora = timezone.now().replace(second=0, microsecond=0)
+        data_inicio = _parse_data_hora(data_inicio) if data_inicio else agora
+        data_fim = _parse_data_hora(data_fim) if data_fim else agora + timedelta(days=7)
+        if not data_inicio or not data_fim:
+            return Response({'error': 'data_inicio e data_fim devem ser datas válidas'},
+                          status=status.HTTP_400_BAD_REQUEST)
         
         reservas = Reserva.objects.filter(
             sala=sala,
@@ -99,8 +312,16 @@ class SalaViewSet(viewsets.ModelViewSet):
             status__in=['agendada', 'em_andamento']
         )
         
-        serializer = ReservaSerializer(reservas, many=True)
-        return Response(serializer.data)
+        etag = gerar_etag(request, sala.atualizado_em, *resumo_queryset(reservas))
+        resposta = nao_modificado(request, etag)
+        if resposta is not None:
+            return resposta
+        
+        def gerar():
+            return ReservaSerializer(reservas.para_listagem(), many=True).data
+        
+        etag, dados, acerto = cache_agenda.obter(sala.pk, data_inicio, data_fim, etag, gerar)
+        return Response(dados, headers={'X-Cache': 'HIT' if acerto else 'MISS', 'ETag': etag})
     
     @action(detail=False, methods=['get'])
     def disponiveis(self, request):
@@ -113,31 +334,89 @@ class SalaViewSet(viewsets.ModelViewSet):
             return Response({'error': 'data_inicio e data_fim são obrigatórios'}, 
                           status=status.HTTP_400_BAD_REQUEST)
         
-        # Salas com conflito no horário
-        salas_ocupadas = Reserva.objects.filter(
-            data_inicio__lt=data_fim,
-            data_fim__gt=data_inicio,
-            status__in=['agendada', 'em_andamento']
-        ).values_list('sala_id', flat=True)
+        data_inicio = _parse_data_hora(data_inicio)
+        data_fim = _parse_data_hora(data_fim)
+        if not data_inicio or not data_fim or data_inicio >= data_fim:
+            return Response({'error': 'data_inicio e data_fim devem ser datas válidas, com início antes do fim'},
+                          status=status.HTTP_400_BAD_REQUEST)
         
-        # Salas disponíveis
-        salas_disponiveis = Sala.objects.filter(
+        # Salas candidatas, filtradas pelos mapas de ocupação em cache
+        candidatas = Sala.objects.filter(
             ativa=True,
             capacidade__gte=capacidade_min
-        ).exclude(id__in=salas_ocupadas)
+        ).com_reservas_ativas()
+        salas_disponiveis = disponibilidade.filtrar_livres(candidatas, data_inicio, data_fim)
         
         serializer = SalaSerializer(salas_disponiveis, many=True)
         return Response(serializer.data)
 
-class ReservaViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['get'], url_path='horarios-livres')
+    def horarios_livres(self, request):
+        """
+        Busca os primeiros horários livres entre todas as salas.
+        Parâmetros: duracao (minutos), capacidade_min, recursos (separados por
+        vírgula), inicio, fim, hora_inicio, hora_fim, limite e criterio
+        ('cedo' ou 'ajuste').
+        """
+        params = request.query_params
+        try:
+            duracao = timedelta(minutes=int(params.get('duracao', 60)))
+            capacidade_min = int(params.get('capacidade_min', 1))
+            limite = min(int(params.get('limite', 5)), 50)
+        except ValueError:
+            return Response({'error': 'duracao, capacidade_min e limite devem ser números inteiros'},
+                          status=status.HTTP_400_BAD_REQUEST)
+        
+        inicio = _parse_data_hora(params['inicio']) if params.get('inicio') else timezone.now()
+        fim = _parse_data_hora(params['fim']) if params.get('fim') else None
+        if inicio and not fim:
+            fim = inicio + timedelta(days=14)
+        try:
+            hora_inicio = parse_time(params.get('hora_inicio', '08:00'))
+            hora_fim = parse_time(params.get('hora_fim', '18:00'))
+        except ValueError:
+            hora_inicio = hora_fim = None
+        criterio = params.get('criterio', 'cedo')
+        
+        if not inicio or not fim or inicio >= fim or fim - inicio > timedelta(days=90):
+            return Response({'error': 'inicio e fim devem ser datas válidas, com no máximo 90 dias de intervalo'},
+                          status=status.HTTP_400_BAD_REQUEST)
+        if not hora_inicio or not hora_fim or duracao <= timedelta(0) or limite < 1:
+            return Response({'error': 'hora_inicio, hora_fim, duracao ou limite inválidos'},
+                          status=status.HTTP_400_BAD_REQUEST)
+        if criterio not in ('cedo', 'ajuste'):
+            return Response({'error': "criterio deve ser 'cedo' ou 'ajuste'"},
+                          status=status.HTTP_400_BAD_REQUEST)
+        
+        salas = Sala.objects.filter(ativa=True, capacidade__gte=capacidade_min)
+        for recurso in filter(None, (r.strip() for r in params.get('recursos', '').split(','))):
+            salas = salas.filter(recursos__icontains=recurso)
+        
+        horarios = disponibilidade.buscar_horarios_livres(
+            salas.only('id', 'nome', 'capacidade'), inicio, fim, duracao,
+            hora_inicio, hora_fim, participantes=capacidade_min,
+            limite=limite, criterio=criterio,
+        )
+        
+        return Response([
+            {
+                'sala': sala.id,
+                'sala_nome': sala.nome,
+                'capacidade': sala.capacidade,
+                'data_inicio': timezone.localtime(data_inicio),
+                'data_fim': timezone.localtime(data_fim),
+            }
+            for sala, data_inicio, data_fim in horarios
+        ])
+
+class ReservaViewSet(ListagemCondicionalMixin, viewsets.ModelViewSet):
     serializer_class = ReservaSerializer
+    pagination_class = ReservaPagination
     permission_classes = [permissions.AllowAny]  # Temporário para debug
     
-    def get_queryset(self):
+    def filtrar(self, queryset):
+        """Filtros da listagem (?sala, ?data_inicio, ?data_fim, ?minhas), também usados nas exportações"""
         user = self.request.user
-        queryset = Reserva.objects.all()
-        
-        # Filtros
         sala_id = self.request.query_params.get('sala')
         data_inicio = self.request.query_params.get('data_inicio')
         data_fim = self.request.query_params.get('data_fim')
@@ -157,12 +436,37 @@ class ReservaViewSet(viewsets.ModelViewSet):
         
         return queryset
     
+    def get_queryset(self):
+        queryset = self.filtrar(Reserva.objects.all())
+        
+        # Leitura: junta sala/usuário sem carregar colunas que o serializer não usa
+        if self.action in ('list', 'retrieve'):
+            queryset = queryset.para_listagem()
+        else:
+            queryset = queryset.select_related('sala')
+        
+        return queryset
+    
+    def validadores_listagem(self, queryset):
+        # Com cursor, valida só os itens da página (evita COUNT na tabela toda).
+        # sala_nome vem da sala: renomear uma sala também muda a listagem
+        pagina = self.paginator.validadores(queryset, self.request)
+        return (
+            pagina if pagina is not None else resumo_queryset(queryset),
+            Sala.objects.aggregate(ultimo=Max('atualizado_em'))['ultimo'],
+        )
+    
     def get_serializer_class(self):
         if self.action == 'create':
             return ReservaCreateSerializer
         return ReservaSerializer
     
+    @idempotente
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+    
     @action(detail=True, methods=['post'])
+    @idempotente
     def cancelar(self, request, pk=None):
         """Cancela uma reserva"""
         reserva = self.get_object()
@@ -178,42 +482,167 @@ class ReservaViewSet(viewsets.ModelViewSet):
         serializer = ReservaSerializer(reserva)
         return Response(serializer.data)
     
-    @action(detail=False, methods=['get'])
-    def dashboard(self, request):
-        """Retorna dados para o dashboard"""
-        user = request.user
-        hoje = datetime.now().date()
+    @action(detail=False, methods=['get'], pagination_class=BuscaPagination)
+    def busca(self, request):
+        """
+        Busca textual em título e descrição (?q=), das reservas mais
+        relevantes para as menos, com os mesmos filtros da listagem.
+        Paginada por número de página (?page=N).
+        """
+        texto = request.query_params.get('q', '').strip()
+        if not texto:
+            return Response({'error': 'Informe o texto da busca no parâmetro q'},
+                          status=status.HTTP_400_BAD_REQUEST)
+        reservas = self.filtrar(Reserva.objects.all()).buscar(texto).para_listagem()
+        pagina = self.paginate_queryset(reservas)
+        return self.get_paginated_response(ReservaBuscaSerializer(pagina, many=True).data)
+    
+    def _exportacao(self, *campos):
+        """Reservas filtradas, em ordem cronológica, lidas do banco em lotes (cursor no servidor)"""
+        return self.filtrar(Reserva.objects.all()).order_by('data_inicio', 'id').values_list(
+            *campos
+        ).iterator(chunk_size=settings.EXPORTACAO_CHUNK_SIZE)
+    
+    @action(detail=False, methods=['get'], url_path='exportar/csv')
+    def exportar_csv(self, request):
+        """Exporta as reservas filtradas em CSV, gerado aos poucos enquanto é enviado"""
+        linhas = self._exportacao(
+            'id', 'sala__nome', 'titulo', 'descricao', 'data_inicio', 'data_fim',
+            'status', 'participantes', 'usuario__username', 'criado_em',
+        )
+        escritor = csv.writer(_Eco())
+        fuso = timezone.get_current_timezone()
         
-        # Estatísticas
-        minhas_reservas_hoje = Reserva.objects.filter(
-            usuario=user,
-            data_inicio__date=hoje,
-            status__in=['agendada', 'em_andamento']
-        ).count()
+        def gerar():
+            yield '\ufeff'  # BOM: o Excel reconhece o arquivo como UTF-8
+            yield escritor.writerow([
+                'id', 'sala', 'titulo', 'descricao', 'data_inicio', 'data_fim',
+                'status', 'participantes', 'usuario', 'criado_em',
+            ])
+            for (reserva_id, sala, titulo, descricao, data_inicio, data_fim,
+                 status_reserva, participantes, usuario, criado_em) in linhas:
+                yield escritor.writerow([
+                    reserva_id, sala, titulo, descricao,
+                    data_inicio.astimezone(fuso).isoformat(),
+                    data_fim.astimezone(fuso).isoformat(),
+                    status_reserva, participantes, usuario,
+                    criado_em.astimezone(fuso).isoformat(),
+                ])
         
-        total_salas = Sala.objects.filter(ativa=True).count()
+        resposta = StreamingHttpResponse(_em_blocos(gerar()), content_type='text/csv; charset=utf-8')
+        resposta['Content-Disposition'] = 'attachment; filename="reservas.csv"'
+        return resposta
+    
+    @action(detail=False, methods=['get'], url_path='exportar/ics')
+    def exportar_ics(self, request):
+        """Exporta as reservas filtradas em iCalendar (.ics), gerado aos poucos enquanto é enviado"""
+        linhas = self._exportacao(
+            'id', 'titulo', 'descricao', 'data_inicio', 'data_fim',
+            'status', 'atualizado_em', 'sala__nome',
+        )
         
-        salas_ocupadas_agora = Reserva.objects.filter(
-            data_inicio__lte=datetime.now(),
-            data_fim__gte=datetime.now(),
-            status='em_andamento'
-        ).count()
+        def gerar():
+            yield icalendar.cabecalho('Reservas')
+            for reserva_id, titulo, descricao, data_inicio, data_fim, status_reserva, atualizado_em, sala in linhas:
+                yield icalendar.evento(
+                    reserva_id, titulo, descricao, data_inicio, data_fim,
+                    status_reserva, atualizado_em, local=sala,
+                )
+            yield icalendar.rodape()
         
-        proximas_reservas = Reserva.objects.filter(
-            usuario=user,
-            data_inicio__gte=datetime.now(),
-            status='agendada'
-        ).order_by('data_inicio')[:5]
+        resposta = StreamingHttpResponse(_em_blocos(gerar()), content_type='text/calendar; charset=utf-8')
+        resposta['Content-Disposition'] = 'attachment; filename="reservas.ics"'
+        return resposta
+    
+    @action(detail=False, methods=['post'], permission_classes=[permissions.IsAuthenticated])
+    def lote(self, request):
+        """
+        Cria várias reservas da mesma sala de uma vez, a partir de uma lista de
+        `ocorrencias` ou de uma `recorrencia` (diaria/semanal). Com conflitos,
+        responde 409 listando cada ocorrência conflitante, a menos que
+        `ignorar_conflitos` seja verdadeiro (aí só as livres são criadas).
+        """
+        serializer = ReservaLoteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        dados = serializer.validated_data
+        sala, ocorrencias = dados['sala'], dados['ocorrencias']
+        
+        with reserva_atomica(sala):
+            conflitos = _conflitos_do_lote(sala, ocorrencias)
+            relatorio = [
+                {
+                    'indice': indice,
+                    'data_inicio': timezone.localtime(ocorrencias[indice]['data_inicio']),
+                    'data_fim': timezone.localtime(ocorrencias[indice]['data_fim']),
+                    'conflitos': conflitos[indice],
+                }
+                for indice in sorted(conflitos)
+            ]
+            if relatorio and not dados['ignorar_conflitos']:
+                return Response({
+                    'error': 'Conflito de horário em uma ou mais ocorrências',
+                    'conflitos': relatorio,
+                }, status=status.HTTP_409_CONFLICT)
+            
+            reservas = Reserva.objects.bulk_create([
+                Reserva(
+                    sala=sala, usuario=request.user, titulo=dados['titulo'],
+                    descricao=dados['descricao'], participantes=dados['participantes'],
+                    data_inicio=ocorrencia['data_inicio'], data_fim=ocorrencia['data_fim'],
+                )
+                for indice, ocorrencia in enumerate(ocorrencias) if indice not in conflitos
+            ])
+            signals.reservas_criadas(reservas)
         
         return Response({
-            'minhas_reservas_hoje': minhas_reservas_hoje,
-            'total_salas': total_salas,
-            'salas_ocupadas_agora': salas_ocupadas_agora,
-            'salas_disponiveis_agora': total_salas - salas_ocupadas_agora,
-            'proximas_reservas': ReservaSerializer(proximas_reservas, many=True).data
-        })
+            'reservas': ReservaSerializer(reservas, many=True).data,
+            'conflitos': relatorio,
+        }, status=status.HTTP_201_CREATED)
+    
+    @action(detail=False, methods=['get'])
+    def dashboard(self, request):
+        """Retorna dados para o dashboard"""
+        with medir_consultas() as medicao:
+            # Contadores globais: uma consulta, compartilhada por todos por alguns segundos
+            globais = cache.get_or_set(
+                'dashboard:globais', _contadores_globais_dashboard, settings.DASHBOARD_CACHE_TTL
+            )
+            
+            minhas_reservas_hoje, proximas_reservas = 0, []
+            user = request.user
+            if user.is_authenticated:
+                agora = timezone.now()
+                inicio_hoje = timezone.make_aware(datetime.combine(timezone.localdate(), time.min))
+                
+                # Intervalo explícito em vez de __date para usar o índice
+                minhas_reservas_hoje = Reserva.objects.filter(
+                    usuario=user,
+                    data_inicio__gte=inicio_hoje,
+                    data_inicio__lt=inicio_hoje + timedelta(days=1),
+                    status__in=['agendada', 'em_andamento']
+                ).count()
+                
+                proximas_reservas = Reserva.objects.filter(
+                    usuario=user,
+                    data_inicio__gte=agora,
+                    status='agendada'
+                ).order_by('data_inicio').para_listagem()[:5]
+            
+            dados = {
+                'minhas_reservas_hoje': minhas_reservas_hoje,
+                'total_salas': globais['total_salas'],
+                'salas_ocupadas_agora': globais['salas_ocupadas_agora'],
+                'salas_disponiveis_agora': globais['total_salas'] - globais['salas_ocupadas_agora'],
+                'proximas_reservas': ReservaSerializer(proximas_reservas, many=True).data
+            }
+        
+        resposta = Response(dados)
+        if settings.DEBUG:
+            resposta['Server-Timing'] = medicao.server_timing()
+        return resposta
 
 class UsuarioViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = User.objects.all()
     serializer_class = UsuarioSerializer
+    pagination_class = UsuarioPagination
     permission_classes = [permissions.IsAuthenticated]
@@ -3,14 +3,115 @@ ASGI config for backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Only the real-time endpoints run on Django's ASGI handler: the Server-Sent
+Events stream at /api/eventos/ and the chat WebSocket at /ws/chat/
+(chat.tempo_real). Every other HTTP request goes to the WSGI application,
+run in a pool of WSGI_THREADS threads (see WsgiEmThreads): Django 4.2's
+ASGI handler reads synchronous streaming responses (the CSV/.ics exports)
+into memory before sending them, and runs every sync view in a single
+thread. The lifespan protocol's shutdown cancels the per-loop background
+tasks. Run it with uvicorn workers (see Procfile).
+
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 """
 
 import os
+from concurrent.futures import ThreadPoolExecutor
 
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
 from django.core.asgi import get_asgi_application
+from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402
+
+from agendamento.checks import avisar_estado_compartilhado  # noqa: E402
+
+# Caches em memória e broker local com vários workers: avisa no log
+avisar_estado_compartilhado()
+
+from agendamento import eventos  # noqa: E402  (precisa do Django configurado)
+from chat import tempo_real  # noqa: E402
+from chat.tempo_real import conexao_chat  # noqa: E402
+
+
+def _fechando(wsgi_application):
+    """Chama close() da resposta ao fim, como um servidor WSGI (request_finished, conexões do banco)"""
+    def aplicacao(environ, start_response):
+        resposta = wsgi_application(environ, start_response)
+        try:
+            yield from resposta
+        finally:
+            if hasattr(resposta, 'close'):
+                resposta.close()
+    return aplicacao
+
+
+class _InstanciaWsgi(WsgiToAsgiInstance):
+    # Corpo síncrono do run_wsgi_app original, que roda todas as requisições
+    # na mesma thread (sync_to_async com thread_sensitive)
+    _rodar = WsgiToAsgiInstance.__dict__['run_wsgi_app'].func
+
+    def __init__(self, wsgi_application, executor):
+        super().__init__(wsgi_application)
+        self.executor = executor
+
+    async def run_wsgi_app(self, body):
+        await sync_to_async(self._rodar, thread_sensitive=False, executor=self.executor)(body)
+
+
+class WsgiEmThreads(WsgiToAsgi):
+    """
+    Aplicação WSGI servida por ASGI em um pool de threads próprio, como os
+    workers com threads do gunicorn. Cada pedaço de uma resposta em stream
+    é enviado assim que gerado.
+    """
+
+    def __init__(self, wsgi_application, threads):
+        super().__init__(_fechando(wsgi_application))
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='wsgi')
+
+    async def __call__(self, scope, receive, send):
+        await _InstanciaWsgi(self.wsgi_application, self.executor)(scope, receive, send)
+
+
+wsgi_application = WsgiEmThreads(get_wsgi_application(), settings.WSGI_THREADS)
+
+ROTAS_WEBSOCKET = {
+    '/ws/chat/': conexao_chat,
+}
+# Views assíncronas, que precisam do handler ASGI do Django
+ROTAS_ASGI = ('/api/eventos/',)
+
+
+async def lifespan(scope, receive, send):
+    """Início e desligamento do worker: no desligamento, encerra as tarefas de fundo do loop"""
+    while True:
+        evento = await receive()
+        if evento['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif evento['type'] == 'lifespan.shutdown':
+            await tempo_real.encerrar()
+            await eventos.encerrar()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(scope, receive, send)
+    if scope['type'] == 'websocket':
+        rota = ROTAS_WEBSOCKET.get(scope['path'])
+        if rota is None:
+            await receive()  # websocket.connect
+            await send({'type': 'websocket.close', 'code': 4404})
+            return
+        return await rota(scope, receive, send)
+    if scope['path'].startswith(ROTAS_ASGI):
+        return await django_application(scope, receive, send)
+    return await wsgi_application(scope, receive, send)
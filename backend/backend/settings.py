@@ -26,6 +26,7 @@ INSTALLED_APPS = [
     'rest_framework_simplejwt',
     'corsheaders',
     'agendamento',
+    'chat',
 ]
 
 MIDDLEWARE = [
@@ -59,6 +60,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'backend.wsgi.application'
+ASGI_APPLICATION = 'backend.asgi.application'
 
 # Database
 # Usa PostgreSQL (Neon) em produção, SQLite em desenvolvimento
@@ -75,6 +77,11 @@ if DATABASE_URL:
         'sslmode': 'require',
     }
     DATABASES['default']['CONN_MAX_AGE'] = 600
+    # Cursores no servidor (exportações) não funcionam atrás do pooler em modo
+    # transação (host "-pooler" do Neon/PgBouncer): defina como True nesse caso
+    DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = config(
+        'DATABASE_DISABLE_SERVER_SIDE_CURSORS', default=False, cast=bool
+    )
 else:
     # Desenvolvimento com SQLite
     DATABASES = {
@@ -84,6 +91,46 @@ else:
         }
     }
 
+# Testes: esquema criado direto dos models, como no comando benchmark. As
+# migrações 0002/0003 criam colunas que os models não têm mais (ex.:
+# agendamento_sala.descricao NOT NULL), o que impede gravar salas em um
+# banco migrado do zero
+DATABASES['default']['TEST'] = {'MIGRATE': False}
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # Em arquivo, como o db.sqlite3 do desenvolvimento: cada thread dos testes
+    # de concorrência abre a própria conexão, com as travas de arquivo do SQLite
+    # (o banco em memória compartilhado trava por tabela)
+    DATABASES['default']['TEST']['NAME'] = BASE_DIR / 'test_db.sqlite3'
+
+# Cache
+# CACHE_BACKEND: 'locmem' (memória do processo, padrão), 'file' (diretório
+# compartilhado entre workers) ou 'redis' (requer o pacote redis)
+CACHE_BACKEND = config('CACHE_BACKEND', default='locmem')
+CACHE_BACKENDS = {
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'salafacil'),
+    'file': ('django.core.cache.backends.filebased.FileBasedCache', '/tmp/salafacil-cache'),
+    'redis': ('django.core.cache.backends.redis.RedisCache', 'redis://127.0.0.1:6379/0'),
+}
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND][0],
+        'LOCATION': config('CACHE_LOCATION', default=CACHE_BACKENDS[CACHE_BACKEND][1]),
+    }
+}
+
+# Workers do servidor (o gunicorn lê a mesma variável). Com mais de um, os
+# caches de agenda, disponibilidade e calendário e o push de eventos precisam
+# de estado compartilhado: agendamento.checks avisa sobre locmem e o broker local
+WEB_CONCURRENCY = config('WEB_CONCURRENCY', default=1, cast=int)
+# Threads por worker para as requisições síncronas (API REST, exportações);
+# cada uma pode manter uma conexão com o banco
+WSGI_THREADS = config('WSGI_THREADS', default=8, cast=int)
+
+# Autenticação por username ou email
+AUTHENTICATION_BACKENDS = [
+    'agendamento.backends.EmailOuUsernameBackend',
+]
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -126,7 +173,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # REST Framework configuration
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'agendamento.autenticacao.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -165,6 +212,14 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    'if-none-match',
+    'idempotency-key',
+]
+
+# Headers de resposta legíveis pelo frontend
+CORS_EXPOSE_HEADERS = [
+    'etag',
+    'idempotent-replayed',
 ]
 
 # JWT configuration
@@ -175,3 +230,68 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
     'ROTATE_REFRESH_TOKENS': True,
 }
+
+# Usuário autenticado em cache (versão por usuário no cache compartilhado; 0 desativa)
+AUTENTICACAO_CACHE_TTL = config('AUTENTICACAO_CACHE_TTL', default=60, cast=int)
+AUTENTICACAO_CACHE_MAX = config('AUTENTICACAO_CACHE_MAX', default=1000, cast=int)
+
+# Disponibilidade de salas (mapas de ocupação em cache)
+DISPONIBILIDADE_CACHE_TTL = config('DISPONIBILIDADE_CACHE_TTL', default=300, cast=int)
+DISPONIBILIDADE_MAX_DIAS = config('DISPONIBILIDADE_MAX_DIAS', default=31, cast=int)
+
+# Cache das respostas de agenda das salas
+AGENDA_CACHE_TTL = config('AGENDA_CACHE_TTL', default=300, cast=int)
+
+# Reservas em lote/recorrentes (POST /api/reservas/lote/)
+RESERVA_LOTE_MAX_OCORRENCIAS = config('RESERVA_LOTE_MAX_OCORRENCIAS', default=200, cast=int)
+
+# Respostas guardadas por Idempotency-Key (removidas por limpar_expirados)
+IDEMPOTENCIA_TTL_HORAS = config('IDEMPOTENCIA_TTL_HORAS', default=24, cast=int)
+# Prazo da requisição original com a chave: depois dele (worker encerrado no
+# meio da ação) uma repetição assume a chave. Maior que o timeout do gunicorn
+IDEMPOTENCIA_PENDENTE_SEGUNDOS = config('IDEMPOTENCIA_PENDENTE_SEGUNDOS', default=60, cast=int)
+
+# Sincronização incremental (/api/sync/): alterações por resposta, espera
+# antes de entregar uma alteração e retenção do log (limpar_expirados).
+# SYNC_ATRASO_SEGUNDOS deve ser maior que a transação mais longa que grava
+# reservas ou salas; uma alteração com commit mais tardio pode não chegar aos
+# clientes até a próxima carga completa (ver agendamento/sincronizacao.py)
+SYNC_LIMITE = config('SYNC_LIMITE', default=500, cast=int)
+SYNC_ATRASO_SEGUNDOS = config('SYNC_ATRASO_SEGUNDOS', default=2, cast=int)
+SYNC_RETENCAO_DIAS = config('SYNC_RETENCAO_DIAS', default=30, cast=int)
+
+# Push de alterações (/api/eventos/, requer ASGI). EVENTOS_BROKER: 'local'
+# (um único worker) ou 'redis' (vários workers/processos; requer o pacote redis)
+EVENTOS_BROKERS = {
+    'local': 'agendamento.eventos.BrokerLocal',
+    'redis': 'agendamento.eventos.BrokerRedis',
+}
+EVENTOS_BROKER = EVENTOS_BROKERS[config('EVENTOS_BROKER', default='local')]
+EVENTOS_REDIS_URL = config('EVENTOS_REDIS_URL', default='redis://127.0.0.1:6379/0')
+# Eventos pendentes por conexão (acima disso o cliente recebe 'ressincronizar'),
+# intervalo do heartbeat, duração máxima da conexão e espera para reconectar
+EVENTOS_TAMANHO_FILA = config('EVENTOS_TAMANHO_FILA', default=100, cast=int)
+EVENTOS_HEARTBEAT = config('EVENTOS_HEARTBEAT', default=15, cast=int)
+EVENTOS_DURACAO_MAXIMA = config('EVENTOS_DURACAO_MAXIMA', default=300, cast=int)
+EVENTOS_RECONEXAO_MS = config('EVENTOS_RECONEXAO_MS', default=3000, cast=int)
+
+# Feeds .ics por sala: janela de datas e tempo em cache (servidor e cliente)
+CALENDARIO_DIAS_PASSADOS = config('CALENDARIO_DIAS_PASSADOS', default=30, cast=int)
+CALENDARIO_DIAS_FUTUROS = config('CALENDARIO_DIAS_FUTUROS', default=365, cast=int)
+CALENDARIO_CACHE_TTL = config('CALENDARIO_CACHE_TTL', default=3600, cast=int)
+CALENDARIO_MAX_AGE = config('CALENDARIO_MAX_AGE', default=300, cast=int)
+
+# Histórico do chat: caracteres de cada mensagem entregues na listagem
+# (o restante vem do detalhe da mensagem)
+CHAT_TAMANHO_PREVIA = config('CHAT_TAMANHO_PREVIA', default=500, cast=int)
+
+# WebSocket do chat (/ws/chat/): validade da presença de um usuário sem
+# notícias do worker dele e do aviso de "digitando"
+CHAT_PRESENCA_TTL = config('CHAT_PRESENCA_TTL', default=60, cast=int)
+CHAT_DIGITANDO_TTL = config('CHAT_DIGITANDO_TTL', default=6, cast=int)
+
+# Exportações CSV/ICS: linhas lidas do banco por vez
+EXPORTACAO_CHUNK_SIZE = config('EXPORTACAO_CHUNK_SIZE', default=2000, cast=int)
+
+# Contadores globais do dashboard (compartilhados entre usuários)
+DASHBOARD_CACHE_TTL = config('DASHBOARD_CACHE_TTL', default=5, cast=int)
@@ -0,0 +1,16 @@
+from django.contrib import admin
+from .models import Conversation, Message
+
+@admin.register(Conversation)
+class ConversationAdmin(admin.ModelAdmin):
+    list_display = ['__str__', 'is_group', 'created_at', 'updated_at']
+    list_filter = ['is_group']
+    search_fields = ['name']
+    filter_horizontal = ['participants']
+
+@admin.register(Message)
+class MessageAdmin(admin.ModelAdmin):
+    list_display = ['conversation', 'sender', 'message_type', 'timestamp']
+    list_filter = ['message_type']
+    search_fields = ['content', 'sender__username']
+    raw_id_fields = ['conversation', 'sender']
@@ -0,0 +1,385 @@
+"""
+Cenários de benchmark do chat, executados por `python manage.py benchmark
+<cenario>` junto com os de agendamento.benchmarks.
+"""
+import random
+import time as relogio
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from agendamento.benchmarks import cenario, criar_salas, medir, resumo
+from agendamento.models import Reserva
+
+
+@cenario('caixa_de_entrada')
+def caixa_de_entrada(stdout, conversas=500, mensagens=200, repeticoes=50):
+    """
+    Caixa de entrada do chat com `conversas` conversas de `mensagens`
+    mensagens cada (metade lida): última mensagem e não lidas por conversa,
+    consultas por conversa contra a listagem anotada (uma consulta).
+    """
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from rest_framework.test import APIRequestFactory, force_authenticate
+
+    from chat.models import Conversation, ConversationRead, Message
+    from chat.views import ConversationViewSet
+
+    usuario = User.objects.create_user('benchmark')
+    outro = User.objects.create_user('outro')
+    Conversation.objects.bulk_create(Conversation(name=f'Conversa {i}') for i in range(conversas))
+    lista = list(Conversation.objects.all())
+    Participantes = Conversation.participants.through
+    Participantes.objects.bulk_create(
+        Participantes(conversation=conversa, user=membro) for conversa in lista for membro in (usuario, outro)
+    )
+    inicio = timezone.now() - timedelta(days=30)
+    for conversa in lista:
+        Message.objects.bulk_create(
+            Message(conversation=conversa, sender=outro if j % 2 else usuario, content=f'Mensagem {j} ' * 20,
+                    timestamp=inicio + timedelta(minutes=random.randint(0, 43200)))
+            for j in range(mensagens)
+        )
+    for conversa in lista:
+        ConversationRead.objects.marcar_lida(
+            conversa, usuario, conversa.messages.filter(timestamp__lt=inicio + timedelta(days=15)).first()
+        )
+    fabrica = APIRequestFactory()
+    view = ConversationViewSet.as_view({'get': 'list'})
+
+    def ingenua():
+        itens = []
+        for conversa in Conversation.objects.filter(participants=usuario).order_by('-updated_at', '-id')[:20]:
+            ultima = conversa.messages.order_by('-timestamp').first()
+            leitura = conversa.leituras.filter(user=usuario).first()
+            nao_lidas = conversa.messages.exclude(sender=usuario).filter(timestamp__gt=leitura.last_read_at).count()
+            itens.append((conversa.pk, ultima.pk, nao_lidas))
+        return itens
+
+    def anotada():
+        requisicao = fabrica.get('/api/chat/conversas/', SERVER_NAME='localhost')
+        force_authenticate(requisicao, usuario)
+        resposta = view(requisicao)
+        assert resposta.status_code == 200
+        return resposta.data
+
+    with CaptureQueriesContext(connection) as consultas:
+        ingenua()
+    stdout.write(f'uma consulta por conversa ({len(consultas)} consultas): {resumo(medir(ingenua, repeticoes))}')
+    anotada()  # A primeira chamada também testa o suporte a JSON do SQLite
+    with CaptureQueriesContext(connection) as consultas:
+        anotada()
+    stdout.write(f'/api/chat/conversas/ ({len(consultas)} consultas): {resumo(medir(anotada, repeticoes))}')
+
+
+@cenario('leitura')
+def leitura(stdout, membros=50, mensagens=10000, novas=100, repeticoes=50):
+    """
+    Grupo de `membros` com `mensagens` mensagens: cada membro marca tudo
+    como lido; depois chegam `novas` mensagens e medimos a contagem de não
+    lidas e marcar como lido de novo.
+    """
+    from rest_framework.test import APIRequestFactory, force_authenticate
+
+    from chat.models import Conversation, ConversationRead, Message
+    from chat.views import ConversationViewSet
+
+    User.objects.bulk_create(User(username=f'membro{i}') for i in range(membros))
+    usuarios = list(User.objects.all())
+    conversa = Conversation.objects.create(name='Grupo', is_group=True)
+    conversa.participants.add(*usuarios)
+    inicio = timezone.now() - timedelta(days=30)
+    Message.objects.bulk_create(
+        (Message(conversation=conversa, sender=random.choice(usuarios), content='Olá ' * 20,
+                 timestamp=inicio + timedelta(seconds=i * 60)) for i in range(mensagens)),
+        batch_size=5000,
+    )
+    fabrica = APIRequestFactory()
+    ler = ConversationViewSet.as_view({'post': 'ler'})
+    listar = ConversationViewSet.as_view({'get': 'list'})
+
+    def marcar(usuario):
+        requisicao = fabrica.post(f'/api/chat/conversas/{conversa.pk}/ler/')
+        force_authenticate(requisicao, usuario)
+        assert ler(requisicao, pk=conversa.pk).status_code == 204
+
+    amostras = []
+    for usuario in usuarios:
+        amostras += medir(lambda: marcar(usuario), 1)
+    stdout.write(f'marcar tudo como lido ({membros} membros): {resumo(amostras)}; '
+                 f'{ConversationRead.objects.count()} linhas de leitura')
+
+    agora = timezone.now()
+    Message.objects.bulk_create(
+        Message(conversation=conversa, sender=usuarios[1], content='Nova', timestamp=agora + timedelta(seconds=i))
+        for i in range(novas)
+    )
+    leitor = usuarios[0]
+
+    def contar():
+        requisicao = fabrica.get('/api/chat/conversas/', SERVER_NAME='localhost')
+        force_authenticate(requisicao, leitor)
+        nao_lidas = listar(requisicao).data['results'][0]['nao_lidas']
+        assert nao_lidas == novas, nao_lidas
+    stdout.write(f'caixa de entrada com {novas} não lidas: {resumo(medir(contar, repeticoes))}')
+    stdout.write(f'marcar como lido depois de {novas} novas: '
+                 f'{resumo([amostra for usuario in usuarios[2:] for amostra in medir(lambda: marcar(usuario), 1)])}')
+
+
+@cenario('historico')
+def historico(stdout, mensagens=150000, longas=10, repeticoes=20):
+    """
+    Histórico de uma conversa com `mensagens` mensagens (`longas`% com 8 KB):
+    página na profundidade N por cursor, por ?page=N (offset) e por âncora.
+    """
+    from rest_framework.test import APIRequestFactory, force_authenticate
+
+    from chat.models import Conversation, Message
+    from chat.paginacao import MessagePagination
+    from chat.views import ConversationViewSet
+
+    usuario = User.objects.create_user('benchmark')
+    outro = User.objects.create_user('outro')
+    conversa = Conversation.objects.create(name='Movimentada')
+    conversa.participants.add(usuario, outro)
+    inicio = timezone.now() - timedelta(days=365)
+    for lote in range(0, mensagens, 10000):
+        Message.objects.bulk_create(
+            Message(conversation=conversa, sender=outro if n % 3 else usuario,
+                    content='Texto longo ' * 700 if n % 100 < longas else f'Mensagem {n}',
+                    timestamp=inicio + timedelta(seconds=n * 60))
+            for n in range(lote, min(lote + 10000, mensagens))
+        )
+    stdout.write(f'{mensagens} mensagens')
+
+    fabrica = APIRequestFactory()
+    view = ConversationViewSet.as_view({'get': 'mensagens'})
+    tamanho = MessagePagination.page_size
+    ordenadas = Message.objects.filter(conversation=conversa).order_by(*MessagePagination.ordering)
+
+    def pagina(parametros):
+        requisicao = fabrica.get(f'/api/chat/conversas/{conversa.pk}/mensagens/', parametros, SERVER_NAME='localhost')
+        force_authenticate(requisicao, usuario)
+        resposta = view(requisicao, pk=conversa.pk)
+        assert resposta.status_code == 200 and len(resposta.data['results']) == tamanho
+        return resposta
+
+    for profundidade in (0, 1000, 10000, 100000):
+        if profundidade >= mensagens - tamanho:
+            continue
+        ultima_vista = ordenadas[profundidade - 1] if profundidade else None
+        cursor = {'cursor': MessagePagination()._codificar(ultima_vista, 'n')} if ultima_vista else {}
+        ancora = ordenadas[profundidade + tamanho // 2]
+        numero = profundidade // tamanho + 1
+        stdout.write(
+            f'profundidade {profundidade:>6}: cursor {resumo(medir(lambda: pagina(cursor), repeticoes))} | '
+            f'âncora {resumo(medir(lambda: pagina({"ancora": ancora.pk}), repeticoes))} | '
+            f'offset {resumo(medir(lambda: pagina({"page": numero}), repeticoes))}'
+        )
+
+
+@cenario('chat_tempo_real')
+def chat_tempo_real(stdout, conexoes=2000, grupo=10, mensagens=200, digitacoes=200):
+    """
+    `conexoes` WebSockets do chat no mesmo processo (backend.asgi, sem
+    servidor: cada socket é um par de filas), em conversas de `grupo`
+    participantes: tempo de conexão, memória por conexão e latência do envio
+    de uma mensagem (ou aviso de digitação) até o último membro recebê-la.
+    """
+    import asyncio
+    import json
+    import threading
+    import tracemalloc
+
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    from backend.asgi import application
+    from chat.models import Conversation
+
+    from agendamento import eventos
+
+    User.objects.bulk_create(User(username=f'membro{i}') for i in range(conexoes))
+    usuarios = list(User.objects.order_by('pk'))
+    Conversation.objects.bulk_create(Conversation(name=f'Grupo {i}', is_group=True) for i in range(0, conexoes, grupo))
+    lista = list(Conversation.objects.order_by('pk'))
+    Participantes = Conversation.participants.through
+    Participantes.objects.bulk_create(
+        Participantes(conversation=lista[i // grupo], user=usuario) for i, usuario in enumerate(usuarios)
+    )
+    tokens = [str(AccessToken.for_user(usuario)) for usuario in usuarios]
+
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+    entradas = []
+    recebidos = []
+    aceitas = []
+    completo = threading.Event()
+    estado = {'prefixo': None, 'esperado': 0}
+
+    async def cliente(token):
+        entrada = asyncio.Queue()
+        entradas.append(entrada)
+        entrada.put_nowait({'type': 'websocket.connect'})
+
+        async def send(evento):
+            if evento['type'] == 'websocket.accept':
+                aceitas.append(None)
+                if len(aceitas) == conexoes:
+                    completo.set()
+            elif evento['type'] == 'websocket.send' and estado['prefixo'] and evento['text'].startswith(estado['prefixo']):
+                recebidos.append(relogio.perf_counter())
+                if len(recebidos) == estado['esperado']:
+                    completo.set()
+
+        scope = {'type': 'websocket', 'path': '/ws/chat/', 'query_string': f'token={token}'.encode()}
+        await application(scope, entrada.get, send)
+
+    async def abrir():
+        return [asyncio.ensure_future(cliente(token)) for token in tokens]
+
+    async def fechar(tarefas):
+        for entrada in entradas:
+            entrada.put_nowait({'type': 'websocket.disconnect', 'code': 1000})
+        await asyncio.gather(*tarefas, return_exceptions=True)
+
+    tracemalloc.start()
+    antes = tracemalloc.get_traced_memory()[0]
+    comeco = relogio.perf_counter()
+    tarefas = asyncio.run_coroutine_threadsafe(abrir(), loop).result()
+    completo.wait(600)
+    while eventos.hub.total() < conexoes:
+        relogio.sleep(0.01)
+    abertura = relogio.perf_counter() - comeco
+    memoria = tracemalloc.get_traced_memory()[0] - antes
+    tracemalloc.stop()
+    stdout.write(
+        f'{len(aceitas)} WebSockets abertos em {abertura:.2f}s com tracemalloc ({abertura / conexoes * 1000:.2f}ms cada); '
+        f'memória Python por conexão (inclui autenticação): {memoria / conexoes / 1024:.1f} KiB'
+    )
+
+    def rodada(tipo, vezes, quadro):
+        estado['prefixo'] = f'{{"tipo":"{tipo}"'
+        completas, perdidas = [], 0
+        for indice in random.sample(range(conexoes), min(vezes, conexoes)):
+            # Todos os membros recebem, inclusive quem enviou
+            estado['esperado'] = min(grupo, conexoes - indice // grupo * grupo)
+            recebidos.clear()
+            completo.clear()
+            conversa = lista[indice // grupo].pk
+            inicio = relogio.perf_counter()
+            loop.call_soon_threadsafe(entradas[indice].put_nowait, {
+                'type': 'websocket.receive', 'text': json.dumps(quadro(conversa)),
+            })
+            completo.wait(5)
+            perdidas += estado['esperado'] - len(recebidos)
+            if recebidos:
+                completas.append((max(recebidos) - inicio) * 1000)
+        return completas, perdidas
+
+    try:
+        completas, perdidas = rodada('mensagem', mensagens, lambda conversa: {
+            'tipo': 'mensagem', 'conversa': conversa, 'conteudo': 'Olá, pessoal', 'ref': 'b',
+        })
+        stdout.write(f'{mensagens} mensagens (grava + commit + entrega); não recebidas: {perdidas}')
+        stdout.write(f'envio -> último membro do grupo: {resumo(completas)}')
+        completas, perdidas = rodada('digitando', digitacoes, lambda conversa: {
+            'tipo': 'digitando', 'conversa': conversa,
+        })
+        stdout.write(f'{digitacoes} avisos de digitação; não recebidos: {perdidas}')
+        stdout.write(f'digitando -> último membro do grupo: {resumo(completas)}')
+    finally:
+        asyncio.run_coroutine_threadsafe(fechar(tarefas), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+
+
+@cenario('busca')
+def busca_textual(stdout, reservas=200000, mensagens=200000, conversas=2000, repeticoes=20):
+    """
+    Busca textual em `reservas` reservas e `mensagens` mensagens (o usuário
+    participa de 1 em cada 10 conversas): icontains contra o índice textual
+    (agendamento.busca), para um termo raro e um comum, pelos endpoints.
+    """
+    from django.db.models import Q
+    from rest_framework.test import APIRequestFactory, force_authenticate
+
+    from chat.models import Conversation, Message
+    from chat.views import MessageViewSet
+
+    from agendamento.views import ReservaViewSet
+
+    palavras = ['reunião', 'planejamento', 'orçamento', 'cliente', 'treinamento', 'revisão', 'projeto',
+                'entrevista', 'alinhamento', 'diretoria', 'equipe', 'semanal', 'mensal', 'apresentação']
+    raro = 'auditoria'
+
+    def frase(n, tamanho):
+        texto = ' '.join(random.choice(palavras) for _ in range(tamanho))
+        return f'{texto} {raro}' if n % 1000 == 0 else texto
+
+    usuario = User.objects.create_user('benchmark')
+    outro = User.objects.create_user('outro')
+    salas = criar_salas(50)
+    inicio = timezone.now() - timedelta(days=365)
+    for lote in range(0, reservas, 10000):
+        Reserva.objects.bulk_create(
+            Reserva(sala=salas[n % len(salas)], usuario=usuario, titulo=frase(n, 3)[:200], descricao=frase(n + 1, 12),
+                    data_inicio=inicio + timedelta(minutes=n), data_fim=inicio + timedelta(minutes=n + 30))
+            for n in range(lote, min(lote + 10000, reservas))
+        )
+    Conversation.objects.bulk_create(Conversation(name=f'Conversa {i}') for i in range(conversas))
+    lista = list(Conversation.objects.all())
+    Participantes = Conversation.participants.through
+    Participantes.objects.bulk_create(
+        Participantes(conversation=conversa, user=membro)
+        for i, conversa in enumerate(lista) for membro in ((usuario, outro) if i % 10 == 0 else (outro,))
+    )
+    for lote in range(0, mensagens, 10000):
+        Message.objects.bulk_create(
+            Message(conversation=lista[n % conversas], sender=outro, content=frase(n, 15),
+                    timestamp=inicio + timedelta(minutes=n))
+            for n in range(lote, min(lote + 10000, mensagens))
+        )
+    stdout.write(f'{reservas} reservas, {mensagens} mensagens em {conversas} conversas')
+
+    fabrica = APIRequestFactory()
+    views = {
+        'reservas': (ReservaViewSet.as_view({'get': 'busca'}, **ReservaViewSet.busca.kwargs), '/api/reservas/busca/'),
+        'mensagens': (MessageViewSet.as_view({'get': 'busca'}, **MessageViewSet.busca.kwargs),
+                      '/api/chat/mensagens/busca/'),
+    }
+
+    def endpoint(nome, termo):
+        view, caminho = views[nome]
+        requisicao = fabrica.get(caminho, {'q': termo}, SERVER_NAME='localhost')
+        force_authenticate(requisicao, usuario)
+        resposta = view(requisicao)
+        assert resposta.status_code == 200
+        return resposta.data['count']
+
+    participacoes = Participantes.objects.filter(user=usuario).values('conversation_id')
+    consultas = {
+        'reservas': (
+            lambda termo: Reserva.objects.filter(Q(titulo__icontains=termo) | Q(descricao__icontains=termo))
+            .order_by('-data_inicio'),
+            lambda termo: Reserva.objects.buscar(termo),
+        ),
+        'mensagens': (
+            lambda termo: Message.objects.filter(conversation__in=participacoes, content__icontains=termo)
+            .order_by('-timestamp'),
+            lambda termo: Message.objects.filter(conversation__in=participacoes).buscar(termo),
+        ),
+    }
+
+    def pagina(queryset):
+        return len(queryset[:20]), queryset.count()
+
+    for nome, (ingenua, indexada) in consultas.items():
+        for termo in (raro, 'planejamento'):
+            stdout.write(
+                f'{nome} "{termo}" ({endpoint(nome, termo)} resultados), página 1 + contagem: '
+                f'icontains {resumo(medir(lambda: pagina(ingenua(termo)), repeticoes))} | '
+                f'índice {resumo(medir(lambda: pagina(indexada(termo)), repeticoes))} | '
+                f'endpoint {resumo(medir(lambda: endpoint(nome, termo), repeticoes))}'
+            )
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.23 on 2026-10-18 19:10
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def atualizar_conversas(apps, schema_editor):
+    """updated_at passa a acompanhar a última mensagem (ordem da caixa de entrada)"""
+    Conversation = apps.get_model('chat', 'Conversation')
+    Message = apps.get_model('chat', 'Message')
+    ultima = Message.objects.filter(conversation=OuterRef('pk')).order_by('-timestamp').values('timestamp')[:1]
+    Conversation.objects.annotate(ultima=Subquery(ultima)).filter(
+        ultima__gt=models.F('updated_at')
+    ).update(updated_at=Subquery(ultima))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'timestamp'], name='chat_msg_conversa_data_idx'),
+        ),
+        migrations.RunPython(atualizar_conversas, migrations.RunPython.noop),
+    ]
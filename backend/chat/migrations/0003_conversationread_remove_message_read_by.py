@@ -0,0 +1,64 @@
+# Generated by Django 4.2.23 on 2026-10-18 19:40
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+
+def copiar_leituras(apps, schema_editor):
+    """
+    Cada participante passa a ter lido até a última mensagem que marcou
+    em read_by (mensagens anteriores não marcadas contam como lidas).
+    """
+    Conversation = apps.get_model('chat', 'Conversation')
+    ConversationRead = apps.get_model('chat', 'ConversationRead')
+    Message = apps.get_model('chat', 'Message')
+    Participantes = Conversation.participants.through
+    lidas = Message.read_by.through.objects.filter(
+        user=OuterRef('user'), message__conversation=OuterRef('conversation'),
+    ).order_by('-message__timestamp', '-message_id')
+    pares = Participantes.objects.annotate(
+        ultima_id=Subquery(lidas.values('message_id')[:1]),
+        ultima_data=Subquery(lidas.values('message__timestamp')[:1]),
+    ).filter(ultima_id__isnull=False).values_list('conversation_id', 'user_id', 'ultima_id', 'ultima_data')
+    lote = []
+    for conversation_id, user_id, ultima_id, ultima_data in pares.iterator(chunk_size=2000):
+        lote.append(ConversationRead(
+            conversation_id=conversation_id, user_id=user_id, last_read_id=ultima_id, last_read_at=ultima_data,
+        ))
+        if len(lote) >= 2000:
+            ConversationRead.objects.bulk_create(lote)
+            lote = []
+    ConversationRead.objects.bulk_create(lote)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('chat', '0002_message_chat_msg_conversa_data_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationRead',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_read_at', models.DateTimeField(blank=True, null=True)),
+                ('last_read_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='leituras', to='chat.conversation')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversation_reads', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='conversationread',
+            constraint=models.UniqueConstraint(fields=('conversation', 'user'), name='chat_leitura_conversa_usuario_uniq'),
+        ),
+        migrations.RunPython(copiar_leituras, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='message',
+            name='read_by',
+        ),
+    ]
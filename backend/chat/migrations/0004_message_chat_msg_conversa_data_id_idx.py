@@ -0,0 +1,22 @@
+# Generated by Django 4.2.23 on 2026-10-18 20:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_conversationread_remove_message_read_by'),
+    ]
+
+    operations = [
+        # O índice novo é criado antes de remover o antigo: a conversa nunca fica sem índice
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'timestamp', 'id'], name='chat_msg_conversa_data_id_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='message',
+            name='chat_msg_conversa_data_idx',
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 4.2.23 on 2026-10-18 23:10
+
+from django.db import migrations
+
+# Coluna tsvector + GIN no PostgreSQL, FTS5 no SQLite (ver agendamento.busca).
+# SQL fixo, e não gerado por IndiceTexto: a migração não muda se o módulo mudar
+CRIAR = {
+    'postgresql': [
+        'ALTER TABLE chat_message ADD COLUMN IF NOT EXISTS busca tsvector',
+        """
+        CREATE OR REPLACE FUNCTION chat_message_busca_atualizar() RETURNS trigger AS $$
+        BEGIN
+            -- save() do Django regrava todas as colunas: só recalcula se o texto mudou
+            IF TG_OP = 'UPDATE' AND NEW.content IS NOT DISTINCT FROM OLD.content THEN
+                RETURN NEW;
+            END IF;
+            NEW.busca := setweight(to_tsvector('portuguese', coalesce(NEW.content, '')), 'A');
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        'DROP TRIGGER IF EXISTS chat_message_busca_trg ON chat_message',
+        'CREATE TRIGGER chat_message_busca_trg BEFORE INSERT OR UPDATE OF content ON chat_message FOR EACH ROW EXECUTE FUNCTION chat_message_busca_atualizar()',
+        "UPDATE chat_message SET busca = setweight(to_tsvector('portuguese', coalesce(content, '')), 'A')",
+        'CREATE INDEX IF NOT EXISTS chat_message_busca_idx ON chat_message USING GIN (busca)',
+    ],
+    'sqlite': [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS chat_message_fts USING fts5(content, content='chat_message', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+        'CREATE TRIGGER IF NOT EXISTS chat_message_fts_ai AFTER INSERT ON chat_message BEGIN INSERT INTO chat_message_fts(rowid, content) VALUES (new.id, new.content); END',
+        "CREATE TRIGGER IF NOT EXISTS chat_message_fts_ad AFTER DELETE ON chat_message BEGIN INSERT INTO chat_message_fts(chat_message_fts, rowid, content) VALUES ('delete', old.id, old.content); END",
+        "CREATE TRIGGER IF NOT EXISTS chat_message_fts_au AFTER UPDATE OF content ON chat_message BEGIN INSERT INTO chat_message_fts(chat_message_fts, rowid, content) VALUES ('delete', old.id, old.content); INSERT INTO chat_message_fts(rowid, content) VALUES (new.id, new.content); END",
+        "INSERT INTO chat_message_fts(chat_message_fts) VALUES ('rebuild')",
+    ],
+}
+
+REMOVER = {
+    'postgresql': [
+        'DROP TRIGGER IF EXISTS chat_message_busca_trg ON chat_message',
+        'DROP FUNCTION IF EXISTS chat_message_busca_atualizar()',
+        'DROP INDEX IF EXISTS chat_message_busca_idx',
+        'ALTER TABLE chat_message DROP COLUMN IF EXISTS busca',
+    ],
+    'sqlite': [
+        'DROP TRIGGER IF EXISTS chat_message_fts_ad',
+        'DROP TRIGGER IF EXISTS chat_message_fts_ai',
+        'DROP TRIGGER IF EXISTS chat_message_fts_au',
+        'DROP TABLE IF EXISTS chat_message_fts',
+    ],
+}
+
+
+def criar_indice(apps, schema_editor):
+    for comando in CRIAR.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(comando)
+
+
+def remover_indice(apps, schema_editor):
+    for comando in REMOVER.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(comando)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_message_chat_msg_conversa_data_id_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(criar_indice, remover_indice),
+    ]
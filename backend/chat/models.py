@@ -0,0 +1,287 @@
+from datetime import datetime, timezone as fuso_utc
+
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.db.models import FilteredRelation, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, JSONObject, Length, Substr
+
+from agendamento import busca
+
+# Antes de qualquer mensagem: cursor de quem nunca leu a conversa
+INICIO = datetime(2000, 1, 1, tzinfo=fuso_utc.utc)
+
+
+class ConversationQuerySet(models.QuerySet):
+    def do_usuario(self, usuario):
+        return self.filter(participants=usuario)
+
+    def caixa_de_entrada(self, usuario, tamanho_previa=200):
+        """
+        Conversas de `usuario` anotadas com `ultima_mensagem` (objeto JSON com
+        id, remetente, tipo, data e o início do conteúdo) e `nao_lidas`, as
+        mensagens de outros participantes que ele ainda não leu.
+
+        As duas anotações são subconsultas correlacionadas, na mesma consulta
+        da listagem: para cada conversa a última mensagem é uma busca no
+        índice (conversation, timestamp, id) com LIMIT 1, o plano que um LATERAL
+        JOIN daria no PostgreSQL, e funciona igual no SQLite. As não lidas são
+        uma contagem por faixa no mesmo índice, a partir do cursor de leitura
+        (ConversationRead) do usuário.
+        """
+        ultima = Message.objects.filter(conversation=OuterRef('pk')).order_by('-timestamp', '-id').values(
+            dados=JSONObject(
+                id='id',
+                sender='sender_id',
+                sender_username='sender__username',
+                message_type='message_type',
+                timestamp='timestamp',
+                content=Substr('content', 1, tamanho_previa),
+            )
+        )[:1]
+        # Mensagens de outros depois do cursor de leitura do usuário (sem cursor: todas).
+        # A condição `>=` isolada permite a busca por faixa no índice
+        lido_ate = Coalesce(OuterRef('minha_leitura__last_read_at'), Value(INICIO))
+        nao_lidas = (
+            Message.objects.filter(conversation=OuterRef('pk'), timestamp__gte=lido_ate)
+            .exclude(sender=usuario)
+            .filter(
+                Q(timestamp__gt=lido_ate)
+                | Q(timestamp=OuterRef('minha_leitura__last_read_at'), id__gt=OuterRef('minha_leitura__last_read_id'))
+            )
+            .order_by()
+            .values('conversation')
+            .annotate(total=models.Count('pk'))
+            .values('total')
+        )
+        return self.do_usuario(usuario).annotate(
+            minha_leitura=FilteredRelation('leituras', condition=Q(leituras__user=usuario)),
+            ultima_mensagem=Subquery(ultima, output_field=models.JSONField()),
+            nao_lidas=Coalesce(Subquery(nao_lidas, output_field=models.IntegerField()), 0),
+        )
+
+
+class MessageQuerySet(models.QuerySet):
+    def com_previa(self, tamanho):
+        """
+        Sem a coluna `content`: anota `previa` (os primeiros `tamanho`
+        caracteres) e `tamanho_conteudo`, para listagens de mensagens longas.
+        O conteúdo completo vem do detalhe da mensagem.
+        """
+        return self.defer('content').annotate(
+            previa=Substr('content', 1, tamanho),
+            tamanho_conteudo=Length('content'),
+        )
+
+    def buscar(self, texto):
+        """Mensagens cujo conteúdo casa com `texto`, das mais relevantes para as menos"""
+        return INDICE_BUSCA.buscar(self, texto)
+
+
+class Conversation(models.Model):
+    name = models.CharField(max_length=255, blank=True, null=True)
+    participants = models.ManyToManyField(settings.AUTH_USER_MODEL, related_name='conversations')
+    is_group = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Atualizado a cada mensagem nova (chat.signals): ordena a caixa de entrada
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ConversationQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['-updated_at']
+
+    def __str__(self):
+        return self.name or f'Conversa {self.pk}'
+
+
+class Message(models.Model):
+    MESSAGE_TYPES = [
+        ('text', 'Texto'),
+        ('image', 'Imagem'),
+        ('file', 'Arquivo'),
+        ('system', 'Sistema'),
+    ]
+
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages')
+    sender = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='sent_messages')
+    content = models.TextField()
+    message_type = models.CharField(max_length=10, choices=MESSAGE_TYPES, default='text')
+    file_url = models.URLField(blank=True, null=True)
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    objects = MessageQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['-timestamp']
+        indexes = [
+            # Última mensagem, não lidas e histórico paginado por (timestamp, id)
+            models.Index(fields=['conversation', 'timestamp', 'id'], name='chat_msg_conversa_data_id_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.sender} em {self.conversation}: {self.content[:50]}'
+
+
+# Busca textual (agendamento.busca), criada na migração 0005
+INDICE_BUSCA = busca.registrar(
+    busca.IndiceTexto('chat_message', [('content', 'A')]),
+    ('chat', '0005_message_busca_textual'),
+)
+
+
+class ConversationReadQuerySet(models.QuerySet):
+    def marcar_lida(self, conversation, user, mensagem=None):
+        """
+        Avança o cursor de `user` em `conversation` até `mensagem` (padrão:
+        a última da conversa). Nunca recua. Uma linha por participante,
+        qualquer que seja o número de mensagens lidas.
+        """
+        if mensagem is None:
+            mensagem = conversation.messages.order_by('-timestamp', '-id').only('id', 'timestamp').first()
+            if mensagem is None:
+                return
+        anterior = Q(last_read_at__isnull=True) | Q(last_read_at__lt=mensagem.timestamp) | Q(
+            last_read_at=mensagem.timestamp, last_read_id__lt=mensagem.pk
+        )
+        avancar = dict(last_read_at=mensagem.timestamp, last_read_id=mensagem.pk)
+        if self.filter(anterior, conversation=conversation, user=user).update(**avancar):
+            return
+        if self.filter(conversation=conversation, user=user).exists():
+            return  # Já estava adiante
+        try:
+            with transaction.atomic():
+                self.create(conversation=conversation, user=user, **avancar)
+        except IntegrityError:
+            # Outra requisição criou o cursor agora
+            self.filter(anterior, conversation=conversation, user=user).update(**avancar)
+
+
+class ConversationRead(models.Model):
+    """Até onde cada participante leu a conversa: a última mensagem lida e a data dela"""
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='leituras')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='conversation_reads')
+    last_read_at = models.DateTimeField(null=True, blank=True)
+    last_read_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ConversationReadQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['conversation', 'user'], name='chat_leitura_conversa_usuario_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.user} leu {self.conversation} até {self.last_read_at}'
+
+
+class Notification(models.Model):
+    NOTIFICATION_TYPES = [
+        ('chat', 'Chat'),
+        ('meeting', 'Reunião'),
+        ('reservation', 'Reserva'),
+        ('system', 'Sistema'),
+        ('warning', 'Aviso'),
+        ('error', 'Erro'),
+    ]
+    PRIORITY_CHOICES = [
+        ('low', 'Baixa'),
+        ('medium', 'Média'),
+        ('high', 'Alta'),
+    ]
+
+    recipient = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='notifications')
+    title = models.CharField(max_length=255)
+    message = models.TextField()
+    notification_type = models.CharField(max_length=20, choices=NOTIFICATION_TYPES)
+    priority = models.CharField(max_length=10, choices=PRIORITY_CHOICES, default='medium')
+    data = models.JSONField(default=dict, blank=True)
+    is_read = models.BooleanField(default=False)
+    was_shown = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    read_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f'{self.title} ({self.recipient})'
+
+
+class PushSubscription(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='push_subscriptions')
+    endpoint = models.URLField()
+    p256dh = models.TextField()
+    auth = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    is_active = models.BooleanField(default=True)
+
+    class Meta:
+        unique_together = ['user', 'endpoint']
+
+    def __str__(self):
+        return f'{self.user} - {self.endpoint[:50]}'
+
+
+class NotificationSettings(models.Model):
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='notification_settings')
+    chat_push_enabled = models.BooleanField(default=True)
+    chat_email_enabled = models.BooleanField(default=False)
+    chat_sound_enabled = models.BooleanField(default=True)
+    meeting_reminder_enabled = models.BooleanField(default=True)
+    meeting_reminder_minutes = models.IntegerField(default=15)
+    meeting_email_enabled = models.BooleanField(default=True)
+    meeting_push_enabled = models.BooleanField(default=True)
+    reservation_email_enabled = models.BooleanField(default=True)
+    reservation_push_enabled = models.BooleanField(default=True)
+    daily_digest_enabled = models.BooleanField(default=False)
+    daily_digest_time = models.TimeField(default='08:00')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Configurações de {self.user}'
+
+
+class EmailTemplate(models.Model):
+    TEMPLATE_TYPES = [
+        ('meeting_reminder', 'Lembrete de Reunião'),
+        ('chat_notification', 'Notificação de Chat'),
+        ('reservation_notification', 'Notificação de Reserva'),
+        ('daily_digest', 'Resumo Diário'),
+        ('welcome', 'Bem-vindo'),
+    ]
+
+    name = models.CharField(max_length=100)
+    template_type = models.CharField(max_length=30, choices=TEMPLATE_TYPES)
+    subject = models.CharField(max_length=255)
+    html_content = models.TextField()
+    text_content = models.TextField(blank=True)
+    available_variables = models.JSONField(default=list)
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+
+class EmailLog(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'Pendente'),
+        ('sent', 'Enviado'),
+        ('failed', 'Falhou'),
+        ('bounced', 'Rejeitado'),
+    ]
+
+    recipient = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    template = models.ForeignKey(EmailTemplate, on_delete=models.CASCADE)
+    subject = models.CharField(max_length=255)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    data_used = models.JSONField(default=dict)
+    error_message = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.subject} para {self.recipient} ({self.status})'
@@ -0,0 +1,68 @@
+"""
+Paginação das listagens do chat, sobre a KeysetPagination do agendamento.
+"""
+from rest_framework.exceptions import NotFound
+from rest_framework.utils.urls import remove_query_param
+
+from agendamento.paginacao import KeysetPagination
+
+
+class ConversationPagination(KeysetPagination):
+    ordering = ('-updated_at', '-id')
+
+
+class MessagePagination(KeysetPagination):
+    """
+    Histórico de uma conversa, da mensagem mais nova para a mais antiga,
+    ancorado em (timestamp, id): `next` traz mensagens mais antigas e
+    `previous` mais novas, cada página é uma busca por faixa no índice
+    (conversation, timestamp, id), com o mesmo custo em qualquer
+    profundidade. `?ancora=<id>` abre a página em volta de uma mensagem
+    (pular para a mensagem citada ou encontrada na busca).
+    """
+    ordering = ('-timestamp', '-id')
+    page_size = 50
+    anchor_query_param = 'ancora'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        ancora = request.query_params.get(self.anchor_query_param)
+        if ancora is None:
+            self.ancora = None
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        try:
+            self.ancora = queryset.get(pk=int(ancora))
+        except (ValueError, queryset.model.DoesNotExist):
+            raise NotFound('Mensagem não encontrada.')
+        valores = [self.ancora.timestamp, self.ancora.pk]
+        tamanho = self.get_page_size(request)
+
+        # Metade da página com as mais novas que a âncora, o resto com a âncora e as mais antigas
+        limite_novas = (tamanho - 1) // 2
+        novas = list(
+            queryset.filter(self._filtro_apos(valores, invertido=True))
+            .order_by(*self._ordenacao(invertido=True))[:limite_novas + 1]
+        )
+        self.tem_anterior = len(novas) > limite_novas
+        novas = novas[:limite_novas]
+        novas.reverse()
+        limite_antigas = tamanho - len(novas) - 1
+        antigas = list(
+            queryset.filter(self._filtro_apos(valores, invertido=False))
+            .order_by(*self._ordenacao(invertido=False))[:limite_antigas + 1]
+        ) if limite_antigas > 0 else []
+        self.tem_proxima = len(antigas) > limite_antigas
+        self.itens = novas + [self.ancora] + antigas[:limite_antigas]
+        return self.itens
+
+    def _link(self, item, direcao):
+        # A partir da página da âncora, os links seguem por cursor
+        link = super()._link(item, direcao)
+        return remove_query_param(link, self.anchor_query_param)
+
+    def get_paginated_response(self, data):
+        resposta = super().get_paginated_response(data)
+        if getattr(self, 'ancora', None) is not None:
+            resposta.data['ancora'] = self.ancora.pk
+        return resposta
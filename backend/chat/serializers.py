@@ -0,0 +1,74 @@
+from datetime import timezone as fuso_utc
+from rest_framework import serializers
+from django.contrib.auth.models import User
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import Conversation, Message
+
+class ParticipanteSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'first_name', 'last_name']
+
+class ConversationInboxSerializer(serializers.ModelSerializer):
+    """Conversa anotada por Conversation.objects.caixa_de_entrada()"""
+    participants = ParticipanteSerializer(many=True, read_only=True)
+    ultima_mensagem = serializers.SerializerMethodField()
+    nao_lidas = serializers.IntegerField(read_only=True)
+    
+    class Meta:
+        model = Conversation
+        fields = ['id', 'name', 'is_group', 'participants', 'created_at', 'updated_at',
+                  'ultima_mensagem', 'nao_lidas']
+    
+    def get_ultima_mensagem(self, obj):
+        mensagem = obj.ultima_mensagem
+        if mensagem is None:
+            return None
+        # O objeto JSON traz a data como texto: com fuso no PostgreSQL, em UTC sem fuso no SQLite
+        data = parse_datetime(mensagem['timestamp'])
+        if timezone.is_naive(data):
+            data = timezone.make_aware(data, fuso_utc.utc)
+        return {**mensagem, 'timestamp': serializers.DateTimeField().to_representation(data)}
+
+class MessageSerializer(serializers.ModelSerializer):
+    """Mensagem completa (detalhe)"""
+    sender_username = serializers.CharField(source='sender.username', read_only=True)
+    
+    class Meta:
+        model = Message
+        fields = ['id', 'conversation', 'sender', 'sender_username', 'content', 'message_type',
+                  'file_url', 'timestamp']
+
+class MessageCreateSerializer(serializers.ModelSerializer):
+    """Mensagem enviada pela API; conversa e remetente vêm da URL e do usuário"""
+    class Meta:
+        model = Message
+        fields = ['content', 'message_type', 'file_url']
+    
+    def validate_message_type(self, valor):
+        if valor == 'system':
+            raise serializers.ValidationError('Mensagens de sistema não podem ser enviadas.')
+        return valor
+
+class MessageHistorySerializer(MessageSerializer):
+    """
+    Mensagem do histórico, anotada por Message.objects.com_previa(): `content`
+    traz só o início das mensagens longas, com `truncada` verdadeiro.
+    """
+    content = serializers.CharField(source='previa', read_only=True)
+    truncada = serializers.SerializerMethodField()
+    
+    class Meta(MessageSerializer.Meta):
+        fields = MessageSerializer.Meta.fields + ['truncada']
+    
+    def get_truncada(self, obj):
+        return obj.tamanho_conteudo > len(obj.previa)
+
+
+class MessageBuscaSerializer(MessageHistorySerializer):
+    """Resultado de Message.objects.buscar(), com a relevância"""
+    relevancia = serializers.FloatField(read_only=True)
+    
+    class Meta(MessageHistorySerializer.Meta):
+        fields = MessageHistorySerializer.Meta.fields + ['relevancia']
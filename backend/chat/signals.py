@@ -0,0 +1,34 @@
+"""
+Sinais do chat: mantém Conversation.updated_at igual à data da última
+mensagem, para a caixa de entrada ordenar e paginar pelo índice da conversa,
+avança o cursor de leitura de quem envia a mensagem e a publica para as
+conexões WebSocket da conversa (chat.tempo_real) após o commit.
+"""
+import logging
+
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from . import tempo_real
+from .models import Conversation, ConversationRead, Message
+
+logger = logging.getLogger(__name__)
+
+
+def _publicar(mensagem):
+    try:
+        tempo_real.publicar_mensagem(mensagem)
+    except Exception:
+        # Entrega em tempo real é melhor esforço: a mensagem já está gravada
+        logger.exception('Falha ao publicar a mensagem %s', mensagem.pk)
+
+
+@receiver(post_save, sender=Message)
+def mensagem_criada(sender, instance, created, **kwargs):
+    if created:
+        Conversation.objects.filter(
+            pk=instance.conversation_id, updated_at__lt=instance.timestamp,
+        ).update(updated_at=instance.timestamp)
+        ConversationRead.objects.marcar_lida(instance.conversation, instance.sender, instance)
+        transaction.on_commit(lambda: _publicar(instance))
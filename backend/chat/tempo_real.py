@@ -0,0 +1,278 @@
+"""
+Entrega do chat em tempo real por WebSocket (/ws/chat/?token=<JWT de acesso>),
+servida direto pelo ASGI em backend/asgi.py.
+
+Cada conexão é uma assinatura do hub de agendamento.eventos nos tópicos
+'conversa:<id>' das conversas do usuário. Mensagens novas (publicadas por
+chat.signals após o commit) e avisos de digitação e presença seguem pelo
+broker de EVENTOS_BROKER, então com o broker Redis chegam a conexões em
+qualquer worker. As publicações feitas no event loop usam
+`apublicar`, que não o bloqueia.
+
+Presença e digitação ficam em dicionários por processo {chave: expira_em}
+(`Expiraveis`), varridos por uma tarefa por event loop (`_manter`,
+cancelada por `encerrar` no desligamento do servidor):
+- presença: usuários com conexão aberta em algum worker. Cada worker
+  republica a presença dos seus usuários a cada meio TTL no tópico
+  'presenca' e espelha esse tópico; quem some sem avisar (worker caído)
+  expira após CHAT_PRESENCA_TTL.
+- digitação: só para limitar os avisos a um por meio CHAT_DIGITANDO_TTL;
+  o cliente apaga o indicador sozinho após o `ttl` do aviso.
+
+Protocolo (objetos JSON com `tipo`):
+  cliente: ping | digitando {conversa} | presentes {conversa}
+           | mensagem {conversa, conteudo, ref}
+  servidor: pronto {conversas} | mensagem {...} | digitando {conversa, usuario, ttl}
+            | presenca {conversa, usuario, online} | presentes {conversa, usuarios}
+            | enviada {ref, id} | erro {detalhe} | pong | ping | ressincronizar
+
+As conversas são lidas na conexão: conversas criadas depois exigem reconectar.
+"""
+import asyncio
+import json
+import math
+import time
+from collections import Counter
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+
+from agendamento import eventos
+from agendamento.autenticacao import CachedJWTAuthentication
+
+from .models import Conversation, Message
+
+TOPICO_PRESENCA = 'presenca'
+
+
+def _json(**dados):
+    return json.dumps(dados, separators=(',', ':'), default=str)
+
+
+class Expiraveis:
+    """Chaves com prazo de validade (relógio monotônico do processo)"""
+
+    def __init__(self, ajuste, padrao):
+        self._ajuste, self._padrao = ajuste, padrao
+        self._itens = {}
+
+    @property
+    def ttl(self):
+        return getattr(settings, self._ajuste, self._padrao)
+
+    def tocar(self, chave, agora):
+        """Renova a chave; True se ela era nova ou já tinha passado da metade do TTL"""
+        anterior = self._itens.get(chave)
+        ttl = self.ttl
+        self._itens[chave] = agora + ttl
+        return anterior is None or anterior - agora < ttl / 2
+
+    def remover(self, chave):
+        return self._itens.pop(chave, None) is not None
+
+    def ativa(self, chave, agora):
+        expira_em = self._itens.get(chave)
+        return expira_em is not None and expira_em > agora
+
+    def varrer(self, agora):
+        vencidas = [chave for chave, expira_em in self._itens.items() if expira_em <= agora]
+        for chave in vencidas:
+            del self._itens[chave]
+        return vencidas
+
+    def __len__(self):
+        return len(self._itens)
+
+
+online = Expiraveis('CHAT_PRESENCA_TTL', 60)
+digitando = Expiraveis('CHAT_DIGITANDO_TTL', 6)
+_conexoes = Counter()  # usuario_id -> conexões abertas neste processo
+_manutencao = {}
+
+
+def publicar_mensagem(mensagem):
+    """
+    Publica uma mensagem nova (chamado por chat.signals após o commit, na
+    thread da view síncrona ou do sync_to_async que gravou a mensagem)
+    """
+    tamanho = getattr(settings, 'CHAT_TAMANHO_PREVIA', 500)
+    eventos.broker().publicar(f'conversa:{mensagem.conversation_id}', _json(
+        tipo='mensagem', id=mensagem.pk, conversation=mensagem.conversation_id,
+        sender=mensagem.sender_id, sender_username=mensagem.sender.username,
+        message_type=mensagem.message_type, file_url=mensagem.file_url,
+        timestamp=mensagem.timestamp.isoformat(), content=mensagem.content[:tamanho],
+        truncada=len(mensagem.content) > tamanho,
+    ))
+
+
+async def _publicar_presenca(usuario_id, conversas, online_agora):
+    destino = eventos.broker()
+    await destino.apublicar(TOPICO_PRESENCA, _json(usuario=usuario_id, online=online_agora))
+    for conversa_id in conversas:
+        await destino.apublicar(f'conversa:{conversa_id}', _json(
+            tipo='presenca', conversa=conversa_id, usuario=usuario_id, online=online_agora,
+        ))
+
+
+async def _manter():
+    """Espelha o tópico de presença, republica a presença local e varre os prazos vencidos"""
+    assinatura = await eventos.assinar({TOPICO_PRESENCA}, duracao=math.inf)
+    proxima_varredura = 0
+    try:
+        while True:
+            intervalo = online.ttl / 2
+            try:
+                mensagem = await asyncio.wait_for(assinatura.fila.get(), intervalo)
+            except asyncio.TimeoutError:
+                mensagem = None
+            agora = time.monotonic()
+            if isinstance(mensagem, str) and mensagem.startswith('{'):
+                dados = json.loads(mensagem)
+                if dados['online']:
+                    online.tocar(dados['usuario'], agora)
+                elif not _conexoes[dados['usuario']]:
+                    online.remover(dados['usuario'])
+            if agora >= proxima_varredura:
+                proxima_varredura = agora + intervalo
+                for usuario_id in list(_conexoes):
+                    await eventos.broker().apublicar(TOPICO_PRESENCA, _json(usuario=usuario_id, online=True))
+                online.varrer(agora)
+                digitando.varrer(agora)
+    finally:
+        eventos.cancelar(assinatura)
+
+
+async def encerrar():
+    """Cancela a manutenção do loop corrente (lifespan.shutdown do servidor ASGI)"""
+    tarefa = _manutencao.pop(asyncio.get_running_loop(), None)
+    if tarefa is not None and not tarefa.done():
+        tarefa.cancel()
+        await asyncio.gather(tarefa, return_exceptions=True)
+
+
+def _autenticar(token):
+    """(usuário, ids das conversas) do token de acesso, ou None"""
+    if not token:
+        return None
+    autenticacao = CachedJWTAuthentication()
+    try:
+        usuario = autenticacao.get_user(autenticacao.get_validated_token(token))
+    except (TokenError, InvalidToken, AuthenticationFailed):
+        return None
+    if not usuario.is_active:
+        return None
+    conversas = set(Conversation.objects.do_usuario(usuario).values_list('pk', flat=True))
+    return usuario, conversas
+
+
+def _criar_mensagem(usuario, conversa_id, conteudo):
+    return Message.objects.create(conversation_id=conversa_id, sender=usuario, content=conteudo).pk
+
+
+def _presentes(conversa_id):
+    agora = time.monotonic()
+    participantes = Conversation.participants.through.objects.filter(conversation_id=conversa_id)
+    return [
+        usuario_id for usuario_id in participantes.values_list('user_id', flat=True)
+        if online.ativa(usuario_id, agora)
+    ]
+
+
+async def _tratar(quadro, usuario, conversas, responder):
+    try:
+        dados = json.loads(quadro)
+        tipo = dados['tipo']
+        conversa_id = dados.get('conversa')
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return responder(_json(tipo='erro', detalhe='Quadro inválido'))
+
+    if tipo == 'ping':
+        return responder(_json(tipo='pong'))
+    if tipo not in ('digitando', 'presentes', 'mensagem'):
+        return responder(_json(tipo='erro', detalhe=f'Tipo desconhecido: {tipo}'))
+    if not isinstance(conversa_id, int) or conversa_id not in conversas:
+        return responder(_json(tipo='erro', detalhe='Conversa inválida', conversa=conversa_id))
+
+    if tipo == 'digitando':
+        if digitando.tocar((conversa_id, usuario.pk), time.monotonic()):
+            await eventos.broker().apublicar(f'conversa:{conversa_id}', _json(
+                tipo='digitando', conversa=conversa_id, usuario=usuario.pk, ttl=digitando.ttl,
+            ))
+    elif tipo == 'presentes':
+        usuarios = await sync_to_async(_presentes)(conversa_id)
+        responder(_json(tipo='presentes', conversa=conversa_id, usuarios=usuarios))
+    else:
+        conteudo = dados.get('conteudo')
+        if not isinstance(conteudo, str) or not conteudo.strip():
+            return responder(_json(tipo='erro', detalhe='Mensagem vazia', ref=dados.get('ref')))
+        digitando.remover((conversa_id, usuario.pk))
+        mensagem_id = await sync_to_async(_criar_mensagem)(usuario, conversa_id, conteudo)
+        responder(_json(tipo='enviada', ref=dados.get('ref'), id=mensagem_id))
+
+
+async def _ler(receive, usuario, conversas, responder):
+    while True:
+        evento = await receive()
+        if evento['type'] == 'websocket.disconnect':
+            return
+        quadro = evento.get('text')
+        if quadro is None and evento.get('bytes') is not None:
+            quadro = evento['bytes'].decode('utf-8', 'replace')
+        await _tratar(quadro, usuario, conversas, responder)
+
+
+async def _escrever(fila, send):
+    ping, ressincronizar = _json(tipo='ping'), _json(tipo='ressincronizar')
+    while True:
+        mensagem = await fila.get()
+        if mensagem is eventos.FIM:
+            return
+        if mensagem is eventos.PING:
+            # Mantém a conexão viva em proxies que derrubam WebSockets ociosos
+            mensagem = ping
+        elif mensagem is eventos.RESSINCRONIZAR:
+            mensagem = ressincronizar
+        await send({'type': 'websocket.send', 'text': mensagem})
+
+
+async def conexao_chat(scope, receive, send):
+    """Aplicação ASGI de uma conexão WebSocket do chat"""
+    evento = await receive()
+    if evento['type'] != 'websocket.connect':
+        return
+    token = parse_qs(scope.get('query_string', b'').decode()).get('token', [None])[0]
+    sessao = await sync_to_async(_autenticar)(token)
+    if sessao is None:
+        await send({'type': 'websocket.close', 'code': 4401})
+        return
+    usuario, conversas = sessao
+    await send({'type': 'websocket.accept'})
+
+    loop = asyncio.get_running_loop()
+    if loop not in _manutencao or _manutencao[loop].done():
+        _manutencao[loop] = loop.create_task(_manter())
+    assinatura = await eventos.assinar({f'conversa:{conversa_id}' for conversa_id in conversas}, duracao=math.inf)
+    _conexoes[usuario.pk] += 1
+    online.tocar(usuario.pk, time.monotonic())
+    if _conexoes[usuario.pk] == 1:
+        await _publicar_presenca(usuario.pk, conversas, True)
+
+    assinatura.entregar(_json(tipo='pronto', usuario=usuario.pk, conversas=sorted(conversas)))
+    tarefas = [
+        asyncio.ensure_future(_ler(receive, usuario, conversas, assinatura.entregar)),
+        asyncio.ensure_future(_escrever(assinatura.fila, send)),
+    ]
+    try:
+        await asyncio.wait(tarefas, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for tarefa in tarefas:
+            tarefa.cancel()
+        eventos.cancelar(assinatura)
+        _conexoes[usuario.pk] -= 1
+        if not _conexoes[usuario.pk]:
+            del _conexoes[usuario.pk]
+            online.remover(usuario.pk)
+            await _publicar_presenca(usuario.pk, conversas, False)
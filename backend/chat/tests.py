@@ -0,0 +1,288 @@
+import asyncio
+import importlib
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.migrations.loader import MigrationLoader
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from agendamento import eventos
+
+from . import tempo_real
+from .models import Conversation, ConversationRead, Message
+
+
+class ChatBaseTestCase(TestCase):
+    client_class = APIClient
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ana = User.objects.create_user('ana')
+        cls.bruno = User.objects.create_user('bruno')
+
+    def setUp(self):
+        self.client.force_authenticate(self.ana)
+
+    def conversa(self, *participantes, **extra):
+        conversa = Conversation.objects.create(**extra)
+        conversa.participants.set(participantes or (self.ana, self.bruno))
+        return conversa
+
+    def enviar(self, conversa, remetente, conteudo='Olá', quantidade=1):
+        mensagens = [
+            Message.objects.create(conversation=conversa, sender=remetente, content=f'{conteudo} {n}')
+            for n in range(quantidade)
+        ]
+        return mensagens[-1]
+
+
+class NumeroDeConsultasTestCase(ChatBaseTestCase):
+    """Caixa de entrada, histórico e busca com número fixo de consultas"""
+
+    def setUp(self):
+        super().setUp()
+        self.principal = self.popular(2)
+
+    def popular(self, quantidade):
+        primeira = None
+        for _ in range(quantidade):
+            convidado = User.objects.create_user(f'usuario{User.objects.count()}')
+            conversa = self.conversa(self.ana, self.bruno, convidado, is_group=True)
+            for remetente in (self.bruno, convidado, self.ana):
+                self.enviar(conversa, remetente, 'Reunião de planejamento', quantidade=2)
+            primeira = primeira or conversa
+        return primeira
+
+    def assertConsultasFixas(self, esperado, url, params=None):
+        """`esperado` consultas agora e depois de multiplicar conversas e mensagens"""
+        for _ in range(2):
+            with self.assertNumQueries(esperado):
+                resposta = self.client.get(url, params or {})
+            self.assertEqual(resposta.status_code, 200)
+            self.popular(5)
+            self.enviar(self.principal, self.bruno, 'Reunião de planejamento', quantidade=10)
+
+    def test_caixa_de_entrada(self):
+        self.assertConsultasFixas(2, '/api/chat/conversas/')
+
+    def test_historico(self):
+        self.assertConsultasFixas(2, f'/api/chat/conversas/{self.principal.pk}/mensagens/')
+
+    def test_busca(self):
+        self.assertConsultasFixas(2, '/api/chat/mensagens/busca/', {'q': 'planejamento'})
+
+
+class NaoLidasTestCase(ChatBaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.conversa_ = self.conversa()
+        self.mensagens = [self.enviar(self.conversa_, self.bruno, f'Mensagem {n}') for n in range(3)]
+        self.enviar(self.conversa_, self.ana, 'Minha')
+
+    def nao_lidas(self):
+        resposta = self.client.get('/api/chat/conversas/')
+        return {conversa['id']: conversa['nao_lidas'] for conversa in resposta.json()['results']}[self.conversa_.pk]
+
+    def ler(self, mensagem=None):
+        dados = {} if mensagem is None else {'mensagem': mensagem.pk}
+        return self.client.post(f'/api/chat/conversas/{self.conversa_.pk}/ler/', dados, format='json')
+
+    def test_ler_ate_uma_mensagem_e_ate_a_ultima(self):
+        # Enviar uma mensagem avança o cursor de quem envia: as anteriores ficam lidas
+        self.assertEqual(self.nao_lidas(), 0)
+        novas = [self.enviar(self.conversa_, self.bruno, f'Nova {n}') for n in range(3)]
+        self.assertEqual(self.nao_lidas(), 3)
+        self.assertEqual(self.ler(novas[0]).status_code, 204)
+        self.assertEqual(self.nao_lidas(), 2)
+        self.assertEqual(self.ler().status_code, 204)
+        self.assertEqual(self.nao_lidas(), 0)
+
+    def test_cursor_nao_recua(self):
+        self.enviar(self.conversa_, self.bruno, 'Nova', quantidade=2)
+        self.ler()
+        self.assertEqual(self.ler(self.mensagens[0]).status_code, 204)
+        self.assertEqual(self.nao_lidas(), 0)
+
+    def test_mensagem_de_outra_conversa(self):
+        outra = self.enviar(self.conversa(self.bruno, User.objects.create_user('carla')), self.bruno)
+        self.assertEqual(self.ler(outra).status_code, 400)
+
+
+class ConversaDeOutrosTestCase(ChatBaseTestCase):
+    def test_conversa_sem_o_usuario_responde_404(self):
+        carla = User.objects.create_user('carla')
+        alheia = self.conversa(self.bruno, carla)
+        mensagem = self.enviar(alheia, carla)
+        self.assertEqual(self.client.get(f'/api/chat/conversas/{alheia.pk}/').status_code, 404)
+        self.assertEqual(self.client.get(f'/api/chat/conversas/{alheia.pk}/mensagens/').status_code, 404)
+        self.assertEqual(self.client.post(f'/api/chat/conversas/{alheia.pk}/ler/').status_code, 404)
+        self.assertEqual(self.client.get(f'/api/chat/mensagens/{mensagem.pk}/').status_code, 404)
+        self.assertEqual(self.client.get('/api/chat/conversas/').json()['results'], [])
+
+
+class HistoricoTestCase(ChatBaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.conversa_ = self.conversa()
+        self.mensagens = [self.enviar(self.conversa_, self.bruno, f'Mensagem {n}') for n in range(7)]
+        self.url = f'/api/chat/conversas/{self.conversa_.pk}/mensagens/'
+
+    def ids(self, resposta):
+        return [mensagem['id'] for mensagem in resposta.json()['results']]
+
+    def esperados(self, *indices):
+        return [self.mensagens[indice].pk for indice in indices]
+
+    def test_next_e_previous(self):
+        primeira = self.client.get(self.url, {'page_size': 3})
+        self.assertEqual(self.ids(primeira), self.esperados(6, 5, 4))
+        self.assertIsNone(primeira.json()['previous'])
+
+        segunda = self.client.get(primeira.json()['next'])
+        self.assertEqual(self.ids(segunda), self.esperados(3, 2, 1))
+        terceira = self.client.get(segunda.json()['next'])
+        self.assertEqual(self.ids(terceira), self.esperados(0))
+        self.assertIsNone(terceira.json()['next'])
+
+        de_volta = self.client.get(terceira.json()['previous'])
+        self.assertEqual(self.ids(de_volta), self.esperados(3, 2, 1))
+        self.assertEqual(self.ids(self.client.get(de_volta.json()['previous'])), self.esperados(6, 5, 4))
+
+    def test_mensagem_nova_nao_desloca_a_proxima_pagina(self):
+        primeira = self.client.get(self.url, {'page_size': 3})
+        self.enviar(self.conversa_, self.bruno, 'Depois')
+        self.assertEqual(self.ids(self.client.get(primeira.json()['next'])), self.esperados(3, 2, 1))
+
+    @override_settings(CHAT_TAMANHO_PREVIA=20)
+    def test_ancora_no_meio_da_pagina(self):
+        ancora = self.mensagens[3]
+        Message.objects.filter(pk=ancora.pk).update(content='Citada ' + 'x' * 100)
+        resposta = self.client.get(self.url, {'ancora': ancora.pk, 'page_size': 5})
+        dados = resposta.json()
+        self.assertEqual(self.ids(resposta), self.esperados(5, 4, 3, 2, 1))
+        self.assertEqual(dados['ancora'], ancora.pk)
+        no_meio = dados['results'][2]
+        self.assertEqual((no_meio['content'], no_meio['truncada']), ('Citada ' + 'x' * 13, True))
+        self.assertFalse(dados['results'][1]['truncada'])
+        self.assertNotIn('ancora=', dados['next'])
+        self.assertEqual(self.ids(self.client.get(dados['next'])), self.esperados(0))
+        self.assertEqual(self.ids(self.client.get(dados['previous'])), self.esperados(6))
+        self.assertEqual(self.client.get(f'/api/chat/mensagens/{ancora.pk}/').json()['content'], 'Citada ' + 'x' * 100)
+
+    def test_ancora_de_outra_conversa(self):
+        outra = self.enviar(self.conversa(), self.bruno)
+        self.assertEqual(self.client.get(self.url, {'ancora': outra.pk}).status_code, 404)
+
+
+class MigracaoLeiturasTestCase(TransactionTestCase):
+    """0003: read_by (uma linha por mensagem lida) vira um cursor por participante"""
+
+    MIGRACAO = ('chat', '0003_conversationread_remove_message_read_by')
+
+    def setUp(self):
+        migracao = importlib.import_module(f'chat.migrations.{self.MIGRACAO[1]}')
+        # Estado logo antes do RunPython: ConversationRead já existe e read_by ainda não foi removido
+        estado = MigrationLoader(connection).project_state(('chat', '0002_message_chat_msg_conversa_data_idx'))
+        for operacao in migracao.Migration.operations[:2]:
+            operacao.state_forwards('chat', estado)
+        self.apps = estado.apps
+        self.copiar_leituras = migracao.copiar_leituras
+        self.lidas = self.apps.get_model('chat', 'Message').read_by.through
+        with connection.schema_editor() as editor:
+            editor.create_model(self.lidas)
+
+    def tearDown(self):
+        with connection.schema_editor() as editor:
+            editor.delete_model(self.lidas)
+
+    def test_copia_a_ultima_mensagem_lida_de_cada_participante(self):
+        ana, bruno, carla, davi = (User.objects.create_user(nome) for nome in ('ana', 'bruno', 'carla', 'davi'))
+        conversa = Conversation.objects.create()
+        conversa.participants.set([ana, bruno, carla, davi])
+        inicio = timezone.now() - timedelta(hours=1)
+        # bulk_create: sem os sinais, que já criariam cursores
+        mensagens = Message.objects.bulk_create(
+            Message(conversation=conversa, sender=davi, content=f'Mensagem {n}') for n in range(3)
+        )
+        for n, mensagem in enumerate(mensagens):
+            Message.objects.filter(pk=mensagem.pk).update(timestamp=inicio + timedelta(minutes=n))
+        self.lidas.objects.bulk_create([
+            self.lidas(message_id=mensagens[0].pk, user_id=ana.pk),
+            self.lidas(message_id=mensagens[1].pk, user_id=ana.pk),
+            self.lidas(message_id=mensagens[2].pk, user_id=carla.pk),
+        ])
+
+        with connection.schema_editor() as editor:
+            self.copiar_leituras(self.apps, editor)
+
+        cursores = dict(ConversationRead.objects.values_list('user__username', 'last_read_id'))
+        self.assertEqual(cursores, {'ana': mensagens[1].pk, 'carla': mensagens[2].pk})
+        nao_lidas = {
+            usuario.username: Conversation.objects.caixa_de_entrada(usuario).get().nao_lidas
+            for usuario in (ana, bruno, carla)
+        }
+        self.assertEqual(nao_lidas, {'ana': 1, 'bruno': 3, 'carla': 0})
+
+
+class EnvioPelaApiTestCase(ChatBaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.conversa_ = self.conversa()
+        self.url = f'/api/chat/conversas/{self.conversa_.pk}/mensagens/'
+
+    def test_mensagem_criada_e_publicada_apos_o_commit(self):
+        with mock.patch.object(tempo_real, 'publicar_mensagem') as publicar_mensagem:
+            with self.captureOnCommitCallbacks(execute=True):
+                resposta = self.client.post(self.url, {'content': 'Bom dia'}, format='json')
+        self.assertEqual(resposta.status_code, 201)
+        dados = resposta.json()
+        self.assertEqual(
+            (dados['conversation'], dados['sender'], dados['content'], dados['message_type']),
+            (self.conversa_.pk, self.ana.pk, 'Bom dia', 'text'),
+        )
+        (mensagem,), _ = publicar_mensagem.call_args
+        self.assertEqual(mensagem.pk, dados['id'])
+        self.client.force_authenticate(self.bruno)
+        self.assertEqual(self.client.get('/api/chat/conversas/').json()['results'][0]['nao_lidas'], 1)
+
+    def test_dados_invalidos(self):
+        self.assertEqual(self.client.post(self.url, {'content': ''}, format='json').status_code, 400)
+        resposta = self.client.post(self.url, {'content': 'Oi', 'message_type': 'system'}, format='json')
+        self.assertEqual(resposta.status_code, 400)
+        self.assertFalse(Message.objects.exists())
+
+    def test_conversa_de_outros(self):
+        alheia = self.conversa(self.bruno, User.objects.create_user('carla'))
+        resposta = self.client.post(f'/api/chat/conversas/{alheia.pk}/mensagens/', {'content': 'Oi'}, format='json')
+        self.assertEqual(resposta.status_code, 404)
+
+
+class DesligamentoTestCase(SimpleTestCase):
+    async def test_lifespan_cancela_as_tarefas_de_fundo(self):
+        from backend.asgi import application
+
+        loop = asyncio.get_running_loop()
+        tempo_real._manutencao[loop] = manter = loop.create_task(tempo_real._manter())
+        while loop not in eventos._pulsos:  # _manter assina o tópico de presença e inicia o heartbeat
+            await asyncio.sleep(0)
+        pulso = eventos._pulsos[loop]
+        recebidos = iter([{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}])
+        enviados = []
+
+        async def receive():
+            return next(recebidos)
+
+        async def send(mensagem):
+            enviados.append(mensagem['type'])
+
+        await application({'type': 'lifespan'}, receive, send)
+        self.assertEqual(enviados, ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+        self.assertTrue(manter.cancelled())
+        self.assertTrue(pulso.done())
+        self.assertNotIn(loop, tempo_real._manutencao)
+        self.assertNotIn(loop, eventos._pulsos)
+        self.assertEqual(eventos.hub.total(), 0)
@@ -0,0 +1,11 @@
+from django.urls import path, include
+from rest_framework.routers import DefaultRouter
+from . import views
+
+router = DefaultRouter()
+router.register(r'conversas', views.ConversationViewSet, basename='conversa')
+router.register(r'mensagens', views.MessageViewSet, basename='mensagem')
+
+urlpatterns = [
+    path('', include(router.urls)),
+]
@@ -0,0 +1,106 @@
+from rest_framework import mixins, viewsets, status, permissions
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from django.contrib.auth.models import User
+from django.conf import settings
+from django.db.models import Prefetch
+from django.shortcuts import get_object_or_404
+from agendamento.paginacao import BuscaPagination
+from .models import Conversation, ConversationRead, Message
+from .paginacao import ConversationPagination, MessagePagination
+from .serializers import (
+    ConversationInboxSerializer, MessageBuscaSerializer, MessageCreateSerializer, MessageHistorySerializer,
+    MessageSerializer,
+)
+
+class ConversationViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Caixa de entrada: conversas do usuário, da mais recente para a mais
+    antiga, com a última mensagem e o total de não lidas. Uma consulta para
+    a página e outra para os participantes, independente do número de
+    conversas e de mensagens.
+    """
+    serializer_class = ConversationInboxSerializer
+    pagination_class = ConversationPagination
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get_queryset(self):
+        participantes = User.objects.only('id', 'username', 'first_name', 'last_name')
+        return Conversation.objects.caixa_de_entrada(self.request.user).prefetch_related(
+            Prefetch('participants', queryset=participantes)
+        )
+    
+    @action(detail=True, methods=['post'])
+    def ler(self, request, pk=None):
+        """
+        Marca a conversa como lida até a mensagem `mensagem` (id) ou, sem
+        ela, até a última. O cursor de leitura só avança.
+        """
+        conversa = get_object_or_404(Conversation.objects.do_usuario(request.user), pk=pk)
+        mensagem = None
+        if request.data.get('mensagem') is not None:
+            try:
+                mensagem = conversa.messages.only('id', 'timestamp').get(pk=int(request.data['mensagem']))
+            except (ValueError, TypeError, conversa.messages.model.DoesNotExist):
+                return Response({'error': 'mensagem deve ser o id de uma mensagem da conversa'},
+                              status=status.HTTP_400_BAD_REQUEST)
+        ConversationRead.objects.marcar_lida(conversa, request.user, mensagem)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    
+    @action(detail=True, methods=['get', 'post'])
+    def mensagens(self, request, pk=None):
+        """
+        GET: histórico da conversa, da mais nova para a mais antiga, paginado
+        por cursor (`next`: mais antigas, `previous`: mais novas) ou aberto em
+        volta de uma mensagem com `?ancora=<id>`. Mensagens longas vêm
+        truncadas em CHAT_TAMANHO_PREVIA caracteres (ver /api/chat/mensagens/<id>/).
+        
+        POST: envia uma mensagem (content, message_type, file_url), entregue
+        após o commit às conexões WebSocket da conversa (chat.signals).
+        """
+        conversa = get_object_or_404(Conversation.objects.do_usuario(request.user), pk=pk)
+        if request.method == 'POST':
+            serializer = MessageCreateSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            mensagem = serializer.save(conversation=conversa, sender=request.user)
+            return Response(MessageSerializer(mensagem).data, status=status.HTTP_201_CREATED)
+        mensagens = Message.objects.filter(conversation=conversa).select_related('sender').only(
+            'id', 'conversation_id', 'message_type', 'file_url', 'timestamp', 'sender__username',
+        ).com_previa(settings.CHAT_TAMANHO_PREVIA)
+        paginador = MessagePagination()
+        pagina = paginador.paginate_queryset(mensagens, request, view=self)
+        return paginador.get_paginated_response(MessageHistorySerializer(pagina, many=True).data)
+
+class MessageViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """Mensagens das conversas do usuário; o histórico paginado fica em conversas/<id>/mensagens/"""
+    serializer_class = MessageSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get_queryset(self):
+        return Message.objects.filter(conversation__participants=self.request.user).select_related('sender')
+    
+    @action(detail=False, methods=['get'], pagination_class=BuscaPagination)
+    def busca(self, request):
+        """
+        Busca textual nas mensagens das conversas do usuário (?q=, opcional
+        ?conversa=<id>), das mais relevantes para as menos, truncadas como no
+        histórico. Paginada por número de página (?page=N).
+        """
+        texto = request.query_params.get('q', '').strip()
+        conversa = request.query_params.get('conversa')
+        if not texto:
+            return Response({'error': 'Informe o texto da busca no parâmetro q'},
+                          status=status.HTTP_400_BAD_REQUEST)
+        if conversa is not None and not conversa.isdigit():
+            return Response({'error': 'conversa deve ser o id de uma conversa'},
+                          status=status.HTTP_400_BAD_REQUEST)
+        # Pertinência como subconsulta, não junção: o índice textual conduz a consulta
+        participacoes = Conversation.participants.through.objects.filter(user=request.user)
+        mensagens = Message.objects.filter(conversation__in=participacoes.values('conversation_id'))
+        if conversa is not None:
+            mensagens = mensagens.filter(conversation_id=conversa)
+        mensagens = mensagens.buscar(texto).select_related('sender').only(
+            'id', 'conversation_id', 'message_type', 'file_url', 'timestamp', 'sender__username',
+        ).com_previa(settings.CHAT_TAMANHO_PREVIA)
+        pagina = self.paginate_queryset(mensagens)
+        return self.get_paginated_response(MessageBuscaSerializer(pagina, many=True).data)